@@ -1,12 +1,15 @@
-import os, sys, json, time, random, urllib.parse, uuid, asyncio, traceback, pathlib, signal, re
+import os, sys, io, gzip, json, time, random, shutil, hashlib, tempfile, sqlite3, bisect, threading, multiprocessing, queue, atexit, contextvars, urllib.parse, uuid, asyncio, traceback, pathlib, signal, re, contextlib
+from collections import deque
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple, Union
 from types import SimpleNamespace
 
 import boto3
 import requests
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
+from botocore.exceptions import ClientError
 from playwright.async_api import Page, expect, Browser, BrowserContext
 from camoufox.async_api import AsyncCamoufox
 from camoufox import DefaultAddons
@@ -18,6 +21,12 @@ from camoufox import DefaultAddons
 # Cfx Vars
 CFX_USERNAME = os.getenv("CFX_USERNAME")
 CFX_PASSWORD = os.getenv("CFX_PASSWORD")
+CFX_PORTAL_URL = os.getenv("CFX_PORTAL_URL", "https://portal.cfx.re").rstrip("/")  # overridden by bench.py's fake portal
+# Several accounts: JSON list of {"name","username","password","proxy_server","proxy_username",
+# "proxy_password","os","locale"}; replaces CFX_USERNAME/CFX_PASSWORD, missing keys fall back to the globals
+CFX_ACCOUNTS = os.getenv("CFX_ACCOUNTS", "").strip()
+ACCOUNT_FENCE_AFTER = int(os.getenv("ACCOUNT_FENCE_AFTER", "3"))          # consecutive login failures before fencing
+ACCOUNT_FENCE_SECONDS = float(os.getenv("ACCOUNT_FENCE_SECONDS", "900"))  # how long a fenced account gets no work
 
 # Proxy Vars
 PROXY_SERVER   = os.getenv("PROXY_SERVER")
@@ -37,22 +46,148 @@ DEBUG = os.getenv("DEBUG", "1") == "1"
 DEBUG_BUCKET = os.getenv("S3_BUCKET")  # defaulted in code below
 DEBUG_PREFIX = os.getenv("DEBUG_PREFIX", "debug/")
 DEBUG_UPLOAD_ON_SUCCESS = os.getenv("DEBUG_UPLOAD_ON_SUCCESS", "0") == "1"
+# Failure artifacts: captured into memory while the page is leased, uploaded in the background
+ARTIFACT_SAMPLE_FIRST = int(os.getenv("ARTIFACT_SAMPLE_FIRST", "3"))      # always keep the first N per error signature
+ARTIFACT_SAMPLE_RATE = float(os.getenv("ARTIFACT_SAMPLE_RATE", "0.1"))    # then keep this fraction of them
+ARTIFACT_BUDGET_MB = float(os.getenv("ARTIFACT_BUDGET_MB", "200"))         # uploaded per rolling hour, 0 = unlimited
+ARTIFACT_QUEUE_MAX = int(os.getenv("ARTIFACT_QUEUE_MAX", "50"))            # pending captures before new ones are dropped
+ARTIFACT_FULL_PAGE = os.getenv("ARTIFACT_FULL_PAGE", "0") == "1"           # full-page screenshot instead of the viewport
+ARTIFACT_TRACES = os.getenv("ARTIFACT_TRACES", "0") == "1"                 # Playwright trace zip per failed record
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1") == "1"                  # format/write log lines on a background thread
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))         # buffered lines before new ones are dropped
+LOG_BATCH_MAX = int(os.getenv("LOG_BATCH_MAX", "256"))           # lines per write + flush
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "50"))        # lines/s per message below WARNING, 0 = unlimited
+LOG_SAMPLE = {                                                   # message=rate, applied below WARNING
+    k.strip(): float(v) for k, v in
+    (item.split("=", 1) for item in os.getenv("LOG_SAMPLE", "page.console=0.1").split(",") if "=" in item)
+}
 
 # Misc. Vars
-MAX_PARALLEL = 1  # Always force to 1 for persistent browser
+MAX_PARALLEL = max(1, int(os.getenv("MAX_PARALLEL", "1")))  # Leased contexts/pages in each account's browser
 DISABLE_HUMAN_DELAYS = os.getenv("DISABLE_HUMAN_DELAYS", "0") == "1"  # New: option to disable delays
 BROWSER_RESTART_AFTER = int(os.getenv("BROWSER_RESTART_AFTER", "50"))  # Restart browser after N requests
+BROWSER_RETIRE_AFTER = int(os.getenv("BROWSER_RETIRE_AFTER", str(BROWSER_RESTART_AFTER * MAX_PARALLEL)))  # leases per browser process, 0 = never
+HOT_SPARE = os.getenv("HOT_SPARE", "0") == "1"                      # warm a standby browser before retiring the active one
+HOT_SPARE_WARM_AT = float(os.getenv("HOT_SPARE_WARM_AT", "0.8"))    # fraction of the retire budget that starts warming
+
+# Resource-aware recycling (0 = check disabled); sampled from /proc for the browser's process tree
+BROWSER_MAX_RSS_MB = int(os.getenv("BROWSER_MAX_RSS_MB", "0"))
+BROWSER_MAX_FDS = int(os.getenv("BROWSER_MAX_FDS", "0"))
+BROWSER_MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", "0"))
+BROWSER_LATENCY_DRIFT = float(os.getenv("BROWSER_LATENCY_DRIFT", "2.0"))    # retire when probe p95 >= baseline p95 x this
+BROWSER_LATENCY_WINDOW = int(os.getenv("BROWSER_LATENCY_WINDOW", "20"))     # probes per p95 window (first window = baseline)
+BROWSER_STATS_INTERVAL = float(os.getenv("BROWSER_STATS_INTERVAL", "30"))  # seconds between samples
+
+# Session state cache (cookies + localStorage of a logged-in context)
+SESSION_STATE_ENABLED = os.getenv("SESSION_STATE_ENABLED", "1") == "1"
+SESSION_STATE_PATH = Path(os.getenv("SESSION_STATE_PATH", "/tmp/cfx_storage_state.json"))
+SESSION_STATE_TTL = int(os.getenv("SESSION_STATE_TTL", "21600"))           # seconds before a saved session is ignored
+SESSION_STATE_S3 = os.getenv("SESSION_STATE_S3", "0") == "1"               # also sync to the debug bucket
+SESSION_STATE_S3_KEY = os.getenv("SESSION_STATE_S3_KEY", "session/storage_state.json")  # under DEBUG_PREFIX
+
+# Route filter Vars: drop resources the upload/download flow never needs
+ROUTE_FILTER = os.getenv("ROUTE_FILTER", "1") == "1"
+ROUTE_BLOCK_TYPES = {v.strip() for v in os.getenv("ROUTE_BLOCK_TYPES", "image,media,font").split(",") if v.strip()}
+ROUTE_BLOCK_HOSTS = [v.strip().lower() for v in os.getenv(
+    "ROUTE_BLOCK_HOSTS",
+    "google-analytics.com,googletagmanager.com,doubleclick.net,hotjar.com,facebook.net,clarity.ms,segment.io,ingest.sentry.io",
+).split(",") if v.strip()]
+ROUTE_ALLOW_PATTERN = os.getenv("ROUTE_ALLOW_PATTERN", r"captcha|challenge|turnstile|sign-in|login")  # never blocked
+
+# Transfer Vars
+STREAM_IO = os.getenv("STREAM_IO", "0") == "1"  # small inputs stay in memory; downloads are renamed, not copied (still uploaded from disk)
+STREAM_MEMORY_MAX_BYTES = int(os.getenv("STREAM_MEMORY_MAX_BYTES", str(32 * 1024 * 1024)))  # larger inputs go to /tmp
+S3_PART_SIZE_MB = int(os.getenv("S3_PART_SIZE_MB", "16"))        # multipart threshold and part size
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "8"))   # parallel parts per transfer
+
+# Asset readiness Vars (portal XHR/fetch traffic first, adaptive DOM polling as fallback)
+ASSET_API_PATTERN = os.getenv("ASSET_API_PATTERN", r"/api/.*asset")       # regex for asset-list responses
+ASSET_READY_STATUSES = {v.strip().lower() for v in os.getenv("ASSET_READY_STATUSES", "active,ready,processed,completed").split(",") if v.strip()}
+ASSET_FAILED_STATUSES = {v.strip().lower() for v in os.getenv("ASSET_FAILED_STATUSES", "failed,error,rejected").split(",") if v.strip()}
+ASSET_READY_TIMEOUT = int(os.getenv("ASSET_READY_TIMEOUT", "210"))        # seconds from list page to downloadable
+ASSET_POLL_MAX_INTERVAL = float(os.getenv("ASSET_POLL_MAX_INTERVAL", "8"))  # cap for the DOM poll backoff
+ASSET_SEARCH_PARAM = os.getenv("ASSET_SEARCH_PARAM", "")                   # created-assets filter query param (e.g. "search"); off until confirmed on the live portal
+ASSET_LIST_URL = os.getenv("ASSET_LIST_URL", "")                           # optional list API, e.g. /api/assets?search={query}&page={page}
+ASSET_LIST_MAX_PAGES = int(os.getenv("ASSET_LIST_MAX_PAGES", "5"))         # pages fetched per list API poll
+
+# Idempotency ledger Vars (drops S3/SQS duplicates before they reach the browser)
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "none").lower()   # none | sqlite | s3
+IDEMPOTENCY_SQLITE_PATH = os.getenv("IDEMPOTENCY_SQLITE_PATH", "/tmp/cfx_idempotency.sqlite3")
+IDEMPOTENCY_PREFIX = os.getenv("IDEMPOTENCY_PREFIX", "idempotency/")      # s3 backend, in S3_BUCKET (or the record's bucket)
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "1800"))  # in-progress claim; keep above worst-case runtime
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(7 * 24 * 3600)))  # completed entries older than this are forgotten
+
+# Housekeeping Vars: prune assets this service created once their output is in S3 (SQS mode, idle gaps only)
+HOUSEKEEPING = os.getenv("HOUSEKEEPING", "0") == "1"
+HOUSEKEEPING_DRY_RUN = os.getenv("HOUSEKEEPING_DRY_RUN", "0") == "1"                 # log what would be pruned, touch nothing
+HOUSEKEEPING_SQLITE_PATH = os.getenv("HOUSEKEEPING_SQLITE_PATH", "/tmp/cfx_assets.sqlite3")
+HOUSEKEEPING_IDLE_SECONDS = float(os.getenv("HOUSEKEEPING_IDLE_SECONDS", "60"))     # pipeline idle this long before a pass
+HOUSEKEEPING_MIN_AGE = float(os.getenv("HOUSEKEEPING_MIN_AGE", "3600"))             # keep assets at least this long
+HOUSEKEEPING_BATCH = int(os.getenv("HOUSEKEEPING_BATCH", "5"))                      # assets per pass
+HOUSEKEEPING_RATE = float(os.getenv("HOUSEKEEPING_RATE", "6"))                      # assets per minute, at most
+HOUSEKEEPING_ACTION_SELECTOR = os.getenv("HOUSEKEEPING_ACTION_SELECTOR", '[data-sentry-component="DeleteButton"]')  # in the asset row
+HOUSEKEEPING_CONFIRM_BUTTON = os.getenv("HOUSEKEEPING_CONFIRM_BUTTON", "Delete")    # confirm dialog button, "" = none
+
+# Result cache Vars (sha256 of input -> previously processed output)
+RESULT_CACHE = os.getenv("RESULT_CACHE", "0") == "1"
+RESULT_CACHE_PREFIX = os.getenv("RESULT_CACHE_PREFIX", "cache/")            # index objects live here in S3_BUCKET
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))   # seconds before an entry is evicted
+
+# Pipeline Vars (download -> browser -> publish stages)
+PIPELINE_PREFETCH = int(os.getenv("PIPELINE_PREFETCH", "2"))                # inputs downloaded ahead of a free browser slot
+PIPELINE_DOWNLOAD_WORKERS = int(os.getenv("PIPELINE_DOWNLOAD_WORKERS", "2"))
+PIPELINE_PUBLISH_WORKERS = int(os.getenv("PIPELINE_PUBLISH_WORKERS", "2"))
+PIPELINE_PUBLISH_QUEUE = int(os.getenv("PIPELINE_PUBLISH_QUEUE", "8"))      # finished outputs waiting to upload
+
+# Batch Vars: upload up to N prefetched records back to back in one slot, then harvest them together
+BATCH_UPLOAD_MAX = int(os.getenv("BATCH_UPLOAD_MAX", "1"))  # 1 = off; keep PIPELINE_PREFETCH >= this
+
+# Metrics: Prometheus text format at /metrics (FastAPI) or on a sidecar listener in SQS mode
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # SQS-mode sidecar, 0 = off
+
+# Tracing: one OTLP/JSON line per record trace (summarise with trace_summary.py), empty = off
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "cfx-courier")
+
+# Worker processes: >1 runs a supervisor front (SQS polling or FastAPI) feeding N browser worker processes
+WORKER_PROCESSES = max(1, int(os.getenv("WORKER_PROCESSES", "1")))
+WORKER_PROXY_SERVERS = [v.strip() for v in os.getenv("WORKER_PROXY_SERVERS", "").split(",") if v.strip()]  # per-worker PROXY_SERVER
+WORKER_RESTART_BACKOFF = float(os.getenv("WORKER_RESTART_BACKOFF", "5"))  # seconds before respawning a crashed worker
+WORKER_INDEX = os.getenv("WORKER_INDEX")  # set inside worker processes
 
 # Runtime mode:
 #  - "http": FastAPI server (ECS behind ALB; also easy local testing)
 #  - "sqs" : FIFO SQS worker (long-poll queue, no HTTP)
 MODE = os.getenv("MODE", "http").lower()
 
+# Lambda runtime: one event loop (and so one warm browser pool) for the life of the execution environment
+LAMBDA_PERSISTENT_LOOP = os.getenv("LAMBDA_PERSISTENT_LOOP", "1") == "1"  # 0 = asyncio.run per invocation
+LAMBDA_PREWARM = os.getenv("LAMBDA_PREWARM", "0") == "1"                  # launch + log in during the init phase
+LAMBDA_PREWARM_TIMEOUT = float(os.getenv("LAMBDA_PREWARM_TIMEOUT", "8"))  # init time spent on it; the rest finishes on first invoke
+LAMBDA_THAW_CHECK_AFTER = float(os.getenv("LAMBDA_THAW_CHECK_AFTER", "30"))  # gap between invocations that counts as a thaw
+
+# HTTP job API (MODE="http"): 202 + status polling instead of holding the connection
+HTTP_ASYNC_JOBS = os.getenv("HTTP_ASYNC_JOBS", "0") == "1"
+HTTP_JOB_QUEUE_MAX = int(os.getenv("HTTP_JOB_QUEUE_MAX", "100"))    # queued + running jobs before 429
+HTTP_JOB_TTL = int(os.getenv("HTTP_JOB_TTL", "3600"))               # seconds a finished job stays queryable
+HTTP_RETRY_AFTER_MIN = int(os.getenv("HTTP_RETRY_AFTER_MIN", "5"))  # floor for the Retry-After estimate
+
 # SQS settings (used only in MODE="sqs")
 SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
 SQS_WAIT_TIME_SECONDS = int(os.getenv("SQS_WAIT_TIME_SECONDS", "20"))
 SQS_MAX_MESSAGES = int(os.getenv("SQS_MAX_MESSAGES", "10"))              # API cap = 10
 SQS_VISIBILITY_TIMEOUT = int(os.getenv("SQS_VISIBILITY_TIMEOUT", "600")) # seconds
+SQS_BUFFER_SIZE = int(os.getenv("SQS_BUFFER_SIZE", "0"))                  # received-but-not-started messages; 0 = auto
+SQS_DELETE_FLUSH_SECONDS = float(os.getenv("SQS_DELETE_FLUSH_SECONDS", "1.0"))  # max delay before a batched delete
+SQS_DELETE_ATTEMPTS = int(os.getenv("SQS_DELETE_ATTEMPTS", "3"))          # flushes a failed delete is retried on
+SQS_DRAIN_SECONDS = float(os.getenv("SQS_DRAIN_SECONDS", "25"))          # grace for in-flight messages on shutdown
+SQS_HEARTBEAT = os.getenv("SQS_HEARTBEAT", "1") == "1"                   # extend visibility while a message is held
+SQS_HEARTBEAT_INTERVAL = int(os.getenv("SQS_HEARTBEAT_INTERVAL", str(max(10, SQS_VISIBILITY_TIMEOUT // 3))))
+SQS_HEARTBEAT_MAX_SECONDS = int(os.getenv("SQS_HEARTBEAT_MAX_SECONDS", "43000"))  # SQS caps a receipt at 12h
+SQS_RELEASE_ON_FAILURE = os.getenv("SQS_RELEASE_ON_FAILURE", "0") == "1"  # visibility 0 on failure for a fast retry
+SQS_MAX_RECEIVES = int(os.getenv("SQS_MAX_RECEIVES", "5"))                # give up on a message after this many deliveries
+SQS_PARKING_QUEUE_URL = os.getenv("SQS_PARKING_QUEUE_URL", "")            # permanent failures are copied here before the ack
 
 TMP_DIR = Path("/tmp"); TMP_DIR.mkdir(exist_ok=True)
 
@@ -75,6 +210,12 @@ s3 = session.client(
 
 sqs = session.client("sqs")  # inherits region/creds from the session
 
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_PART_SIZE_MB * 1024 * 1024,
+    multipart_chunksize=S3_PART_SIZE_MB * 1024 * 1024,
+    max_concurrency=S3_MAX_CONCURRENCY,
+)
+
 # S3 sanity checking
 print("S3 endpoint:", s3.meta.endpoint_url)
 creds = s3._request_signer._credentials
@@ -82,110 +223,873 @@ print("Using access key:", creds.access_key[:4] + "…", "session?", bool(getatt
 
 
 # ================
-# Browser Pool Management
+# Session state cache
 # ================
-class BrowserPool:
+class SessionStateStore:
+    """Caches a logged-in context's storage state locally and, optionally, in S3."""
+    def __init__(self, path: Path, s3_key: str):
+        self.path = path
+        self.s3_key = s3_key
+        self._state: Optional[dict] = None
+        self._saved_at = 0.0
+        self._s3_checked = False
+
+    def _fresh(self, saved_at: float) -> bool:
+        return time.time() - saved_at < SESSION_STATE_TTL
+
+    def _s3_location(self):
+        bucket = DEBUG_BUCKET or S3_BUCKET
+        return (bucket, f"{DEBUG_PREFIX}{self.s3_key}") if SESSION_STATE_S3 and bucket else (None, None)
+
+    def _read_local(self) -> Optional[dict]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+
+    def _read_s3(self) -> Optional[dict]:
+        bucket, key = self._s3_location()
+        if not bucket:
+            return None
+        try:
+            obj = s3.get_object(Bucket=bucket, Key=key)
+        except s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(obj["Body"].read())
+
+    def _write(self, doc: dict):
+        body = json.dumps(doc)
+        # Unique temp file: worker processes sharing this path must not write into each other's
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name + ".", suffix=".tmp")  # 0600
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(body)
+            os.replace(tmp, self.path)
+        except BaseException:
+            _unlink_quietly(Path(tmp))
+            raise
+        bucket, key = self._s3_location()
+        if bucket:
+            s3.put_object(Bucket=bucket, Key=key, Body=body.encode("utf-8"), ContentType="application/json")
+
+    async def load(self) -> Optional[dict]:
+        """Return a non-expired storage state, or None if a full login is needed."""
+        if not SESSION_STATE_ENABLED:
+            return None
+        if self._state is not None and self._fresh(self._saved_at):
+            return self._state
+        self._state = None
+
+        source = "local"
+        try:
+            doc = await asyncio.to_thread(self._read_local)
+            if doc is None and not self._s3_checked:
+                self._s3_checked = True
+                source = "s3"
+                doc = await asyncio.to_thread(self._read_s3)
+        except Exception as e:
+            log("WARNING", "session_state:load_error", source=source, error=str(e))
+            return None
+
+        if not doc:
+            return None
+        age = int(time.time() - doc.get("saved_at", 0))
+        if not self._fresh(doc.get("saved_at", 0)):
+            log("INFO", "session_state:expired", source=source, age_s=age)
+            return None
+        self._state, self._saved_at = doc["state"], doc["saved_at"]
+        log("INFO", "session_state:loaded", source=source, age_s=age, cookies=len(self._state.get("cookies", [])))
+        return self._state
+
+    async def save(self, context: BrowserContext):
+        """Persist the context's storage state after a successful login (best-effort)."""
+        if not SESSION_STATE_ENABLED:
+            return
+        try:
+            state = await context.storage_state()
+            doc = {"saved_at": time.time(), "state": state}
+            await asyncio.to_thread(self._write, doc)
+            self._state, self._saved_at = state, doc["saved_at"]
+            log("INFO", "session_state:saved", s3=bool(self._s3_location()[0]))
+        except Exception as e:
+            log("WARNING", "session_state:save_error", error=str(e))
+
+    async def invalidate(self):
+        """Forget the cached state once the portal rejects it."""
+        self._state = None
+        self._s3_checked = True  # the shared copy is the one that just failed
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log("WARNING", "session_state:invalidate_error", error=str(e))
+        log("INFO", "session_state:invalidated")
+
+
+# ================
+# Accounts
+# ================
+class CfxAccount:
+    """One set of Cfx.re credentials with its own proxy, fingerprint and cached session."""
+    def __init__(self, name: str, username: Optional[str], password: Optional[str],
+                 proxy_server: Optional[str] = None, proxy_username: Optional[str] = None,
+                 proxy_password: Optional[str] = None, os_fingerprint: str = "windows", locale: str = "en-GB",
+                 shared_session: bool = False):
+        self.name = name
+        self.username = username
+        self.password = password
+        self.proxy_server = proxy_server
+        self.proxy_username = proxy_username
+        self.proxy_password = proxy_password
+        self.os_fingerprint = os_fingerprint
+        self.locale = locale
+        if shared_session:
+            self.session_store = SessionStateStore(SESSION_STATE_PATH, SESSION_STATE_S3_KEY)
+        else:
+            path = SESSION_STATE_PATH.with_name(f"{SESSION_STATE_PATH.stem}_{name}{SESSION_STATE_PATH.suffix}")
+            key = pathlib.PurePosixPath(SESSION_STATE_S3_KEY)
+            self.session_store = SessionStateStore(path, str(key.with_name(f"{key.stem}_{name}{key.suffix}")))
+        self.login_failures = 0
+        self.fenced_until = 0.0
+
+    def proxy(self) -> Optional[dict]:
+        if not self.proxy_server:
+            return None
+        proxy = {"server": self.proxy_server}
+        if self.proxy_username and self.proxy_password:
+            proxy["username"] = self.proxy_username
+            proxy["password"] = self.proxy_password
+        return proxy
+
+    def fenced(self) -> bool:
+        return time.monotonic() < self.fenced_until
+
+    def login_succeeded(self):
+        self.login_failures = 0
+        self.fenced_until = 0.0
+
+    def login_failed(self):
+        self.login_failures += 1
+        if ACCOUNT_FENCE_AFTER > 0 and self.login_failures >= ACCOUNT_FENCE_AFTER:
+            self.fenced_until = time.monotonic() + ACCOUNT_FENCE_SECONDS
+            log("ERROR", "accounts:fenced", account=self.name, failures=self.login_failures,
+                seconds=ACCOUNT_FENCE_SECONDS)
+
+
+def _parse_accounts() -> List[dict]:
+    """Raw CFX_ACCOUNTS entries; raises ValueError when the variable is malformed."""
+    try:
+        raw = json.loads(CFX_ACCOUNTS)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"CFX_ACCOUNTS is not valid JSON: {e}")
+    if not isinstance(raw, list) or not all(isinstance(a, dict) for a in raw):
+        raise ValueError("CFX_ACCOUNTS must be a JSON list of objects")
+    return raw
+
+def _load_accounts() -> List[CfxAccount]:
+    if not CFX_ACCOUNTS:
+        return [CfxAccount("default", CFX_USERNAME, CFX_PASSWORD, PROXY_SERVER, PROXY_USERNAME,
+                           PROXY_PASSWORD, OS_FINGERPRINT, LOCALE, shared_session=True)]
+    try:
+        raw = _parse_accounts()
+    except ValueError:
+        return []  # validate_config reports it
+    return [
+        CfxAccount(
+            a.get("name") or f"account{i}", a.get("username"), a.get("password"),
+            a.get("proxy_server", PROXY_SERVER), a.get("proxy_username", PROXY_USERNAME),
+            a.get("proxy_password", PROXY_PASSWORD), a.get("os", OS_FINGERPRINT), a.get("locale", LOCALE),
+        )
+        for i, a in enumerate(raw)
+    ]
+
+# ================
+# Request filtering
+# ================
+class RouteFilter:
+    """
+    Context-wide route handler that aborts blocked resource types and stubs third-party
+    scripts (empty 200, so the SPA doesn't stall on them). Navigations and URLs matching
+    ROUTE_ALLOW_PATTERN always go through. Counters cover one lease.
+    """
+    # Rough transfer sizes used to estimate bytes saved (blocked requests are never fetched)
+    EST_BYTES = {"image": 40_000, "media": 500_000, "font": 60_000, "script": 80_000, "stylesheet": 30_000}
+
     def __init__(self):
-        self.browser: Optional[Browser] = None
+        self._allow = re.compile(ROUTE_ALLOW_PATTERN, re.I) if ROUTE_ALLOW_PATTERN else None
+        self.reset()
+
+    def reset(self):
+        self.allowed = 0
+        self.blocked = 0
+        self.stubbed = 0
+        self.est_bytes_saved = 0
+        self.by_type: Dict[str, int] = {}
+
+    def _blocked_host(self, url: str) -> bool:
+        host = (urllib.parse.urlsplit(url).hostname or "").lower()
+        return any(host == h or host.endswith("." + h) for h in ROUTE_BLOCK_HOSTS)
+
+    async def handle(self, route):
+        req = route.request
+        rtype = req.resource_type
+        try:
+            if req.is_navigation_request() or (self._allow and self._allow.search(req.url)):
+                self.allowed += 1
+                await route.continue_()
+            elif self._blocked_host(req.url):
+                if rtype == "script":
+                    await route.fulfill(status=200, content_type="application/javascript", body="")
+                    self.stubbed += 1
+                else:
+                    await route.abort("blockedbyclient")
+                    self.blocked += 1
+                self._count(rtype)
+            elif rtype in ROUTE_BLOCK_TYPES:
+                await route.abort("blockedbyclient")
+                self.blocked += 1
+                self._count(rtype)
+            else:
+                self.allowed += 1
+                await route.continue_()
+        except Exception:
+            pass  # page/context closed mid-request
+
+    def _count(self, rtype: str):
+        self.by_type[rtype] = self.by_type.get(rtype, 0) + 1
+        self.est_bytes_saved += self.EST_BYTES.get(rtype, 10_000)
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "blocked": self.blocked, "stubbed": self.stubbed,
+                "est_bytes_saved": self.est_bytes_saved, "by_type": dict(self.by_type)}
+
+# ================
+# Browser process stats (/proc)
+# ================
+BROWSER_PROC_NAMES = ("camoufox", "firefox")
+
+def _proc_table() -> Dict[int, tuple]:
+    """pid -> (ppid, comm) for every visible process; empty where /proc is unavailable."""
+    table = {}
+    try:
+        pids = [int(p) for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return table
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                raw = f.read()
+            comm = raw[raw.index("(") + 1:raw.rindex(")")]
+            ppid = int(raw[raw.rindex(")") + 2:].split()[1])
+            table[pid] = (ppid, comm)
+        except (OSError, ValueError, IndexError):
+            continue
+    return table
+
+def _descendants(table: Dict[int, tuple], root: int) -> set:
+    children: Dict[int, List[int]] = {}
+    for pid, (ppid, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    found, frontier = set(), [root]
+    while frontier:
+        for pid in children.get(frontier.pop(), []):
+            if pid not in found:
+                found.add(pid)
+                frontier.append(pid)
+    return found
+
+def _is_browser_proc(comm: str) -> bool:
+    comm = comm.lower()
+    return any(n in comm for n in BROWSER_PROC_NAMES)
+
+def _browser_root_pids() -> set:
+    """Browser main processes started by this process (children of the Playwright driver)."""
+    table = _proc_table()
+    return {pid for pid in _descendants(table, os.getpid())
+            if _is_browser_proc(table[pid][1]) and not _is_browser_proc(table.get(table[pid][0], (0, ""))[1])}
+
+def _process_tree_stats(root: int) -> Optional[Dict[str, int]]:
+    """Summed RSS and open file descriptors of `root` and its descendants."""
+    table = _proc_table()
+    if root not in table:
+        return None
+    tree = {root} | _descendants(table, root)
+    rss = fds = 0
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for pid in tree:
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                rss += int(f.read().split()[1]) * page_size
+            fds += len(os.listdir(f"/proc/{pid}/fd"))
+        except (OSError, ValueError, IndexError):
+            continue
+    return {"rss_bytes": rss, "fds": fds, "processes": len(tree)}
+
+def _p95(values) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))] if ordered else 0.0
+
+# ================
+# Browser Pool Management
+# ================
+class BrowserSlot:
+    """One leased context/page pair inside the shared browser."""
+    def __init__(self, index: int):
+        self.index = index
+        self.browser: Optional[Browser] = None  # browser process that owns this slot's context
         self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
         self.logged_in = False
+        self.session_restored = False
         self.request_count = 0
-        self.lock = asyncio.Lock()
-        
-    async def get_page(self) -> Page:
-        """Get or create a browser page, handling initialization and health checks."""
+        self.leased = False
+        self.route_filter: Optional[RouteFilter] = None
+        self.pool: Optional["BrowserPool"] = None
+
+    def adopt(self, warm: "BrowserSlot"):
+        """Take over a context/page that was prepared on a spare browser."""
+        self.browser, self.context, self.page = warm.browser, warm.context, warm.page
+        self.route_filter = warm.route_filter
+        self.logged_in, self.session_restored = warm.logged_in, warm.session_restored
+        self.request_count = 0
+
+
+# Launches are serialised so the before/after pid diff in _initialize_browser can only
+# see the browser being launched, not one another pool started at the same moment
+_launch_lock: Optional[asyncio.Lock] = None
+_launch_lock_loop = None
+
+def _browser_launch_lock() -> asyncio.Lock:
+    """The launch lock for the running loop (a fresh one per asyncio.run, e.g. per Lambda invocation)."""
+    global _launch_lock, _launch_lock_loop
+    loop = asyncio.get_running_loop()
+    if _launch_lock is None or _launch_lock_loop is not loop:
+        _launch_lock, _launch_lock_loop = asyncio.Lock(), loop
+    return _launch_lock
+
+
+class BrowserPool:
+    """
+    One Camoufox browser serving `size` independently leased contexts/pages for one account.
+
+    The browser process itself is retired after BROWSER_RETIRE_AFTER leases or when it
+    disconnects. With HOT_SPARE, a standby browser is launched, logged in and parked on
+    the create modal in the background first, so the swap costs a pointer change.
+    """
+    def __init__(self, account: CfxAccount, size: int = 1):
+        self.account = account
+        self.size = max(1, size)
+        self.browser: Optional[Browser] = None
+        self.browser_requests = 0
+        self.slots = [BrowserSlot(i) for i in range(self.size)]
+        self._free: asyncio.Queue = asyncio.Queue()
+        for slot in self.slots:
+            slot.pool = self
+            self._free.put_nowait(slot)
+        self.lock = asyncio.Lock()  # guards browser launch/swap/teardown
+        self._retired: List[Browser] = []
+        self._spare: Optional[Dict[int, BrowserSlot]] = None          # warmed, not yet promoted
+        self._warm_contexts: Optional[Dict[int, BrowserSlot]] = None  # promoted, waiting for their slot
+        self._warming: Dict[int, BrowserSlot] = {}                      # being logged in by _warm_spare
+        self._spare_task: Optional[asyncio.Task] = None
+        # Resource sampling for the active browser
+        self._pids: Dict[int, int] = {}  # id(browser) -> main process pid
+        self._probe_ms = deque(maxlen=max(1, BROWSER_LATENCY_WINDOW))
+        self._baseline_p95: Optional[float] = None
+        self._stats_for: Optional[int] = None
+        self._last_sample = 0.0
+        self._sample_task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, float] = {}
+
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        """Lease a healthy slot for the duration of one record."""
+        slot = await self._free.get()
+        slot.leased = True
+        try:
+            await self.refresh(slot)
+            slot.request_count += 1
+            self.browser_requests += 1
+            self._maybe_sample()
+            self._maybe_warm_spare()
+            if slot.route_filter:
+                slot.route_filter.reset()
+            yield slot
+        finally:
+            if slot.route_filter:
+                log("INFO", "route_filter:stats", slot=slot.index, **slot.route_filter.stats())
+            slot.leased = False
+            self._free.put_nowait(slot)
+            await self._reap_retired()
+
+    async def refresh(self, slot: BrowserSlot) -> Page:
+        """Make sure the slot has a live, responsive page and return it."""
+        # All under the lock: another lease retiring the browser mid-open would otherwise leave
+        # this slot on None or on a browser that _reap_retired is about to close
         async with self.lock:
-            # Check if we need to restart the browser
-            if self.request_count >= BROWSER_RESTART_AFTER and self.browser:
-                log("INFO", "browser_pool:restart", reason="request_limit", count=self.request_count)
-                await self.close()
-                self.request_count = 0
-                self.logged_in = False
-            
-            # Initialize browser if needed
-            if not self.browser or not self.page:
-                await self._initialize_browser()
-            
-            # Health check - verify page is responsive
-            try:
-                # Simple health check to ensure page is alive
-                await asyncio.wait_for(self.page.evaluate("() => true"), timeout=5.0)
-                # Also check if we're not on an error page
-                current_url = self.page.url
-                if "error" in current_url.lower() or "404" in current_url:
-                    raise Exception(f"Browser on error page: {current_url}")
-            except Exception as e:
-                log("WARNING", "browser_pool:health_check_failed", reason="page_unresponsive", error=str(e))
-                await self.close()
-                await self._initialize_browser()
-            
-            self.request_count += 1
-            return self.page
-    
-    async def _initialize_browser(self):
-        """Initialize browser, context, and page."""
-        log("INFO", "browser_pool:init:start")
-        
-        proxy = None
-        if PROXY_SERVER:
-            proxy = {"server": PROXY_SERVER}
-            if PROXY_USERNAME and PROXY_PASSWORD:
-                proxy["username"] = PROXY_USERNAME
-                proxy["password"] = PROXY_PASSWORD
-        
-        self.browser = await AsyncCamoufox(
-            headless=True,
-            os=OS_FINGERPRINT,
-            locale=LOCALE,
-            geoip="103.7.205.5",
-            proxy=proxy,
-            window=(1920, 1080),
-            exclude_addons=[DefaultAddons.UBO],
-        ).start()
-        
-        self.context = await self.browser.new_context()
-        self.page = await self.context.new_page()
-        
+            await self._maybe_retire()
+            await self._ensure_browser()
+            if slot.browser is not self.browser:
+                await self._migrate(slot)
+
+            # Recycle the slot's context once it has served its quota
+            if slot.request_count >= BROWSER_RESTART_AFTER and slot.context:
+                log("INFO", "browser_pool:restart", reason="request_limit", slot=slot.index, count=slot.request_count)
+                BROWSER_RESTARTS.inc(reason="context_request_limit")
+                await self._close_slot(slot)
+                slot.request_count = 0
+
+            if not slot.page:
+                await self._open_slot(slot)
+
+        # Health check - verify page is responsive
+        try:
+            t0 = time.perf_counter()
+            await asyncio.wait_for(slot.page.evaluate("() => true"), timeout=5.0)
+            self._record_probe(slot, (time.perf_counter() - t0) * 1000)
+            # Also check if we're not on an error page
+            current_url = slot.page.url
+            if "error" in current_url.lower() or "404" in current_url:
+                raise Exception(f"Browser on error page: {current_url}")
+        except Exception as e:
+            log("WARNING", "browser_pool:health_check_failed", reason="page_unresponsive", slot=slot.index, error=str(e))
+            HEALTH_CHECK_FAILURES.inc(account=self.account.name)
+            await self._close_slot(slot)
+            async with self.lock:
+                await self._ensure_browser()
+                await self._open_slot(slot)
+        return slot.page
+
+    def _pressure(self) -> Dict[str, float]:
+        """Each recycling signal as a fraction of its limit (>= 1.0 means retire)."""
+        p = {}
+        if BROWSER_RETIRE_AFTER > 0:
+            p["request_limit"] = self.browser_requests / BROWSER_RETIRE_AFTER
+        if BROWSER_MAX_RSS_MB > 0 and "rss_mb" in self.stats:
+            p["rss"] = self.stats["rss_mb"] / BROWSER_MAX_RSS_MB
+        if BROWSER_MAX_FDS > 0 and "fds" in self.stats:
+            p["fds"] = self.stats["fds"] / BROWSER_MAX_FDS
+        if BROWSER_MAX_PAGES > 0 and "pages" in self.stats:
+            p["pages"] = self.stats["pages"] / BROWSER_MAX_PAGES
+        if BROWSER_LATENCY_DRIFT > 0 and self._baseline_p95 and "probe_p95_ms" in self.stats:
+            p["latency_drift"] = self.stats["probe_p95_ms"] / (self._baseline_p95 * BROWSER_LATENCY_DRIFT)
+        return p
+
+    def _should_retire(self) -> Optional[str]:
+        pressure = self._pressure()
+        reason = max(pressure, key=pressure.get, default=None)
+        return reason if reason and pressure[reason] >= 1.0 else None
+
+    def _reset_stats(self):
+        self._probe_ms.clear()
+        self._baseline_p95 = None
+        self._stats_for = id(self.browser) if self.browser else None
+        self.stats = {}
+
+    def _record_probe(self, slot: BrowserSlot, ms: float):
+        if slot.browser is not self.browser:
+            return
+        if self._stats_for != id(self.browser):
+            self._reset_stats()
+        self._probe_ms.append(ms)
+        if self._baseline_p95 is None and len(self._probe_ms) == self._probe_ms.maxlen:
+            self._baseline_p95 = max(_p95(self._probe_ms), 1.0)
+            log("INFO", "browser_pool:latency_baseline", probe_p95_ms=round(self._baseline_p95, 1))
+
+    def _maybe_sample(self):
+        if time.monotonic() - self._last_sample < BROWSER_STATS_INTERVAL:
+            return
+        if self._sample_task and not self._sample_task.done():
+            return
+        self._last_sample = time.monotonic()
+        self._sample_task = asyncio.create_task(self._sample())
+
+    async def _sample(self):
+        """Refresh self.stats for the active browser; _maybe_retire acts on them."""
+        browser = self.browser
+        if not browser:
+            return
+        if self._stats_for != id(browser):
+            self._reset_stats()
+        stats: Dict[str, float] = {"requests": self.browser_requests}
+        try:
+            stats["pages"] = sum(len(c.pages) for c in browser.contexts)
+        except Exception:
+            pass
+        pid = self._pids.get(id(browser))
+        tree = await asyncio.to_thread(_process_tree_stats, pid) if pid else None
+        if tree:
+            stats.update(rss_mb=round(tree["rss_bytes"] / 1048576, 1), fds=tree["fds"], processes=tree["processes"])
+        if self._probe_ms:
+            stats["probe_p50_ms"] = round(sorted(self._probe_ms)[len(self._probe_ms) // 2], 1)
+            stats["probe_p95_ms"] = round(_p95(self._probe_ms), 1)
+        if browser is not self.browser:
+            return
+        self.stats = stats
+        pressure = {k: round(v, 2) for k, v in self._pressure().items()}
+        log("INFO", "browser_pool:stats", pid=pid, baseline_p95_ms=self._baseline_p95, pressure=pressure, **stats)
+
+    async def _maybe_retire(self):
+        """Retire the active browser once it is over budget (caller holds the lock)."""
+        if not self.browser:
+            return
+        reason = self._should_retire()
+        if not reason:
+            return
+        if self._spare is None and self._spare_task and not self._spare_task.done():
+            return  # keep serving from the old browser until the spare is warm
+        log("INFO", "browser_pool:retire", reason=reason, requests=self.browser_requests,
+            hot_spare=self._spare is not None, **self.stats)
+        BROWSER_RESTARTS.inc(reason=reason)
+        self._retired.append(self.browser)
+        self.browser = None
+        self._reset_stats()
+        if self._spare is not None:
+            await self._promote_spare()
+
+    async def _ensure_browser(self):
+        """Caller holds the lock."""
+        if self.browser and self.browser.is_connected():
+            return
+        if self.browser:
+            log("WARNING", "browser_pool:browser_disconnected")
+            BROWSER_RESTARTS.inc(reason="disconnected")
+            self._retired.append(self.browser)
+            self.browser = None
+        if self._spare is not None:
+            await self._promote_spare()
+            if self.browser.is_connected():
+                return
+            self._retired.append(self.browser)
+        self.browser = await self._initialize_browser()
+        self.browser_requests = 0
+        self._reset_stats()
+
+    async def _initialize_browser(self) -> Browser:
+        """Launch a Camoufox browser."""
+        log("INFO", "browser_pool:init:start", account=self.account.name, size=self.size)
+
+        async with _browser_launch_lock():
+            known = await asyncio.to_thread(_browser_root_pids)
+            browser = await AsyncCamoufox(
+                headless=True,
+                os=self.account.os_fingerprint,
+                locale=self.account.locale,
+                geoip="103.7.205.5",
+                proxy=self.account.proxy(),
+                window=(1920, 1080),
+                exclude_addons=[DefaultAddons.UBO],
+            ).start()
+            # Remember the new browser's main pid so its process tree can be sampled
+            new_pids = await asyncio.to_thread(_browser_root_pids) - known
+        if len(new_pids) == 1:
+            self._pids[id(browser)] = new_pids.pop()
+        elif new_pids:
+            # Something else spawned a browser meanwhile; no stats beat another browser's stats
+            log("WARNING", "browser_pool:pid_ambiguous", account=self.account.name, pids=sorted(new_pids))
+
+        log("INFO", "browser_pool:init:complete", account=self.account.name, pid=self._pids.get(id(browser)))
+        return browser
+
+    async def _open_slot(self, slot: BrowserSlot, browser: Optional[Browser] = None):
+        """Create the slot's context and page, restoring a cached session if one exists."""
+        browser = browser or self.browser
+        state = await self.account.session_store.load()
+        if state:
+            slot.context = await browser.new_context(storage_state=state)
+        else:
+            slot.context = await browser.new_context()
+        slot.browser = browser
+        if ROUTE_FILTER:
+            slot.route_filter = RouteFilter()
+            await slot.context.route("**/*", slot.route_filter.handle)
+        if ARTIFACT_TRACES:
+            # Recording runs for the context's lifetime; each record gets its own chunk
+            await slot.context.tracing.start(screenshots=True, snapshots=True)
+        slot.page = await slot.context.new_page()
+        # Optimistic: navigate_to_upload_modal falls back to a full login if the portal disagrees
+        slot.logged_in = slot.session_restored = bool(state)
+
         # Set up event handlers
-        self.page.on("console", lambda m: log("DEBUG", "page.console", type=m.type, text=m.text[:200]))
-        self.page.on("pageerror", lambda e: log("WARNING", "page.error", error=str(e)))
-        
-        log("INFO", "browser_pool:init:complete")
-    
-    async def mark_logged_in(self):
-        """Mark that we've successfully logged in."""
-        self.logged_in = True
-    
-    async def is_logged_in(self) -> bool:
-        """Check if we're still logged in."""
-        return self.logged_in
-    
-    async def close(self):
-        """Close browser resources."""
-        if self.page:
+        idx = slot.index
+        slot.page.on("console", lambda m: log("DEBUG", "page.console", slot=idx, type=m.type, text=m.text[:200]))
+        slot.page.on("pageerror", lambda e: log("WARNING", "page.error", slot=idx, error=str(e)))
+        log("INFO", "browser_pool:slot_open", slot=idx)
+
+    async def _migrate(self, slot: BrowserSlot):
+        """Move a slot onto the active browser, using a warmed spare context when available (lock held)."""
+        await self._close_slot(slot)
+        warm = (self._warm_contexts or {}).pop(slot.index, None)
+        if warm:
+            slot.adopt(warm)
+            log("INFO", "browser_pool:slot_swapped", slot=slot.index, source="hot_spare")
+
+    # ---- hot spare ----
+    def _maybe_warm_spare(self):
+        if not HOT_SPARE or self._spare is not None:
+            return
+        if self._spare_task and not self._spare_task.done():
+            return
+        if max(self._pressure().values(), default=0.0) >= HOT_SPARE_WARM_AT:
+            self._spare_task = asyncio.create_task(self._warm_spare())
+
+    async def _warm_spare(self):
+        """Launch a standby browser and park one logged-in page per slot on the create modal."""
+        _ctx_span.set(None)  # background work: keep it out of the record trace that triggered it
+        t0 = time.perf_counter()
+        browser = None
+        warm = self._warming = {}  # registered up front so owns()/account_for() resolve these pages to us
+        try:
+            browser = await self._initialize_browser()
+            for slot in self.slots:
+                spare = BrowserSlot(slot.index)
+                spare.pool = self
+                warm[slot.index] = spare
+                await self._open_slot(spare, browser)
+                # Logs in if the cached session doesn't cover it; later contexts reuse the fresh session
+                await navigate_to_upload_modal(spare.page)
+                spare.logged_in = True
+            self._spare = warm
+            log("INFO", "browser_pool:spare_ready", duration_ms=int((time.perf_counter() - t0) * 1000))
+        except Exception as e:
+            log("WARNING", "browser_pool:spare_failed", error=str(e))
+            for spare in warm.values():
+                await self._close_slot(spare)
+            if browser:
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+        finally:
+            self._warming = {}
+
+    async def _promote_spare(self):
+        """Make the warmed spare the active browser (lock held)."""
+        warm, self._spare = self._spare, None
+        self.browser = next(iter(warm.values())).browser
+        self.browser_requests = 0
+        self._reset_stats()
+        self._warm_contexts = warm
+        # Idle slots move over now; leased ones move on their next refresh
+        for slot in self.slots:
+            if not slot.leased:
+                await self._migrate(slot)
+        log("INFO", "browser_pool:spare_promoted")
+
+    async def _reap_retired(self):
+        """Close retired browsers once no slot runs on them any more."""
+        if not self._retired:
+            return
+        in_use = {id(s.browser) for s in self.slots if s.browser}
+        for browser in [b for b in self._retired if id(b) not in in_use]:
+            self._retired.remove(browser)
+            self._pids.pop(id(browser), None)
             try:
-                await self.page.close()
+                await browser.close()
             except Exception:
                 pass
-        if self.context:
+            log("INFO", "browser_pool:retired_closed")
+
+    def slot_for(self, page: Page) -> Optional[BrowserSlot]:
+        for slot in self.slots:
+            if slot.page is page:
+                return slot
+        return None
+
+    def owns(self, page: Page) -> bool:
+        """True for this pool's slot pages and its hot-spare pages."""
+        if self.slot_for(page):
+            return True
+        return any(w.page is page for warm in (self._warming, self._spare or {}, self._warm_contexts or {})
+                   for w in warm.values())
+
+    async def mark_logged_in(self, page: Page):
+        """Mark that the slot owning `page` has successfully logged in."""
+        slot = self.slot_for(page)
+        if slot:
+            slot.logged_in = True
+
+    async def is_logged_in(self, page: Page) -> bool:
+        """Check if the slot owning `page` is still logged in."""
+        slot = self.slot_for(page)
+        return bool(slot and slot.logged_in)
+
+    async def mark_logged_out(self, page: Page):
+        slot = self.slot_for(page)
+        if slot:
+            slot.logged_in = False
+
+    async def session_rejected(self, page: Page):
+        """Drop the cached storage state if this slot was started from it."""
+        slot = self.slot_for(page)
+        if slot and slot.session_restored:
+            slot.session_restored = False
+            slot.logged_in = False
+            log("WARNING", "session_state:rejected", account=self.account.name, slot=slot.index)
+            await self.account.session_store.invalidate()
+
+    async def thaw_check(self):
+        """
+        After the Lambda sandbox was frozen: relaunch a browser that died meanwhile and close
+        idle pages that no longer answer, so the next lease starts from something live.
+        """
+        self._reset_stats()  # probe latencies straddling the freeze say nothing about the browser
+        async with self.lock:
+            if not self.browser:
+                return
+            await self._ensure_browser()
+            for slot in self.slots:
+                if slot.leased or not slot.page or slot.browser is not self.browser:
+                    continue
+                try:
+                    await asyncio.wait_for(slot.page.evaluate("() => true"), timeout=3.0)
+                except Exception as e:
+                    log("WARNING", "browser_pool:thaw_unresponsive", account=self.account.name, slot=slot.index, error=str(e))
+                    HEALTH_CHECK_FAILURES.inc(account=self.account.name)
+                    await self._close_slot(slot)
+
+    async def _close_slot(self, slot: BrowserSlot):
+        if slot.page:
             try:
-                await self.context.close()
+                await slot.page.close()
             except Exception:
                 pass
-        if self.browser:
+        if slot.context:
             try:
-                await self.browser.close()
+                await slot.context.close()
             except Exception:
                 pass
+        slot.browser = None
+        slot.context = None
+        slot.page = None
+        slot.route_filter = None
+        slot.logged_in = False
+        slot.session_restored = False
+
+    async def _close_browser(self):
+        if self._spare_task and not self._spare_task.done():
+            self._spare_task.cancel()
+            await asyncio.gather(self._spare_task, return_exceptions=True)
+        browsers = [self.browser, *self._retired]
+        browsers += [w.browser for w in (self._spare or {}).values()][:1]
+        for slot in self.slots:
+            await self._close_slot(slot)
+            slot.request_count = 0
+        for warm in (self._spare or {}, self._warm_contexts or {}):
+            for spare in warm.values():
+                await self._close_slot(spare)
+        self._spare = self._warm_contexts = None
+        self._retired = []
+        for browser in browsers:
+            if browser:
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
         self.browser = None
-        self.context = None
-        self.page = None
-        self.logged_in = False
-        log("INFO", "browser_pool:closed")
+        self.browser_requests = 0
+        self._pids.clear()
+        self._reset_stats()
+
+    async def close(self):
+        """Close browser resources."""
+        async with self.lock:
+            await self._close_browser()
+        log("INFO", "browser_pool:closed", account=self.account.name)
+
+
+class AccountScheduler:
+    """
+    One BrowserPool per account. Each lease goes to the least-loaded account that isn't
+    fenced; an account is fenced for ACCOUNT_FENCE_SECONDS after ACCOUNT_FENCE_AFTER
+    consecutive failed logins, and its in-flight records finish where they are.
+    """
+    def __init__(self, accounts: List[CfxAccount], size: int = 1):
+        self.pools = [BrowserPool(a, size) for a in accounts]
+        self.size = sum(p.size for p in self.pools)
+        self._active: Dict[int, int] = {id(p): 0 for p in self.pools}  # leased + waiting, per pool
+
+    def _pick(self, prefer: Optional[str] = None) -> BrowserPool:
+        healthy = [p for p in self.pools if not p.account.fenced()]
+        if not healthy:
+            raise RuntimeError("All Cfx.re accounts are fenced after repeated login failures")
+        for pool in healthy:
+            if pool.account.name == prefer:
+                return pool
+        return min(healthy, key=lambda p: self._active[id(p)] / p.size)
+
+    @contextlib.asynccontextmanager
+    async def lease(self, prefer: Optional[str] = None):
+        """Lease a slot from the least-loaded healthy account (or `prefer`, while it is healthy)."""
+        pool = self._pick(prefer)
+        self._active[id(pool)] += 1
+        try:
+            async with pool.lease() as slot:
+                yield slot
+        finally:
+            self._active[id(pool)] -= 1
+
+    def pool_for(self, page: Page) -> Optional[BrowserPool]:
+        for pool in self.pools:
+            if pool.owns(page):
+                return pool
+        return None
+
+    def account_for(self, page: Page) -> CfxAccount:
+        pool = self.pool_for(page)
+        if not pool:
+            # Guessing would log in with another account's credentials through this page's proxy
+            raise RuntimeError("Page does not belong to any account's browser pool")
+        return pool.account
+
+    async def mark_logged_in(self, page: Page):
+        pool = self.pool_for(page)
+        if pool:
+            await pool.mark_logged_in(page)
 
-# Global browser pool
-browser_pool = BrowserPool()
+    async def thaw_check(self):
+        results = await asyncio.gather(*(p.thaw_check() for p in self.pools), return_exceptions=True)
+        for pool, res in zip(self.pools, results):
+            if isinstance(res, Exception):
+                log("WARNING", "browser_pool:thaw_check_failed", account=pool.account.name, error=str(res))
+
+    async def prewarm(self):
+        """Launch every account's browser and log its first slot in, ahead of the first record."""
+        async def _one(pool: BrowserPool):
+            async with pool.lease() as slot:
+                await navigate_to_upload_modal(slot.page)
+        results = await asyncio.gather(*(_one(p) for p in self.pools), return_exceptions=True)
+        for pool, res in zip(self.pools, results):
+            if isinstance(res, Exception):
+                log("WARNING", "browser_pool:prewarm_failed", account=pool.account.name, error=str(res))
+
+    async def is_logged_in(self, page: Page) -> bool:
+        pool = self.pool_for(page)
+        return bool(pool and await pool.is_logged_in(page))
+
+    async def mark_logged_out(self, page: Page):
+        pool = self.pool_for(page)
+        if pool:
+            await pool.mark_logged_out(page)
+
+    async def session_rejected(self, page: Page):
+        pool = self.pool_for(page)
+        if pool:
+            await pool.session_rejected(page)
+
+    def status(self) -> List[dict]:
+        return [
+            {"account": p.account.name, "active": self._active[id(p)], "size": p.size,
+             "fenced": p.account.fenced(), "login_failures": p.account.login_failures}
+            for p in self.pools
+        ]
+
+    async def close(self):
+        await asyncio.gather(*(p.close() for p in self.pools))
+
+# Global account scheduler (one browser pool per account)
+account_scheduler = AccountScheduler(_load_accounts(), MAX_PARALLEL)
 
 # ================
 # Configuration Validation
@@ -195,15 +1099,38 @@ def validate_config():
     errors = []
     
     # Always required for actual processing
-    if not CFX_USERNAME:
-        errors.append("CFX_USERNAME is required")
-    if not CFX_PASSWORD:
-        errors.append("CFX_PASSWORD is required")
+    if CFX_ACCOUNTS:
+        try:
+            raw = _parse_accounts()
+            if not raw:
+                errors.append("CFX_ACCOUNTS must list at least one account")
+            names = [a.get("name") or f"account{i}" for i, a in enumerate(raw)]
+            if len(set(names)) != len(names):
+                errors.append("CFX_ACCOUNTS names must be unique")
+            for name, a in zip(names, raw):
+                if not a.get("username") or not a.get("password"):
+                    errors.append(f"CFX_ACCOUNTS[{name}] needs username and password")
+                proxy = a.get("proxy_server")
+                if proxy and not proxy.startswith(("http://", "https://")):
+                    errors.append(f"CFX_ACCOUNTS[{name}] proxy_server must start with http:// or https://")
+        except ValueError as e:
+            errors.append(str(e))
+    else:
+        if not CFX_USERNAME:
+            errors.append("CFX_USERNAME is required")
+        if not CFX_PASSWORD:
+            errors.append("CFX_PASSWORD is required")
     
     # Mode-specific validation
     if MODE == "sqs" and not SQS_QUEUE_URL:
         errors.append("SQS_QUEUE_URL is required in SQS mode")
     
+    if HOUSEKEEPING and HOUSEKEEPING_RATE <= 0:
+        errors.append("HOUSEKEEPING_RATE must be positive")
+
+    if IDEMPOTENCY_BACKEND not in ("none", "sqlite", "s3"):
+        errors.append("IDEMPOTENCY_BACKEND must be one of none, sqlite, s3")
+
     # Proxy validation
     if PROXY_SERVER and not PROXY_SERVER.startswith(("http://", "https://")):
         errors.append("PROXY_SERVER must start with http:// or https://")
@@ -218,41 +1145,429 @@ def validate_config():
 # ================
 LEVELS = {"DEBUG":10,"INFO":20,"WARNING":30,"ERROR":40,"CRITICAL":50}
 MIN_LEVEL = LEVELS.get(LOG_LEVEL, 20)
-_current_ctx = {"request_id": None, "s3_bucket": None, "s3_key": None}
+# Per-task request context (each record / HTTP request runs in its own task context)
+_ctx_request_id: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+_ctx_s3_bucket: contextvars.ContextVar = contextvars.ContextVar("s3_bucket", default=None)
+_ctx_s3_key: contextvars.ContextVar = contextvars.ContextVar("s3_key", default=None)
+_ctx_span: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+
+def _redact(v: Optional[str], keep_last=4):
+    if not v: return None
+    return "***" + v[-keep_last:] if len(v) > keep_last else "***"
+
+class LogWriter:
+    """
+    Serialises and writes log records on a background thread, so a log call on the event
+    loop costs a dict and a queue put. Lines go out in batches with one flush per batch;
+    when the queue is full new records are dropped and the count is reported later.
+    """
+    def __init__(self, stream, max_queue: int, batch_max: int):
+        self.stream = stream
+        self.batch_max = max(1, batch_max)
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_queue))
+        self._thread: Optional[threading.Thread] = None
+        self.dropped = 0
+        self._dropped_reported = 0
+
+    def submit(self, rec: dict):
+        if self._thread is None:
+            # Started lazily so spawned worker processes get their own thread
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(rec)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception:
+                pass  # never let one bad batch end the thread; later lines would queue up unwritten
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def render(self, rec: dict) -> str:
+        rec["ts"] = datetime.fromtimestamp(rec["ts"], timezone.utc).isoformat()
+        return json.dumps(rec, default=str)
+
+    def _render_safe(self, rec: dict) -> str:
+        """render(), or a repr() line for records json can't take (odd keys, mutated mid-dump)."""
+        try:
+            return self.render(rec)
+        except Exception as e:
+            try:
+                text = repr(rec)
+            except Exception:
+                text = "<unrepresentable record>"
+            return json.dumps({"ts": datetime.now(timezone.utc).isoformat(), "level": "ERROR",
+                               "message": "log:unserialisable", "error": str(e), "record": text[:4000]})
+
+    def drop_notice(self, count: int) -> Optional[dict]:
+        return {"ts": time.time(), "level": "WARNING", "message": "log:dropped", "count": count}
+
+    def write(self, batch: List[dict]):
+        dropped = self.dropped - self._dropped_reported
+        if dropped:
+            self._dropped_reported += dropped
+            notice = self.drop_notice(dropped)
+            if notice:
+                batch = batch + [notice]
+        lines = [self._render_safe(rec) for rec in batch]
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        except Exception:
+            pass
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until everything queued so far has been written (shutdown, Lambda freeze)."""
+        deadline = time.monotonic() + timeout
+        while self._thread and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+class _LogLimiter:
+    """Per-message sampling and a one-second fixed-window rate limit for chatty events."""
+    def __init__(self):
+        self._windows: Dict[str, list] = {}  # msg -> [window start, lines, suppressed]
+
+    def allow(self, msg: str) -> Tuple[bool, int]:
+        """(emit?, lines suppressed in the previous window to report alongside)."""
+        rate = LOG_SAMPLE.get(msg)
+        if rate is not None and random.random() >= rate:
+            return False, 0
+        if LOG_RATE_LIMIT <= 0:
+            return True, 0
+        now = time.monotonic()
+        w = self._windows.get(msg)
+        if w is None or now - w[0] >= 1.0:
+            suppressed = w[2] if w else 0
+            self._windows[msg] = [now, 1, 0]
+            return True, suppressed
+        if w[1] >= LOG_RATE_LIMIT:
+            w[2] += 1
+            return False, 0
+        w[1] += 1
+        return True, 0
+
+
+log_writer = LogWriter(sys.stdout, LOG_QUEUE_MAX, LOG_BATCH_MAX)
+_log_limiter = _LogLimiter()
+atexit.register(log_writer.flush)
+
+def log(level: str, msg: str, **kv):
+    if LEVELS[level] < MIN_LEVEL: return
+    if LEVELS[level] < LEVELS["WARNING"]:
+        allowed, suppressed = _log_limiter.allow(msg)
+        if not allowed:
+            return
+        if suppressed:
+            kv["suppressed_before"] = suppressed
+    rec = {
+        "ts": time.time(),
+        "level": level,
+        "message": msg,
+        "request_id": _ctx_request_id.get(),
+        "s3_bucket": _ctx_s3_bucket.get(),
+        "s3_key": _ctx_s3_key.get(),
+    }
+    rec.update(kv)
+    if LOG_ASYNC:
+        log_writer.submit(rec)
+    else:
+        log_writer.write([rec])
+
+# ================
+# Metrics
+# ================
+def _label_str(key: Tuple) -> str:
+    if not key:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in key) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[Tuple, float] = {}
+
+    @staticmethod
+    def _key(labels: Dict[str, str]) -> Tuple:
+        return tuple(sorted(labels.items()))
+
+    def samples(self) -> List[Tuple[str, Tuple, float]]:
+        return [("", k, v) for k, v in self.values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        k = self._key(labels)
+        self.values[k] = self.values.get(k, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time from `fn` -> [(labels, value), ...]."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn=None):
+        super().__init__(name, help_text)
+        self.fn = fn
+
+    def inc(self, amount: float = 1.0, **labels):
+        k = self._key(labels)
+        self.values[k] = self.values.get(k, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.fn is None:
+            return super().samples()
+        try:
+            return [("", self._key(labels), float(v)) for labels, v in self.fn()]
+        except Exception:
+            return []
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        super().__init__(name, help_text)
+        self.buckets = sorted(buckets)
+        self.values: Dict[Tuple, list] = {}  # key -> [per-bucket counts (+Inf last), sum]
+
+    def observe(self, value: float, **labels):
+        k = self._key(labels)
+        state = self.values.get(k)
+        if state is None:
+            state = self.values[k] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        out = []
+        for k, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                out.append(("_bucket", k + (("le", le),), cumulative))
+            out.append(("_sum", k, total))
+            out.append(("_count", k, cumulative))
+        return out
+
+
+class MetricsRegistry:
+    """In-process metrics; updates are plain dict arithmetic on the event loop thread."""
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str, fn=None) -> Gauge:
+        return self._add(Gauge(name, help_text, fn))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...]) -> Histogram:
+        return self._add(Histogram(name, help_text, buckets))
+
+    def snapshot(self) -> List[dict]:
+        """Picklable copy of every sample (worker processes send these to the front)."""
+        return [{"name": m.name, "kind": m.kind, "help": m.help, "samples": m.samples()}
+                for m in self.metrics.values()]
+
+    def render(self, extra: Optional[List[Tuple[Dict[str, str], List[dict]]]] = None) -> str:
+        """Prometheus text exposition of this process plus labelled snapshots from other processes."""
+        families: Dict[str, dict] = {}
+        for labels, snap in [({}, self.snapshot())] + list(extra or []):
+            extra_key = tuple(sorted(labels.items()))
+            for fam in snap:
+                entry = families.setdefault(fam["name"], {"kind": fam["kind"], "help": fam["help"], "lines": []})
+                for suffix, key, value in fam["samples"]:
+                    entry["lines"].append(f"{fam['name']}{suffix}{_label_str(extra_key + tuple(key))} {value}")
+        out = []
+        for name, fam in families.items():
+            out.append(f"# HELP {name} {fam['help']}")
+            out.append(f"# TYPE {name} {fam['kind']}")
+            out.extend(fam["lines"])
+        return "\n".join(out) + "\n"
+
+
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram(
+    "cfx_stage_duration_seconds", "Duration of timed stages (Timer names)",
+    (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600),
+)
+RETRIES = metrics.counter("cfx_retries_total", "Browser flow retries by resumed stage and error kind")
+LOGINS = metrics.counter("cfx_logins_total", "Portal logins by account and result")
+BROWSER_RESTARTS = metrics.counter("cfx_browser_restarts_total", "Browser context/process restarts by reason")
+HEALTH_CHECK_FAILURES = metrics.counter("cfx_health_check_failures_total", "Failed page health probes")
+RECORDS = metrics.counter("cfx_records_total", "Records finished by the pipeline, by result")
+RECORDS_IN_FLIGHT = metrics.gauge("cfx_records_in_flight", "Records submitted to the pipeline and not yet finished")
+metrics.gauge("cfx_pipeline_queue_depth", "Records waiting per pipeline stage",
+              lambda: [({"stage": k}, v) for k, v in pipeline.depth().items()])
+metrics.gauge("cfx_browser_slots_leased", "Leased browser slots per account",
+              lambda: [({"account": p.account.name}, sum(s.leased for s in p.slots)) for p in account_scheduler.pools])
+
+
+# ================
+# Tracing
+# ================
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.root = parent.root if parent else self
+        self.attrs = attrs
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in self.attrs.items() if v is not None],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+
+class TraceWriter(LogWriter):
+    """LogWriter whose records are already-built OTLP documents."""
+    def render(self, rec: dict) -> str:
+        return json.dumps(rec, default=str)
+
+    def drop_notice(self, count: int) -> Optional[dict]:
+        return None
+
+
+class Tracer:
+    """
+    Nested spans tracked through contextvars. Finished spans are held per trace and written
+    as one OTLP/JSON (resourceSpans) line when the trace's root span ends; spans that end
+    after their root are written on their own line with the same trace id.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._pending: Dict[str, List[Span]] = {}
+        self._writer: Optional[TraceWriter] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def start(self, name: str, **attrs) -> Optional[Span]:
+        if not self.enabled:
+            return None
+        return Span(name, _ctx_span.get(), attrs)
+
+    def finish(self, span: Span, error: Optional[BaseException] = None):
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"[:300]
+        if span.root is not span and span.root.end_ns is not None:
+            self._export([span])  # late child of an already exported trace
+            return
+        self._pending.setdefault(span.trace_id, []).append(span)
+        if span.root is span:
+            self._export(self._pending.pop(span.trace_id))
+
+    def _export(self, spans: List[Span]):
+        if self._writer is None:
+            # One file per worker process so concurrent appends never interleave
+            path = f"{self.path}.worker{WORKER_INDEX}" if WORKER_INDEX is not None else self.path
+            self._writer = TraceWriter(open(path, "a", encoding="utf-8"), LOG_QUEUE_MAX, LOG_BATCH_MAX)
+            atexit.register(self._writer.flush)
+        self._writer.submit({"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "app"}, "spans": [s.otlp() for s in spans]}],
+        }]})
+
+    def flush(self):
+        if self._writer:
+            self._writer.flush()
+
+tracer = Tracer(TRACE_EXPORT_PATH)
 
-def _ts():
-    return datetime.now(timezone.utc).isoformat()
+@contextlib.asynccontextmanager
+async def span(name: str, **attrs):
+    """Child span of the current one (or a new trace root) for the duration of the block."""
+    s = tracer.start(name, **attrs)
+    if s is None:
+        yield None
+        return
+    token = _ctx_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        tracer.finish(s, e)
+        raise
+    else:
+        tracer.finish(s)
+    finally:
+        _ctx_span.reset(token)
 
-def _redact(v: Optional[str], keep_last=4):
-    if not v: return None
-    return "***" + v[-keep_last:] if len(v) > keep_last else "***"
+async def _wait(name: str, awaitable):
+    """Await one expect()/wait_for_* call inside its own span."""
+    async with span(f"wait:{name}"):
+        return await awaitable
 
-def log(level: str, msg: str, **kv):
-    if LEVELS[level] < MIN_LEVEL: return
-    rec = {
-        "ts": _ts(),
-        "level": level,
-        "message": msg,
-        "request_id": _current_ctx.get("request_id"),
-        "s3_bucket": _current_ctx.get("s3_bucket"),
-        "s3_key": _current_ctx.get("s3_key"),
-    }
-    rec.update(kv)
-    print(json.dumps(rec, default=str), flush=True)
 
 class Timer:
     def __init__(self, name, **fields):
         self.name = name
         self.fields = fields
         self.t0 = None
+        self.span: Optional[Span] = None
+        self._token = None
     async def __aenter__(self):
         self.t0 = time.perf_counter()
         log("INFO", f"{self.name}:start", **self.fields)
+        self.span = tracer.start(self.name, **self.fields)
+        if self.span:
+            self._token = _ctx_span.set(self.span)
         return self
     async def __aexit__(self, exc_type, exc, tb):
         dur = time.perf_counter() - self.t0
         status = "ok" if exc is None else "error"
         log("INFO", f"{self.name}:end", duration_ms=int(dur*1000), status=status, **self.fields)
+        if METRICS_ENABLED:
+            STAGE_SECONDS.observe(dur, stage=self.name, status=status)
+        if self.span:
+            tracer.finish(self.span, exc)
+            _ctx_span.reset(self._token)
 
 def _norm_prefix(p: Optional[str]) -> str:
     p = (p or "").lstrip("/")
@@ -262,6 +1577,8 @@ def _norm_prefix(p: Optional[str]) -> str:
 OUTPUT_PREFIX = _norm_prefix(OUTPUT_PREFIX)
 INPUT_PREFIX  = _norm_prefix(INPUT_PREFIX)
 DEBUG_PREFIX  = _norm_prefix(DEBUG_PREFIX)
+RESULT_CACHE_PREFIX = _norm_prefix(RESULT_CACHE_PREFIX)
+IDEMPOTENCY_PREFIX = _norm_prefix(IDEMPOTENCY_PREFIX)
 
 # ================
 # S3 helpers (async wrappers)
@@ -270,23 +1587,78 @@ async def s3_download(bucket: str, key: str, dest_path: Path):
     size = None
     log("INFO", "s3.download:start", bucket=bucket, key=key)
     try:
-        await asyncio.to_thread(s3.download_file, bucket, key, str(dest_path))
+        await asyncio.to_thread(s3.download_file, bucket, key, str(dest_path), Config=S3_TRANSFER_CONFIG)
         if dest_path.exists(): size = dest_path.stat().st_size
         log("INFO", "s3.download:end", bucket=bucket, key=key, size=size)
     except Exception as e:
         log("ERROR", "s3.download:error", bucket=bucket, key=key, error=str(e))
         raise
 
-async def s3_upload(src_path: Path, bucket: str, key: str):
+async def s3_upload(src_path: Path, bucket: str, key: str, metadata: Optional[Dict[str, str]] = None):
     size = src_path.stat().st_size if src_path.exists() else None
     log("INFO", "s3.upload:start", bucket=bucket, key=key, size=size)
     try:
-        await asyncio.to_thread(s3.upload_file, str(src_path), bucket, key)
+        extra = {"Metadata": metadata} if metadata else None
+        await asyncio.to_thread(s3.upload_file, str(src_path), bucket, key, ExtraArgs=extra, Config=S3_TRANSFER_CONFIG)
         log("INFO", "s3.upload:end", bucket=bucket, key=key, size=size)
     except Exception as e:
         log("ERROR", "s3.upload:error", bucket=bucket, key=key, error=str(e))
         raise
 
+class _HashingWriter:
+    """Write-through wrapper that hashes as bytes arrive; non-seekable so s3transfer writes parts in order."""
+    def __init__(self, fileobj, hasher):
+        self._fileobj = fileobj
+        self._hasher = hasher
+    def write(self, data):
+        self._hasher.update(data)
+        return self._fileobj.write(data)
+    def seekable(self):
+        return False
+
+async def s3_download_fileobj(bucket: str, key: str, fileobj, target: str, hasher=None):
+    log("INFO", "s3.download:start", bucket=bucket, key=key, target=target)
+    if hasher is not None:
+        fileobj = _HashingWriter(fileobj, hasher)
+    try:
+        await asyncio.to_thread(s3.download_fileobj, bucket, key, fileobj, Config=S3_TRANSFER_CONFIG)
+        log("INFO", "s3.download:end", bucket=bucket, key=key, target=target)
+    except Exception as e:
+        log("ERROR", "s3.download:error", bucket=bucket, key=key, error=str(e))
+        raise
+
+async def s3_download_input(bucket: str, key: str, dest_path: Path, name: str,
+                            size: Optional[int] = None, hasher=None):
+    """
+    Fetch a record's input for the browser. With STREAM_IO, inputs up to STREAM_MEMORY_MAX_BYTES
+    are kept in memory as a Playwright file payload; anything else lands at dest_path.
+    If `hasher` is given it is fed the bytes as they are downloaded.
+    """
+    if STREAM_IO:
+        if size is None:
+            head = await asyncio.to_thread(s3.head_object, Bucket=bucket, Key=key)
+            size = head["ContentLength"]
+        if size <= STREAM_MEMORY_MAX_BYTES:
+            buf = io.BytesIO()
+            await s3_download_fileobj(bucket, key, buf, "memory", hasher)
+            return {"name": name, "mimeType": "application/zip", "buffer": buf.getvalue()}
+    if hasher is None:
+        await s3_download(bucket, key, dest_path)
+    else:
+        with open(dest_path, "wb") as f:
+            await s3_download_fileobj(bucket, key, f, "disk", hasher)
+    return dest_path
+
+async def s3_copy(src_bucket: str, src_key: str, bucket: str, key: str):
+    """Server-side copy (multipart for large objects)."""
+    log("INFO", "s3.copy:start", src=f"s3://{src_bucket}/{src_key}", bucket=bucket, key=key)
+    try:
+        await asyncio.to_thread(s3.copy, {"Bucket": src_bucket, "Key": src_key}, bucket, key, Config=S3_TRANSFER_CONFIG)
+        log("INFO", "s3.copy:end", bucket=bucket, key=key)
+    except Exception as e:
+        log("ERROR", "s3.copy:error", bucket=bucket, key=key, error=str(e))
+        raise
+
 async def generate_presigned_url(bucket: str, key: str, expiration=3600):
     """Generates a presigned URL for an S3 object."""
     log("INFO", "s3.generate_presigned_url:start", bucket=bucket, key=key)
@@ -303,6 +1675,186 @@ async def generate_presigned_url(bucket: str, key: str, expiration=3600):
         log("ERROR", "s3.generate_presigned_url:error", error=str(e))
         return None
 
+# ================
+# Result cache
+# ================
+class ResultCache:
+    """
+    Index of input sha256 -> processed output, stored as small JSON objects under
+    RESULT_CACHE_PREFIX. Entries older than RESULT_CACHE_TTL, or whose output is gone,
+    are evicted when looked up.
+    """
+    def _index_key(self, sha256: str) -> str:
+        return f"{RESULT_CACHE_PREFIX}{sha256}.json"
+
+    async def lookup(self, bucket: str, sha256: str) -> Optional[Dict[str, str]]:
+        index_key = self._index_key(sha256)
+        try:
+            obj = await asyncio.to_thread(s3.get_object, Bucket=bucket, Key=index_key)
+            entry = json.loads(obj["Body"].read())
+        except s3.exceptions.NoSuchKey:
+            log("INFO", "result_cache:miss", sha256=sha256)
+            return None
+        except Exception as e:
+            log("WARNING", "result_cache:lookup_error", sha256=sha256, error=str(e))
+            return None
+
+        age = time.time() - entry.get("created_at", 0)
+        if age > RESULT_CACHE_TTL:
+            log("INFO", "result_cache:expired", sha256=sha256, age_s=int(age))
+            await self._evict(bucket, index_key)
+            return None
+        try:
+            head = await asyncio.to_thread(s3.head_object, Bucket=entry["bucket"], Key=entry["key"])
+        except Exception as e:
+            log("INFO", "result_cache:stale", sha256=sha256, output=entry.get("key"), error=str(e))
+            await self._evict(bucket, index_key)
+            return None
+        tagged = (head.get("Metadata") or {}).get("sha256")
+        if tagged != sha256:
+            # The output key was overwritten by a different input's result since this entry was stored
+            log("INFO", "result_cache:stale", sha256=sha256, output=entry.get("key"), reason="sha256_mismatch", tagged=tagged)
+            await self._evict(bucket, index_key)
+            return None
+        log("INFO", "result_cache:hit", sha256=sha256, output=f"s3://{entry['bucket']}/{entry['key']}", age_s=int(age))
+        return entry
+
+    async def store(self, bucket: str, sha256: str, out_bucket: str, out_key: str):
+        entry = {"bucket": out_bucket, "key": out_key, "created_at": time.time()}
+        try:
+            await asyncio.to_thread(s3.put_object, Bucket=bucket, Key=self._index_key(sha256),
+                                    Body=json.dumps(entry).encode("utf-8"), ContentType="application/json")
+            log("INFO", "result_cache:stored", sha256=sha256, output=f"s3://{out_bucket}/{out_key}")
+        except Exception as e:
+            log("WARNING", "result_cache:store_error", sha256=sha256, error=str(e))
+
+    async def _evict(self, bucket: str, index_key: str):
+        try:
+            await asyncio.to_thread(s3.delete_object, Bucket=bucket, Key=index_key)
+        except Exception as e:
+            log("WARNING", "result_cache:evict_error", key=index_key, error=str(e))
+
+result_cache = ResultCache()
+
+# ================
+# Idempotency ledger
+# ================
+class RecordInProgress(Exception):
+    """Another delivery holds a live claim on this record; retry once it finishes or its lease lapses."""
+
+
+class SqliteLedger:
+    """Local ledger; claims are atomic per host (BEGIN IMMEDIATE)."""
+    def __init__(self, path: str):
+        self.path = path
+        with contextlib.closing(self._connect()) as db:
+            db.execute("CREATE TABLE IF NOT EXISTS ledger (id TEXT PRIMARY KEY, state TEXT NOT NULL, "
+                       "lease_until REAL, result TEXT, updated_at REAL NOT NULL)")
+            db.commit()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _acquire(self, ident: str) -> Tuple[str, Optional[dict]]:
+        now = time.time()
+        with contextlib.closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT state, lease_until, result, updated_at FROM ledger WHERE id = ?", (ident,)).fetchone()
+            if row:
+                state, lease_until, result, updated_at = row
+                if state == "completed" and now - updated_at < IDEMPOTENCY_TTL:
+                    db.execute("COMMIT")
+                    return "completed", json.loads(result or "null")
+                if state == "in_progress" and (lease_until or 0) > now:
+                    db.execute("COMMIT")
+                    return "in_progress", None
+            db.execute("INSERT OR REPLACE INTO ledger (id, state, lease_until, result, updated_at) VALUES (?, ?, ?, NULL, ?)",
+                       (ident, "in_progress", now + IDEMPOTENCY_LEASE_SECONDS, now))
+            db.execute("COMMIT")
+            return "acquired", None
+
+    def _complete(self, ident: str, result: dict):
+        with contextlib.closing(self._connect()) as db:
+            db.execute("UPDATE ledger SET state = 'completed', lease_until = NULL, result = ?, updated_at = ? WHERE id = ?",
+                       (json.dumps(result), time.time(), ident))
+
+    def _release(self, ident: str):
+        with contextlib.closing(self._connect()) as db:
+            db.execute("DELETE FROM ledger WHERE id = ? AND state = 'in_progress'", (ident,))
+
+    async def acquire(self, ident: str, bucket: str):
+        return await asyncio.to_thread(self._acquire, ident)
+
+    async def complete(self, ident: str, bucket: str, result: dict):
+        await asyncio.to_thread(self._complete, ident, result)
+
+    async def release(self, ident: str, bucket: str):
+        await asyncio.to_thread(self._release, ident)
+
+
+class S3Ledger:
+    """Shared ledger; claims use S3 conditional writes (If-None-Match / If-Match)."""
+    def _key(self, ident: str) -> str:
+        return f"{IDEMPOTENCY_PREFIX}{hashlib.sha256(ident.encode('utf-8')).hexdigest()}.json"
+
+    @staticmethod
+    def _conflict(e: ClientError) -> bool:
+        return e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict")
+
+    def _put(self, bucket: str, ident: str, entry: dict, **conditions):
+        body = json.dumps(dict(entry, id=ident)).encode("utf-8")
+        s3.put_object(Bucket=bucket, Key=self._key(ident), Body=body, ContentType="application/json", **conditions)
+
+    def _acquire(self, ident: str, bucket: str) -> Tuple[str, Optional[dict]]:
+        now = time.time()
+        claim = {"state": "in_progress", "lease_until": now + IDEMPOTENCY_LEASE_SECONDS, "updated_at": now}
+        try:
+            self._put(bucket, ident, claim, IfNoneMatch="*")
+            return "acquired", None
+        except ClientError as e:
+            if not self._conflict(e):
+                raise
+        obj = s3.get_object(Bucket=bucket, Key=self._key(ident))
+        entry = json.loads(obj["Body"].read())
+        if entry.get("state") == "completed" and now - entry.get("updated_at", 0) < IDEMPOTENCY_TTL:
+            return "completed", entry.get("result")
+        if entry.get("state") == "in_progress" and entry.get("lease_until", 0) > now:
+            return "in_progress", None
+        # Expired lease or stale completion: take it over, unless someone else just did
+        try:
+            self._put(bucket, ident, claim, IfMatch=obj["ETag"])
+            return "acquired", None
+        except ClientError as e:
+            if self._conflict(e):
+                return "in_progress", None
+            raise
+
+    async def acquire(self, ident: str, bucket: str):
+        return await asyncio.to_thread(self._acquire, ident, bucket)
+
+    async def complete(self, ident: str, bucket: str, result: dict):
+        entry = {"state": "completed", "result": result, "updated_at": time.time()}
+        await asyncio.to_thread(self._put, bucket, ident, entry)
+
+    async def release(self, ident: str, bucket: str):
+        await asyncio.to_thread(s3.delete_object, Bucket=bucket, Key=self._key(ident))
+
+
+def _make_ledger():
+    if IDEMPOTENCY_BACKEND == "sqlite":
+        return SqliteLedger(IDEMPOTENCY_SQLITE_PATH)
+    if IDEMPOTENCY_BACKEND == "s3":
+        return S3Ledger()
+    return None
+
+idempotency_ledger = _make_ledger()
+
+def _record_identity(rec) -> Tuple[str, str, Optional[str]]:
+    """(bucket, key, etag) of an S3-style record; the ETag is only known if the event carried it."""
+    obj = rec["s3"]["object"]
+    etag = (obj.get("eTag") or obj.get("etag") or "").strip('"') or None
+    return rec["s3"]["bucket"]["name"], urllib.parse.unquote_plus(obj["key"]), etag
+
 # ================
 # Notifications
 # ================
@@ -324,27 +1876,38 @@ async def human_delay(min_seconds=1.2, max_seconds=2.6):
         await asyncio.sleep(random.uniform(min_seconds, max_seconds))
 
 async def type_like_human(el, text: str):
-    await el.click()
-    await human_delay(0.3, 0.7)
-    if DISABLE_HUMAN_DELAYS:
-        await el.fill(text)
-    else:
-        for ch in text:
-            await el.type(ch, delay=random.uniform(70, 200))
-    await human_delay(0.3, 0.7)
+    async with span("type", chars=len(text)):
+        await el.click()
+        await human_delay(0.3, 0.7)
+        if DISABLE_HUMAN_DELAYS:
+            await el.fill(text)
+        else:
+            for ch in text:
+                await el.type(ch, delay=random.uniform(70, 200))
+        await human_delay(0.3, 0.7)
 
 # ================
 # Site automation (Camoufox)
 # ================
 async def perform_login(page: Page, username: str, password: str):
     """Perform login and verify success."""
-    log("INFO", "login:begin")
+    account = account_scheduler.account_for(page).name
+    try:
+        async with Timer("login", account=account):
+            await _perform_login(page, username, password)
+    except Exception:
+        LOGINS.inc(account=account, result="error")
+        raise
+    LOGINS.inc(account=account, result="ok")
+
+async def _perform_login(page: Page, username: str, password: str):
+    log("INFO", "login:begin", account=account_scheduler.account_for(page).name)
     
     # Check if we're already on the login page
     if "sign-in" not in page.url:
         # Navigate to login page via button click
         signin_button = page.get_by_role("button", name="Sign in with Cfx.re")
-        await expect(signin_button).to_be_visible(timeout=15000)
+        await _wait("signin_button", expect(signin_button).to_be_visible(timeout=15000))
         await signin_button.click()
         await human_delay()
 
@@ -352,16 +1915,16 @@ async def perform_login(page: Page, username: str, password: str):
     username_field = page.locator("#login-account-name")
     password_field = page.locator("#login-account-password")
     
-    await expect(username_field).to_be_visible(timeout=10000)
+    await _wait("username_field", expect(username_field).to_be_visible(timeout=10000))
     await username_field.clear()
     await type_like_human(username_field, username)
     
-    await expect(password_field).to_be_visible()
+    await _wait("password_field", expect(password_field).to_be_visible())
     await password_field.clear()
     await type_like_human(password_field, password)
 
     login_button = page.locator("#login-button")
-    await expect(login_button).to_be_enabled()
+    await _wait("login_button", expect(login_button).to_be_enabled())
     await login_button.click()
     log("INFO", "login:submitted")
     
@@ -369,13 +1932,17 @@ async def perform_login(page: Page, username: str, password: str):
     try:
         # Wait for redirect back to assets page
         # Use a more flexible URL pattern to handle different portal URLs
-        await page.wait_for_url("**/portal.cfx.re/**", timeout=30000)
+        await _wait("login_redirect", page.wait_for_url(f"{CFX_PORTAL_URL}/**", timeout=30000))
         # Verify we can see expected elements
         asset_elements = page.locator('[data-sentry-component="AssetRow"], .cfxui__InputDropzone__dropzone__bde8d, input[placeholder*="asset"]')
-        await expect(asset_elements.first).to_be_visible(timeout=10000)
+        await _wait("login_landing", expect(asset_elements.first).to_be_visible(timeout=10000))
         log("INFO", "login:success")
-        await browser_pool.mark_logged_in()
+        account = account_scheduler.account_for(page)
+        account.login_succeeded()
+        await account_scheduler.mark_logged_in(page)
+        await account.session_store.save(page.context)
     except Exception as e:
+        account_scheduler.account_for(page).login_failed()
         # Check for common login failure indicators
         error_element = page.locator(".error-message, .alert-danger, [role='alert']")
         if await error_element.count() > 0:
@@ -385,10 +1952,14 @@ async def perform_login(page: Page, username: str, password: str):
 
 async def navigate_to_upload_modal(page: Page):
     """Navigate to the upload modal, handling login if needed."""
-    target_url = "https://portal.cfx.re/assets/created-assets?modal=create"
+    async with span("navigate_to_upload_modal"):
+        await _navigate_to_upload_modal(page)
+
+async def _navigate_to_upload_modal(page: Page):
+    target_url = f"{CFX_PORTAL_URL}/assets/created-assets?modal=create"
     
     # Navigate to the target URL
-    if not page.url.startswith("https://portal.cfx.re"):
+    if not page.url.startswith(CFX_PORTAL_URL):
         await page.goto(target_url, wait_until="domcontentloaded", timeout=60000)
         await human_delay(1.5, 3)
     elif "modal=create" not in page.url:
@@ -409,18 +1980,20 @@ async def navigate_to_upload_modal(page: Page):
     
     if signin_visible:
         log("INFO", "login:required")
-        await perform_login(page, CFX_USERNAME, CFX_PASSWORD)
+        await account_scheduler.session_rejected(page)
+        account = account_scheduler.account_for(page)
+        await perform_login(page, account.username, account.password)
         # After login, we should be redirected to the upload modal
-        await expect(asset_name_field).to_be_visible(timeout=25000)
+        await _wait("upload_modal", expect(asset_name_field).to_be_visible(timeout=25000))
         return
     
     # Check if asset name field is visible (indicates we're logged in)
     try:
-        await expect(asset_name_field).to_be_visible(timeout=7000)
+        await _wait("upload_modal", expect(asset_name_field).to_be_visible(timeout=7000))
         log("INFO", "login:already_authenticated")
     except Exception:
         # Can't see the form, might be a session issue or different page
-        if await browser_pool.is_logged_in():
+        if await account_scheduler.is_logged_in(page):
             # We think we're logged in but can't see the form, try reloading
             log("WARNING", "login:session_expired", action="reloading")
             await page.reload()
@@ -428,11 +2001,11 @@ async def navigate_to_upload_modal(page: Page):
             
             # Check again after reload
             try:
-                await expect(asset_name_field).to_be_visible(timeout=7000)
+                await _wait("upload_modal", expect(asset_name_field).to_be_visible(timeout=7000))
                 return
             except:
                 # Still can't see it, force re-login
-                browser_pool.logged_in = False
+                await account_scheduler.mark_logged_out(page)
         
         # Navigate to trigger login flow
         await page.goto(target_url, wait_until="domcontentloaded", timeout=30000)
@@ -446,180 +2019,926 @@ async def navigate_to_upload_modal(page: Page):
             pass
             
         if signin_visible:
-            await perform_login(page, CFX_USERNAME, CFX_PASSWORD)
-            await expect(asset_name_field).to_be_visible(timeout=25000)
+            await account_scheduler.session_rejected(page)
+            account = account_scheduler.account_for(page)
+            await perform_login(page, account.username, account.password)
+            await _wait("upload_modal", expect(asset_name_field).to_be_visible(timeout=25000))
 
-async def run_asset_flow(page: Page, file_to_upload: Path) -> Path:
-    # Validate file exists
-    if not file_to_upload.exists():
-        raise FileNotFoundError(f"Upload file not found: {file_to_upload}")
-    
+class AssetProcessingFailed(Exception):
+    """The portal reported a failed status for an uploaded asset."""
+    def __init__(self, asset_name: str, status: str):
+        super().__init__(f"Portal reported asset {asset_name} as {status}")
+        self.asset_name = asset_name
+
+
+# Per-stage retry policy for run_asset_flow: (attempts, backoff seconds before each retry).
+# Keyed by the stage being reached when the failure happened; a retry resumes there.
+STAGE_RETRY_POLICY = {
+    "navigated":   (3, (1, 2)),
+    "uploaded":    (2, (2,)),      # the only stage that creates a new asset
+    "row_visible": (3, (2, 4)),
+    "ready":       (2, (5,)),      # re-poll the same asset rather than re-upload it
+    "downloaded":  (3, (1, 2)),
+    "reupload":    (2, (5,)),      # portal reported the asset failed: start over
+}
+
+
+class AssetCheckpoint:
+    """How far one input got through run_asset_flow, so a retry resumes instead of re-uploading."""
+    STAGES = ("navigated", "uploaded", "row_visible", "ready", "downloaded")
+
+    def __init__(self):
+        self.stage: Optional[str] = None
+        self.asset_name: Optional[str] = None
+        self.account: Optional[str] = None  # assets only show up in the account that uploaded them
+        self.out_path: Optional[Path] = None
+        self.attempts: Dict[str, int] = {}
+
+    def reached(self, stage: str) -> bool:
+        return self.stage is not None and self.STAGES.index(self.stage) >= self.STAGES.index(stage)
+
+    @property
+    def pending(self) -> str:
+        """The stage the flow is working towards."""
+        if self.stage is None:
+            return self.STAGES[0]
+        return self.STAGES[min(self.STAGES.index(self.stage) + 1, len(self.STAGES) - 1)]
+
+    def advance(self, stage: str, **fields):
+        if not self.reached(stage):
+            self.stage = stage
+            for k, v in fields.items():
+                setattr(self, k, v)
+            log("INFO", "checkpoint", stage=stage, asset_name=self.asset_name)
+
+    def restart(self):
+        """Forget upload progress; the next attempt creates a new asset."""
+        self.stage = self.asset_name = self.account = None
+        self.out_path = None
+
+
+def _classify_error(exc: BaseException) -> str:
+    """fatal (don't retry) | reupload (portal rejected the asset) | session (login trouble) | transient."""
+    if isinstance(exc, AssetProcessingFailed):
+        return "reupload"
+    if isinstance(exc, (FileNotFoundError, IsADirectoryError, PermissionError)):
+        return "fatal"
+    if isinstance(exc, ClientError) and exc.response.get("Error", {}).get("Code") in ("NoSuchKey", "NoSuchBucket", "404", "NotFound"):
+        return "fatal"  # the input isn't there; another delivery won't change that
+    msg = str(exc).lower()
+    if "login failed" in msg or "login verification failed" in msg:
+        return "session"
+    return "transient"
+
+
+class AssetWatcher:
+    """
+    Listens to the portal's own asset-list XHR/fetch responses and records the status
+    of the watched asset names, so readiness is noticed as soon as the SPA learns it.
+    """
+    STATUS_KEYS = ("status", "state", "processingStatus", "processing_status")
+
+    def __init__(self, page: Page, names=()):
+        self.page = page
+        self.names = set(names)
+        self.status: Dict[str, str] = {}
+        self._pattern = re.compile(ASSET_API_PATTERN, re.I)
+        self._changed = asyncio.Event()
+
+    def attach(self) -> "AssetWatcher":
+        self.page.on("response", self._on_response)
+        return self
+
+    def detach(self):
+        try:
+            self.page.remove_listener("response", self._on_response)
+        except Exception:
+            pass
+
+    def add(self, name: str):
+        self.names.add(name)
+
+    async def _on_response(self, response):
+        try:
+            if response.request.resource_type not in ("xhr", "fetch") or not self._pattern.search(response.url):
+                return
+            data = await response.json()
+        except Exception:
+            return
+        self.ingest(data)
+
+    def ingest(self, data) -> Dict[str, str]:
+        """Record watched statuses found anywhere in an asset-list payload; returns what was found."""
+        found = {}
+        self._collect(data, found)
+        updated = {n: st for n, st in found.items() if self.status.get(n) != st}
+        if updated:
+            self.status.update(updated)
+            log("DEBUG", "asset_watcher:status", statuses=updated)
+            self._changed.set()
+        return found
+
+    async def poll_list(self, query: str):
+        """
+        Ask the portal's list API (ASSET_LIST_URL) about `query` directly, following pages
+        until every watched name is found or a page comes back empty.
+        """
+        missing = set(self.names)
+        for page_no in range(1, ASSET_LIST_MAX_PAGES + 1):
+            url = urllib.parse.urljoin(CFX_PORTAL_URL, ASSET_LIST_URL.format(
+                query=urllib.parse.quote(query), page=page_no))
+            try:
+                # page.request shares the browser context's cookies, so the portal session applies
+                resp = await self.page.request.get(url, timeout=15000)
+                data = await resp.json() if resp.ok else None
+            except Exception as e:
+                log("DEBUG", "asset_watcher:list_error", url=url, error=str(e))
+                return
+            if not data or not _has_items(data):
+                return
+            missing -= set(self.ingest(data))
+            if not missing or "{page}" not in ASSET_LIST_URL:
+                return
+
+    def _collect(self, node, found: Dict[str, str]):
+        if isinstance(node, dict):
+            name = next((v for v in node.values() if isinstance(v, str) and v in self.names), None)
+            if name:
+                status = next((node[k] for k in self.STATUS_KEYS if isinstance(node.get(k), str)), None)
+                if status:
+                    found[name] = status.lower()
+            for v in node.values():
+                if isinstance(v, (dict, list)):
+                    self._collect(v, found)
+        elif isinstance(node, list):
+            for v in node:
+                self._collect(v, found)
+
+    def is_ready(self, name: str) -> bool:
+        return self.status.get(name) in ASSET_READY_STATUSES
+
+    def is_failed(self, name: str) -> bool:
+        return self.status.get(name) in ASSET_FAILED_STATUSES
+
+    async def changed(self, timeout: float):
+        """Sleep up to `timeout` seconds, waking early when any watched status changes."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._changed.clear()
+
+
+def _has_items(node) -> bool:
+    """True when a list-API payload contains at least one non-empty list of records."""
+    if isinstance(node, list):
+        return any(isinstance(v, dict) for v in node) or any(_has_items(v) for v in node)
+    if isinstance(node, dict):
+        return any(_has_items(v) for v in node.values() if isinstance(v, (dict, list)))
+    return False
+
+def _asset_row(page: Page, name: str):
+    """Table row whose cell reads exactly `name` (has_text would also match longer sibling names)."""
+    return page.locator("tr").filter(has=page.get_by_text(name, exact=True))
+
+def _asset_query(names: List[str]) -> str:
+    """Search term matching every name; batches share a name prefix so one query covers them all."""
+    return os.path.commonprefix(list(names)) or names[0]
+
+
+async def _wait_any_asset_ready(page: Page, watcher: AssetWatcher, names: List[str], on_row=None):
+    """
+    Wait until one of `names` has an enabled download button and return (name, button).
+    Portal responses (and ASSET_LIST_URL polls, when configured) wake the wait immediately;
+    otherwise the DOM is re-checked with a growing interval, and the page is only reloaded
+    after long stretches without a row (or when the network says ready but the table
+    hasn't caught up). The page is expected to be filtered by _goto_created_assets, so the
+    table only holds these assets however many the account has.
+    """
+    rows = {n: _asset_row(page, n) for n in names}
+    query = _asset_query(names)
+    deadline = time.monotonic() + ASSET_READY_TIMEOUT
+    interval, reload_after = 0.5, 30.0
+    last_nav = time.monotonic()
+    ready_since: Dict[str, float] = {}
+    rows_seen = set()
+
+    while True:
+        if ASSET_LIST_URL:
+            await watcher.poll_list(query)
+        for name, asset_row in rows.items():
+            if watcher.is_failed(name):
+                raise AssetProcessingFailed(name, watcher.status[name])
+            try:
+                if await asset_row.count() == 0:
+                    continue
+                if name not in rows_seen:
+                    rows_seen.add(name)
+                    log("INFO", "asset:row_visible", asset_name=name)
+                    if on_row:
+                        on_row(name)
+                download_button = asset_row.locator('[data-sentry-component="DownloadButton"]').first
+                if await download_button.count() > 0 and await download_button.is_enabled():
+                    log("INFO", "asset:processed_ready", asset_name=name, portal_status=watcher.status.get(name))
+                    return name, download_button
+            except Exception as e:
+                log("DEBUG", "asset:poll_error", asset_name=name, error=str(e))
+
+        now = time.monotonic()
+        if now >= deadline:
+            raise TimeoutError(f"Assets {names} not downloadable after {ASSET_READY_TIMEOUT}s "
+                               f"(rows_seen={sorted(rows_seen)}, portal_status={watcher.status})")
+
+        for name in names:
+            if watcher.is_ready(name):
+                ready_since.setdefault(name, now)
+            else:
+                ready_since.pop(name, None)
+        stale_ready = any(now - t > 5 for t in ready_since.values())
+        rows_missing = len(rows_seen) < len(names) and now - last_nav > reload_after
+        if stale_ready or rows_missing:
+            log("INFO", "asset:reload", assets=names, reason="stale_ready" if stale_ready else "row_missing")
+            await page.reload(wait_until="domcontentloaded")
+            last_nav = time.monotonic()
+            ready_since.clear()
+            reload_after = min(reload_after * 2, 120.0)
+            interval = 0.5
+            continue
+
+        await watcher.changed(timeout=min(interval, max(0.0, deadline - now)))
+        interval = min(interval * 1.5, ASSET_POLL_MAX_INTERVAL)
+
+
+async def _wait_asset_ready(page: Page, watcher: AssetWatcher, asset_name: str, on_row=None):
+    """Wait until the asset's download button is enabled and return it."""
+    _, download_button = await _wait_any_asset_ready(page, watcher, [asset_name], on_row)
+    return download_button
+
+
+def _upload_label(upload: Union[Path, dict]) -> str:
+    return f"memory:{upload['name']}" if isinstance(upload, dict) else str(upload)
+
+def _new_asset_name(prefix: Optional[str] = None, index: Optional[int] = None) -> str:
+    """Unique asset name; pass a shared `prefix` (itself a _new_asset_name()) to name a batch."""
+    if prefix is not None:
+        return f"{prefix}_{index:03d}"  # fixed width: no name is a prefix of a sibling's
     base_asset_name = os.getenv("BASE_ASSET_NAME", "TestAsset")
     # Use more unique identifier to avoid collisions
-    asset_name = f"{base_asset_name}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
-    log("INFO", "asset_flow:start", asset_name=asset_name, upload=str(file_to_upload))
+    return f"{base_asset_name}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
 
-    try:
-        # Navigate to upload modal (handles login if needed)
-        await navigate_to_upload_modal(page)
-        
-        # Find and fill asset name
-        asset_name_field = page.get_by_placeholder("Enter asset name")
-        await asset_name_field.clear()  # Clear any existing text
-        await type_like_human(asset_name_field, asset_name)
-
-        # Upload file
-        file_input = page.locator("input[type='file']").first
-        if await file_input.count() > 0:
-            await file_input.set_input_files(str(file_to_upload))
-        else:
-            async with page.expect_file_chooser() as fc_info:
-                dropzone = page.locator(".cfxui__InputDropzone__dropzone__bde8d")
-                await expect(dropzone).to_be_visible()
-                await human_delay()
-                await dropzone.click()
-            file_chooser = await fc_info.value
-            await file_chooser.set_files(str(file_to_upload))
-        log("INFO", "upload:file_selected")
-
-        upload_button = page.get_by_role("button", name="Upload File")
-        await expect(upload_button).to_be_enabled()
-        await upload_button.click()
-        log("INFO", "upload:clicked")
-
-        await expect(upload_button).to_be_hidden(timeout=90000)
-        log("INFO", "upload:complete")
-        await human_delay()
+async def _submit_upload(page: Page, file_to_upload: Union[Path, dict], asset_name: str):
+    """Create one asset through the upload modal and wait for the transfer to finish."""
+    # Validate file exists
+    if isinstance(file_to_upload, Path) and not file_to_upload.exists():
+        raise FileNotFoundError(f"Upload file not found: {file_to_upload}")
 
-        # Navigate to assets list to see the processing status
-        await page.goto("https://portal.cfx.re/assets/created-assets", wait_until="domcontentloaded")
-        await human_delay()
+    # Find and fill asset name
+    asset_name_field = page.get_by_placeholder("Enter asset name")
+    await asset_name_field.clear()  # Clear any existing text
+    await type_like_human(asset_name_field, asset_name)
 
-        # Try to find the asset row, it might require scrolling or filtering
-        asset_row = page.locator(f"tr:has-text('{asset_name}')")
-        
-        # Wait for the row to appear, with retries in case we need to refresh
-        for retry in range(3):
-            try:
-                await expect(asset_row).to_be_visible(timeout=30000)
-                break
-            except:
-                if retry < 2:
-                    log("INFO", "asset:not_visible_yet", retry=retry, asset_name=asset_name)
-                    await page.reload()
-                    await human_delay(2, 4)
-                else:
-                    raise
+    # Upload file
+    files = file_to_upload if isinstance(file_to_upload, dict) else str(file_to_upload)
+    file_input = page.locator("input[type='file']").first
+    if await file_input.count() > 0:
+        await file_input.set_input_files(files)
+    else:
+        async with page.expect_file_chooser() as fc_info:
+            dropzone = page.locator(".cfxui__InputDropzone__dropzone__bde8d")
+            await _wait("dropzone", expect(dropzone).to_be_visible())
+            await human_delay()
+            await dropzone.click()
+        file_chooser = await fc_info.value
+        await file_chooser.set_files(files)
+    log("INFO", "upload:file_selected", asset_name=asset_name)
+
+    upload_button = page.get_by_role("button", name="Upload File")
+    await _wait("upload_button", expect(upload_button).to_be_enabled())
+    await upload_button.click()
+    log("INFO", "upload:clicked", asset_name=asset_name)
 
-        download_button = asset_row.locator('[data-sentry-component="DownloadButton"]')
-        await expect(download_button).to_be_enabled(timeout=120000)
-        log("INFO", "asset:processed_ready")
+    async with Timer("upload.wait", asset_name=asset_name):
+        await _wait("upload_transfer", expect(upload_button).to_be_hidden(timeout=90000))
+    log("INFO", "upload:complete", asset_name=asset_name)
+    await human_delay()
+
+async def _goto_created_assets(page: Page, names: List[str]):
+    """Navigate to the assets list, filtered down to `names`, to see the processing status."""
+    url = f"{CFX_PORTAL_URL}/assets/created-assets"
+    if ASSET_SEARCH_PARAM:
+        url += "?" + urllib.parse.urlencode({ASSET_SEARCH_PARAM: _asset_query(names)})
+    async with span("navigate:created_assets"):
+        await page.goto(url, wait_until="domcontentloaded")
+        await human_delay()
 
-        # More unique output filename
-        output_path = TMP_DIR / f"download_{uuid.uuid4().hex}_{int(time.time())}.zip"
+async def _download_asset(page: Page, download_button) -> Path:
+    # More unique output filename
+    output_path = TMP_DIR / f"download_{uuid.uuid4().hex}_{int(time.time())}.zip"
+    async with Timer("download", saved_to=str(output_path)):
         async with page.expect_download() as download_info:
             await download_button.click()
         download = await download_info.value
-        await download.save_as(str(output_path))
-        log("INFO", "download:complete", saved_to=str(output_path))
+        if STREAM_IO:
+            # Take over Playwright's own download artifact (a rename on the same filesystem)
+            # instead of copying it with save_as. This saves one local copy only: Playwright has
+            # already written the file to disk, and the publish stage multipart-uploads it from there.
+            await asyncio.to_thread(shutil.move, await download.path(), output_path)
+        else:
+            await download.save_as(str(output_path))
+    log("INFO", "download:complete", saved_to=str(output_path))
+    return output_path
+
+async def _return_to_upload_modal(page: Page):
+    # Always try to navigate back to upload modal for next request
+    try:
+        async with span("navigate:return_to_modal"):
+            await page.goto(f"{CFX_PORTAL_URL}/assets/created-assets?modal=create",
+                            wait_until="domcontentloaded", timeout=15000)
+    except Exception as e:
+        log("WARNING", "navigation:cleanup_failed", error=str(e))
+
+async def run_asset_flow(page: Page, file_to_upload: Union[Path, dict],
+                         checkpoint: Optional[AssetCheckpoint] = None) -> Path:
+    """
+    file_to_upload is a path on disk or an in-memory Playwright file payload (see s3_download_input).
+    Progress is recorded in `checkpoint`; passing it back in resumes after the last completed stage.
+    """
+    cp = checkpoint or AssetCheckpoint()
+    if cp.reached("downloaded"):
+        return cp.out_path
+    if not cp.reached("uploaded"):
+        cp.restart()
+        cp.asset_name = _new_asset_name()
+    asset_name = cp.asset_name
+    log("INFO", "asset_flow:start", asset_name=asset_name, upload=_upload_label(file_to_upload), resume_from=cp.stage)
+
+    watcher = AssetWatcher(page, [asset_name]).attach()
+    try:
+        if not cp.reached("uploaded"):
+            # Navigate to upload modal (handles login if needed)
+            await navigate_to_upload_modal(page)
+            cp.advance("navigated")
+            await _submit_upload(page, file_to_upload, asset_name)
+            cp.advance("uploaded", account=account_scheduler.account_for(page).name)
+        await _goto_created_assets(page, [asset_name])
+
+        # Wait for processing to finish (portal XHR status, DOM polling as fallback)
+        async with Timer("processing.wait", asset_name=asset_name):
+            download_button = await _wait_asset_ready(page, watcher, asset_name,
+                                                      on_row=lambda _: cp.advance("row_visible"))
+        cp.advance("ready")
+        out_path = await _download_asset(page, download_button)
+        cp.advance("downloaded", out_path=out_path)
+        return out_path
+
+    finally:
+        watcher.detach()
+        await _return_to_upload_modal(page)
+
+async def run_batch_asset_flow(page: Page, uploads: List[Union[Path, dict]],
+                               checkpoints: Optional[List[AssetCheckpoint]] = None) -> List[Union[Path, Exception]]:
+    """
+    Upload every input back to back through the create modal, then watch the created-assets
+    list once and download each asset as soon as the portal finishes it, so server-side
+    processing overlaps. Returns one output path or exception per input, in order; each
+    input's checkpoint lets a single-record retry pick up where the batch left it.
+    """
+    checkpoints = checkpoints or [AssetCheckpoint() for _ in uploads]
+    prefix = _new_asset_name()
+    for i, cp in enumerate(checkpoints):
+        cp.restart()
+        cp.asset_name = _new_asset_name(prefix, i)
+    names = [cp.asset_name for cp in checkpoints]
+    index = {name: i for i, name in enumerate(names)}
+    results: List[Union[Path, Exception, None]] = [None] * len(uploads)
+    log("INFO", "batch_flow:start", size=len(uploads), asset_names=names)
+
+    watcher = AssetWatcher(page, names).attach()
+    try:
+        account = account_scheduler.account_for(page).name
+        for i, upload in enumerate(uploads):
+            try:
+                await navigate_to_upload_modal(page)
+                checkpoints[i].advance("navigated")
+                await _submit_upload(page, upload, names[i])
+                checkpoints[i].advance("uploaded", account=account)
+            except Exception as e:
+                log("WARNING", "batch_flow:upload_failed", asset_name=names[i], error=str(e))
+                results[i] = e
+
+        pending = {names[i]: i for i, r in enumerate(results) if r is None}
+        if pending:
+            await _goto_created_assets(page, list(pending))
+        while pending:
+            try:
+                async with Timer("processing.wait", pending=len(pending)):
+                    name, download_button = await _wait_any_asset_ready(
+                        page, watcher, list(pending), on_row=lambda n: checkpoints[index[n]].advance("row_visible"))
+                cp = checkpoints[index[name]]
+                cp.advance("ready")
+                out_path = await _download_asset(page, download_button)
+                cp.advance("downloaded", out_path=out_path)
+                results[pending.pop(name)] = out_path
+            except AssetProcessingFailed as e:
+                results[pending.pop(e.asset_name)] = e
+                checkpoints[index[e.asset_name]].restart()
+            except Exception as e:
+                # Timeout or broken page: give up on whatever is still outstanding
+                for i in pending.values():
+                    results[i] = e
+                pending.clear()
 
-        return output_path
+        log("INFO", "batch_flow:end", ok=sum(isinstance(r, Path) for r in results), size=len(uploads))
+        return results
 
     finally:
-        # Always try to navigate back to upload modal for next request
+        watcher.detach()
+        await _return_to_upload_modal(page)
+
+# ================
+# Failure artifacts
+# ================
+def _error_signature(exc: BaseException, stage: str) -> str:
+    """Stable grouping key for sampling: stage, exception type and the message minus ids/numbers."""
+    first_line = (str(exc).splitlines() or [""])[0]
+    return f"{stage}:{type(exc).__name__}:{re.sub(r'[0-9a-f]{8,}|[0-9]+', '#', first_line)[:120]}"
+
+def _artifact_body(data: Union[bytes, Path], name: str) -> bytes:
+    body = data.read_bytes() if isinstance(data, Path) else data
+    return gzip.compress(body, compresslevel=6) if name.endswith(".gz") else body
+
+
+class ArtifactUploader:
+    """
+    Uploads failure artifacts off the record's critical path. Captures are sampled per error
+    signature (the first ARTIFACT_SAMPLE_FIRST, then ARTIFACT_SAMPLE_RATE), compressed and
+    uploaded by a background task, and capped at ARTIFACT_BUDGET_MB per rolling hour.
+    """
+    def __init__(self):
+        self._loop = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._seen: Dict[str, int] = {}
+        self._sent = deque()  # (monotonic, bytes) uploaded within the last hour
+        self.dropped = 0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task and self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=max(1, ARTIFACT_QUEUE_MAX))
+        self._task = asyncio.create_task(self._run())
+
+    def should_capture(self, signature: str) -> bool:
+        if not DEBUG:
+            return False
+        seen = self._seen[signature] = self._seen.get(signature, 0) + 1
+        return seen <= ARTIFACT_SAMPLE_FIRST or random.random() < ARTIFACT_SAMPLE_RATE
+
+    def submit(self, bucket: str, dbg_tag: str, signature: str, files: List[Tuple[str, Union[bytes, Path]]]):
+        """Queue (name, bytes-or-path) files for DEBUG_PREFIX/dbg_tag/; never blocks."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((bucket, dbg_tag, signature, files))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            log("WARNING", "artifacts:dropped", reason="queue_full", signature=signature, dropped=self.dropped)
+            for _, data in files:
+                _unlink_quietly(data if isinstance(data, Path) else None)
+
+    def _budget_left(self) -> float:
+        if ARTIFACT_BUDGET_MB <= 0:
+            return float("inf")
+        now = time.monotonic()
+        while self._sent and now - self._sent[0][0] > 3600:
+            self._sent.popleft()
+        return ARTIFACT_BUDGET_MB * 1048576 - sum(n for _, n in self._sent)
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._upload(*item)
+            except Exception as e:
+                log("ERROR", "debug_artifact_upload_failed", error=str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _upload(self, bucket: str, dbg_tag: str, signature: str, files):
+        try:
+            for name, data in files:
+                body = await asyncio.to_thread(_artifact_body, data, name)
+                if len(body) > self._budget_left():
+                    log("WARNING", "artifacts:dropped", reason="budget", signature=signature, file=name, bytes=len(body))
+                    continue
+                key = f"{DEBUG_PREFIX}{dbg_tag}/{name}"
+                await asyncio.to_thread(s3.put_object, Bucket=bucket, Key=key, Body=body)
+                self._sent.append((time.monotonic(), len(body)))
+                log("INFO", "artifacts:uploaded", key=key, bytes=len(body), signature=signature)
+        finally:
+            for _, data in files:
+                _unlink_quietly(data if isinstance(data, Path) else None)
+
+    async def drain(self, timeout: float = 30.0):
+        """Wait for queued artifacts to be uploaded (shutdown, end of a Lambda invocation)."""
+        if not self._task or self._loop is not asyncio.get_running_loop():
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log("WARNING", "artifacts:drain_timeout", pending=self._queue.qsize())
+
+    async def close(self, timeout: float = 30.0):
+        await self.drain(timeout)
+        if self._task and self._loop is asyncio.get_running_loop():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+artifact_uploader = ArtifactUploader()
+
+async def _trace_chunk(slot: BrowserSlot, path: Optional[Path] = None, start: bool = False) -> bool:
+    """Start, or stop (saving to `path` when given), the slot's per-record Playwright trace chunk."""
+    if not ARTIFACT_TRACES or not slot.context:
+        return False
+    try:
+        if start:
+            await slot.context.tracing.start_chunk()
+        else:
+            await slot.context.tracing.stop_chunk(path=str(path) if path else None)
+        return True
+    except Exception as e:
+        # e.g. the context was recycled by a retry and has no open chunk
+        log("DEBUG", "artifacts:trace_error", start=start, error=str(e))
+        return False
+
+async def _capture_failure(slot: BrowserSlot, page: Optional[Page]) -> List[Tuple[str, Union[bytes, Path]]]:
+    """Grab what the failing page looks like, in memory; compression and upload happen later."""
+    files: List[Tuple[str, Union[bytes, Path]]] = []
+    if page:
+        try:
+            files.append(("error.png", await page.screenshot(full_page=ARTIFACT_FULL_PAGE, timeout=5000)))
+        except Exception:
+            pass
+        try:
+            html = await asyncio.wait_for(page.content(), timeout=5)
+            files.append(("error.html.gz", html.encode("utf-8", errors="ignore")))
+        except Exception:
+            pass
+    trace_path = TMP_DIR / f"trace_{uuid.uuid4().hex}.zip"
+    if await _trace_chunk(slot, trace_path) and trace_path.exists():
+        files.append(("trace.zip", trace_path))
+    return files
+
+
+async def process_with_persistent_browser(upload_zip: Union[Path, dict], dbg_tag: str, debug_bucket: str,
+                                          checkpoint: Optional[AssetCheckpoint] = None):
+    """
+    Process using a page leased from the persistent browser pool.
+    Failure artifacts go to `debug_bucket` in the background (see ArtifactUploader).
+    `checkpoint` (e.g. from a batch run) resumes an input that already got part of the way.
+    """
+    page = None
+    cp = checkpoint or AssetCheckpoint()
+
+    # Retries resume at the stage that failed, under that stage's policy
+    async def _with_retries(slot):
+        nonlocal page
+        while True:
+            try:
+                return await run_asset_flow(page, upload_zip, cp)
+            except Exception as e:
+                kind = _classify_error(e)
+                stage = "reupload" if kind == "reupload" else cp.pending
+                cp.attempts[stage] = cp.attempts.get(stage, 0) + 1
+                attempts, delays = STAGE_RETRY_POLICY[stage]
+                log("WARNING", "retry", stage=stage, kind=kind, attempt=cp.attempts[stage], slot=slot.index,
+                    asset_name=cp.asset_name, error=str(e))
+                if kind == "fatal" or cp.attempts[stage] >= attempts:
+                    raise
+                RETRIES.inc(stage=stage, kind=kind)
+                if kind == "reupload":
+                    cp.restart()
+                elif kind == "session":
+                    await account_scheduler.mark_logged_out(page)
+                await asyncio.sleep(delays[min(cp.attempts[stage], len(delays)) - 1])
+                # Re-check the leased slot in case its page is broken
+                page = await slot.pool.refresh(slot)
+
+    # Lease a context/page for this record; an uploaded asset can only be resumed on its own account
+    async with account_scheduler.lease(prefer=cp.account if cp.reached("uploaded") else None) as slot:
         try:
-            await page.goto("https://portal.cfx.re/assets/created-assets?modal=create", 
-                          wait_until="domcontentloaded", timeout=15000)
+            page = slot.page
+            if cp.reached("uploaded") and cp.account != slot.pool.account.name:
+                log("WARNING", "checkpoint:account_unavailable", account=cp.account, asset_name=cp.asset_name)
+                cp.restart()
+
+            await _trace_chunk(slot, start=True)
+            async with Timer("camoufox_run", dbg_tag=dbg_tag, slot=slot.index, resume_from=cp.stage):
+                result = await _with_retries(slot)
+            await _trace_chunk(slot)  # discard the chunk of a successful record
+
+            return result
+
         except Exception as e:
-            log("WARNING", "navigation:cleanup_failed", error=str(e))
+            # Capture (sampled) while the page is still ours; upload happens after the lease is back
+            signature = _error_signature(e, cp.pending)
+            files = []
+            if artifact_uploader.should_capture(signature):
+                files = await _capture_failure(slot, page)
+            else:
+                await _trace_chunk(slot)
+            if files:
+                artifact_uploader.submit(debug_bucket, dbg_tag, signature, files)
+            log("ERROR", "exception", error=str(e), signature=signature, artifacts=[n for n, _ in files],
+                traceback="".join(traceback.format_exc()))
+            raise
+
+async def process_batch_with_persistent_browser(uploads: List[Union[Path, dict]],
+                                                checkpoints: Optional[List[AssetCheckpoint]] = None
+                                                ) -> List[Union[Path, Exception]]:
+    """Run a batch of uploads through one leased slot; per-input failures are returned, not raised."""
+    try:
+        async with account_scheduler.lease() as slot:
+            async with Timer("camoufox_batch_run", size=len(uploads), slot=slot.index):
+                return await run_batch_asset_flow(slot.page, uploads, checkpoints)
+    except Exception as e:
+        log("ERROR", "batch_flow:error", error=str(e), traceback="".join(traceback.format_exc()))
+        return [e] * len(uploads)
+
+# ================
+# Per-record processing
+# ================
+class RecordJob:
+    """One S3 record travelling through the download -> browser -> publish stages."""
+    def __init__(self, bucket: str, key: str, rel: str, debug_bucket: str, size: Optional[int] = None):
+        self.bucket = bucket
+        self.key = key
+        self.rel = rel
+        self.size = size
+        self.debug_bucket = debug_bucket
+        self.request_id = _ctx_request_id.get()
+        self.span = _ctx_span.get()  # the record's trace root, for spans opened by stage workers
+        self.dbg_tag = pathlib.Path(rel).stem or uuid.uuid4().hex
+        # More unique filenames to avoid collisions
+        self.in_path: Optional[Path] = TMP_DIR / f"input_{uuid.uuid4().hex}_{int(time.time())}.zip"
+        self.upload: Union[Path, dict, None] = None  # in_path, or an in-memory payload with STREAM_IO
+        self.sha256: Optional[str] = None
+        self.cached: Optional[Dict[str, str]] = None  # result cache entry when the browser can be skipped
+        self.out_path: Optional[Path] = None
+        self.asset: Optional[Tuple[str, str]] = None  # (asset name, account) the portal run created
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def enter(self):
+        """Point the log context at this record (stage workers are shared)."""
+        _ctx_request_id.set(self.request_id)
+        _ctx_s3_bucket.set(self.bucket)
+        _ctx_s3_key.set(self.key)
+        _ctx_span.set(self.span)
+
+    @property
+    def out_bucket(self) -> str:
+        return S3_BUCKET or self.bucket
+
+    @property
+    def out_key(self) -> str:
+        return f"{OUTPUT_PREFIX}{self.rel}"
+
+    def drop_input(self):
+        _unlink_quietly(self.in_path)
+        self.in_path = self.upload = None
+
+    def cleanup(self):
+        for p in (self.in_path, self.out_path):
+            _unlink_quietly(p)
+        self.in_path = self.out_path = self.upload = None
+
 
-async def process_with_persistent_browser(upload_zip: Path, dbg_tag: str, s3_debug_uploader):
+def _unlink_quietly(p: Optional[Path]):
+    try:
+        if p and isinstance(p, Path) and p.exists():
+            p.unlink()
+    except Exception:
+        pass
+
+
+class RecordPipeline:
     """
-    Process using persistent browser instance.
-    s3_debug_uploader(local_path: Path, key_suffix: str) -> awaitable
+    Staged record processing with bounded hand-offs so the browser never waits on S3:
+      download workers -> [prefetched inputs] -> browser workers -> [outputs] -> publish workers
     """
-    screenshot_path = html_path = None
-    
-    # simple retry wrapper for transient UI flakiness
-    async def _with_retries(fn, *args, **kwargs):
-        delays = [1, 2, 4]  # seconds
-        last_exc = None
-        for attempt, d in enumerate([0] + delays, start=1):
-            if d: await asyncio.sleep(d)
+    def __init__(self):
+        self._tasks = []
+        self._loop = None
+        self._intake: Optional[asyncio.Queue] = None
+        self._ready: Optional[asyncio.Queue] = None
+        self._publish: Optional[asyncio.Queue] = None
+        self._prefetch: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.idle_since = time.monotonic()
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._tasks and self._loop is loop:
+            return
+        # First use, or the previous loop is gone (e.g. one asyncio.run per Lambda invocation)
+        self._loop = loop
+        self._intake = asyncio.Queue()
+        self._ready = asyncio.Queue()
+        self._publish = asyncio.Queue(maxsize=max(1, PIPELINE_PUBLISH_QUEUE))
+        # Caps inputs sitting on disk waiting for a browser slot
+        self._prefetch = asyncio.Semaphore(max(1, PIPELINE_PREFETCH))
+        workers = (
+            [self._download_worker] * max(1, PIPELINE_DOWNLOAD_WORKERS)
+            + [self._browser_worker] * account_scheduler.size
+            + [self._publish_worker] * max(1, PIPELINE_PUBLISH_WORKERS)
+        )
+        self._tasks = [asyncio.create_task(w()) for w in workers]
+        log("INFO", "pipeline:start", download_workers=PIPELINE_DOWNLOAD_WORKERS,
+            browser_workers=account_scheduler.size, publish_workers=PIPELINE_PUBLISH_WORKERS,
+            prefetch=PIPELINE_PREFETCH)
+
+    async def submit(self, job: RecordJob):
+        """Queue a record and wait for its result."""
+        self._ensure_started()
+        RECORDS_IN_FLIGHT.inc()
+        self.active += 1
+        try:
+            await self._intake.put(job)
+            result = await job.future
+        except Exception:
+            RECORDS.inc(result="error")
+            raise
+        finally:
+            RECORDS_IN_FLIGHT.dec()
+            self.active -= 1
+            if not self.active:
+                self.idle_since = time.monotonic()
+        RECORDS.inc(result="cached" if job.cached else "ok")
+        return result
+
+    def idle_for(self, seconds: float) -> bool:
+        """No record has been in flight for at least `seconds`."""
+        return not self.active and time.monotonic() - self.idle_since >= seconds
+
+    def depth(self) -> Dict[str, int]:
+        if not self._tasks:
+            return {"intake": 0, "ready": 0, "publish": 0}
+        return {"intake": self._intake.qsize(), "ready": self._ready.qsize(), "publish": self._publish.qsize()}
+
+    def _fail(self, job: RecordJob, exc: Exception):
+        job.cleanup()
+        if not job.future.done():
+            job.future.set_exception(exc)
+
+    async def _download_worker(self):
+        while True:
+            job = await self._intake.get()
+            await self._prefetch.acquire()
+            job.enter()
             try:
-                return await fn(*args, **kwargs)
+                hasher = hashlib.sha256() if RESULT_CACHE else None
+                async with Timer("s3.download", key=job.key, bucket=job.bucket):
+                    job.upload = await s3_download_input(job.bucket, job.key, job.in_path,
+                                                         pathlib.Path(job.rel).name, job.size, hasher)
+                if hasher is not None:
+                    job.sha256 = hasher.hexdigest()
+                    job.cached = await result_cache.lookup(job.out_bucket, job.sha256)
             except Exception as e:
-                last_exc = e
-                log("WARNING", "retry", attempt=attempt, error=str(e))
-                # On retry, get fresh page in case current one is broken
-                if attempt < len(delays) + 1:
-                    try:
-                        await browser_pool.get_page()  # This will trigger health check
-                    except:
-                        pass
-        raise last_exc
+                self._prefetch.release()
+                self._fail(job, e)
+                continue
+            if job.cached:
+                # Already processed this exact zip: skip the browser entirely
+                self._prefetch.release()
+                job.drop_input()
+                await self._publish.put(job)
+                continue
+            self._ready.put_nowait(job)
 
-    page = None
-    try:
-        # Get page from browser pool
-        page = await browser_pool.get_page()
-        
-        async with Timer("camoufox_run", dbg_tag=dbg_tag):
-            result = await _with_retries(run_asset_flow, page, upload_zip)
-        
-        return result
+    async def _browser_worker(self):
+        while True:
+            job = await self._ready.get()
+            self._prefetch.release()
+            if BATCH_UPLOAD_MAX > 1 and not self._ready.empty():
+                batch = [job]
+                while len(batch) < BATCH_UPLOAD_MAX and not self._ready.empty():
+                    batch.append(self._ready.get_nowait())
+                    self._prefetch.release()
+                await self._run_batch(batch)
+                continue
+            job.enter()
+            cp = AssetCheckpoint()
+            try:
+                async with Timer("process_with_persistent_browser", rel=job.rel):
+                    job.out_path = await process_with_persistent_browser(job.upload, job.dbg_tag, job.debug_bucket, cp)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            job.asset = (cp.asset_name, cp.account)
+            job.drop_input()
+            # Blocks only when publishing falls far behind
+            await self._publish.put(job)
 
-    except Exception as e:
-        # Artifacts on failure
-        err_id = uuid.uuid4().hex
-        screenshot_path = TMP_DIR / f"error_{err_id}.png"
-        html_path = TMP_DIR / f"error_{err_id}.html"
+    async def _run_batch(self, batch: List[RecordJob]):
+        batch[0].enter()  # the shared browser run is traced under the first record
+        log("INFO", "pipeline:batch", size=len(batch), keys=[j.key for j in batch])
+        checkpoints = [AssetCheckpoint() for _ in batch]
+        outputs = await process_batch_with_persistent_browser([j.upload for j in batch], checkpoints)
+        for job, out, cp in zip(batch, outputs, checkpoints):
+            job.enter()
+            if isinstance(out, Path):
+                job.out_path = out
+            else:
+                # Anything the batch couldn't finish goes through the single-record flow, resuming
+                # from its checkpoint (e.g. re-polling an asset that was already uploaded)
+                log("WARNING", "batch_flow:fallback", error=str(out), resume_from=cp.stage, asset_name=cp.asset_name)
+                try:
+                    job.out_path = await process_with_persistent_browser(job.upload, job.dbg_tag, job.debug_bucket, cp)
+                except Exception as e:
+                    self._fail(job, e)
+                    continue
+            job.asset = (cp.asset_name, cp.account)
+            job.drop_input()
+            await self._publish.put(job)
 
-        # Try to capture debug info if page is available
-        if page:
-            try:
-                await page.screenshot(path=str(screenshot_path), full_page=True)
-            except Exception:
-                pass
+    async def _publish_worker(self):
+        while True:
+            job = await self._publish.get()
+            job.enter()
             try:
-                html = await page.content()
-                html_path.write_text(html, encoding="utf-8", errors="ignore")
-            except Exception:
-                pass
+                result = await _publish_record(job)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            if asset_ledger and job.asset:
+                # The output is in S3 now, so the portal copy may be pruned later
+                await asset_ledger.record(*job.asset, job.out_bucket, job.out_key)
+            job.cleanup()
+            if not job.future.done():
+                job.future.set_result(result)
 
-        # Upload artifacts (best-effort)
-        try:
-            if DEBUG:
-                if screenshot_path and screenshot_path.exists():
-                    await s3_debug_uploader(screenshot_path, f"{DEBUG_PREFIX}{dbg_tag}/error.png")
-                if html_path and html_path.exists():
-                    await s3_debug_uploader(html_path, f"{DEBUG_PREFIX}{dbg_tag}/error.html")
-        except Exception as up_e:
-            log("ERROR", "debug_artifact_upload_failed", error=str(up_e))
+    async def close(self):
+        tasks, self._tasks = self._tasks, []
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-        log("ERROR", "exception", error=str(e), traceback="".join(traceback.format_exc()))
-        raise
+pipeline = RecordPipeline()
+
+
+async def _publish_record(job: RecordJob):
+    """Upload the processed output, then presign and notify."""
+    rel = job.rel
+    out_bucket = job.out_bucket
+    out_key = job.out_key
+
+    if job.cached:
+        src_bucket, src_key = job.cached["bucket"], job.cached["key"]
+        if (src_bucket, src_key) != (out_bucket, out_key):
+            async with Timer("s3.copy_cached_result", key=out_key, bucket=out_bucket):
+                await s3_copy(src_bucket, src_key, out_bucket, out_key)
+    else:
+        metadata = {"sha256": job.sha256} if job.sha256 else None
+        async with Timer("s3.upload_result", key=out_key, bucket=out_bucket):
+            await s3_upload(job.out_path, out_bucket, out_key, metadata=metadata)
+        if job.sha256:
+            await result_cache.store(out_bucket, job.sha256, out_bucket, out_key)
+
+    # Notify with presigned URL if configured
+    presigned_url = await generate_presigned_url(out_bucket, out_key)
+    webhook_url = os.getenv("DISCORD_WEBHOOK_URL")
+    if presigned_url and webhook_url:
+        message = f"🔒 @here Asset encryption has complete for `{rel}`!\n\Direct download link: {presigned_url} \n\n Please note that this URL will expire in 60 minutes."
+        await send_discord_notification(webhook_url, message)
+    else:
+        log("INFO", "discord.notification:skip",
+            reason="no_webhook_or_presign_failed",
+            has_webhook=bool(webhook_url), has_presigned=bool(presigned_url))
+
+    log("INFO", "done:record", output=f"s3://{out_bucket}/{out_key}", cached=bool(job.cached))
+    result = {"in": f"s3://{job.bucket}/{job.key}", "out": f"s3://{out_bucket}/{out_key}"}
+    if job.cached:
+        result["cached"] = True
+    return result
 
-    finally:
-        # cleanup artifacts
-        for p in (screenshot_path, html_path):
-            try:
-                if p and isinstance(p, Path) and p.exists(): p.unlink()
-            except Exception:
-                pass
 
-# ================
-# Per-record processing
-# ================
 async def _process_record(rec, debug_bucket_fallback: Optional[str]):
     """
     rec must be an S3-style record, e.g.:
       {"s3": {"bucket": {"name": "b"}, "object": {"key": "k"}}}
     """
+    # Root span of the record's trace; pipeline stages re-enter it through RecordJob.enter()
+    async with span("record", bucket=rec["s3"]["bucket"]["name"],
+                    key=urllib.parse.unquote_plus(rec["s3"]["object"]["key"])):
+        return await _run_record(rec, debug_bucket_fallback)
+
+async def _run_record(rec, debug_bucket_fallback: Optional[str]):
     bucket = rec["s3"]["bucket"]["name"]
     key = urllib.parse.unquote_plus(rec["s3"]["object"]["key"])
-    _current_ctx["s3_bucket"] = bucket
-    _current_ctx["s3_key"] = key
+    _ctx_s3_bucket.set(bucket)
+    _ctx_s3_key.set(key)
     log("INFO", "event:record", bucket=bucket, key=key)
 
     if OUTPUT_PREFIX and key.startswith(OUTPUT_PREFIX):
@@ -632,53 +2951,187 @@ async def _process_record(rec, debug_bucket_fallback: Optional[str]):
 
     rel = key[len(INPUT_PREFIX):] if INPUT_PREFIX else key
 
-    # More unique filenames to avoid collisions
-    unique_id = f"{uuid.uuid4().hex}_{int(time.time())}"
-    in_path = TMP_DIR / f"input_{unique_id}.zip"
-    out_path: Optional[Path] = None
-
     # figure debug bucket
     use_debug_bucket = DEBUG_BUCKET or S3_BUCKET or debug_bucket_fallback or bucket
-    dbg_tag = pathlib.Path(rel).stem or uuid.uuid4().hex
 
-    async def s3_debug_uploader(local_path: Path, dbg_key_suffix: str):
-        await s3_upload(local_path, use_debug_bucket, dbg_key_suffix)
+    size = rec["s3"]["object"].get("size")
+    job = RecordJob(bucket, key, rel, use_debug_bucket, size=size)
+    if not idempotency_ledger:
+        return await pipeline.submit(job)
+
+    # Idempotency: the same object version is processed once, however often it is delivered
+    _, _, etag = _record_identity(rec)
+    if not etag:
+        head = await asyncio.to_thread(s3.head_object, Bucket=bucket, Key=key)
+        etag = head["ETag"].strip('"')
+        job.size = job.size or head.get("ContentLength")
+    ident = f"{bucket}/{key}@{etag}"
+    ledger_bucket = S3_BUCKET or bucket
+    state, prior = await idempotency_ledger.acquire(ident, ledger_bucket)
+    if state == "in_progress":
+        # Not a success: the claim may belong to a worker that died mid-record, and acking
+        # this delivery would lose the record. Fail it so the message comes back later.
+        log("INFO", "skip:in_progress", etag=etag)
+        raise RecordInProgress(f"s3://{bucket}/{key} is already being processed")
+    if state != "acquired":
+        log("INFO", "skip:duplicate", state=state, etag=etag)
+        return dict(prior or {"in": f"s3://{bucket}/{key}"}, duplicate=state)
 
     try:
-        async with Timer("s3.download", key=key, bucket=bucket):
-            await s3_download(bucket, key, in_path)
+        result = await pipeline.submit(job)
+    except BaseException:
+        try:
+            await idempotency_ledger.release(ident, ledger_bucket)
+        except Exception as e:
+            log("WARNING", "idempotency:release_error", error=str(e))
+        raise
+    try:
+        await idempotency_ledger.complete(ident, ledger_bucket, result)
+    except Exception as e:
+        log("WARNING", "idempotency:complete_error", error=str(e))
+    return result
 
-        async with Timer("process_with_persistent_browser", rel=rel):
-            out_path = await process_with_persistent_browser(in_path, dbg_tag, s3_debug_uploader)
+# ================
+# Portal housekeeping
+# ================
+class AssetLedger:
+    """Assets this service created, with where their output went; lives next to the idempotency ledger."""
+    def __init__(self, path: str):
+        self.path = path
+        with contextlib.closing(self._connect()) as db:
+            db.execute("CREATE TABLE IF NOT EXISTS assets (name TEXT PRIMARY KEY, account TEXT, out_bucket TEXT NOT NULL, "
+                       "out_key TEXT NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                       "created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+            db.commit()
 
-        out_bucket = S3_BUCKET or bucket
-        out_key = f"{OUTPUT_PREFIX}{rel}"
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
 
-        async with Timer("s3.upload_result", key=out_key, bucket=out_bucket):
-            await s3_upload(out_path, out_bucket, out_key)
-
-        # Notify with presigned URL if configured
-        presigned_url = await generate_presigned_url(out_bucket, out_key)
-        webhook_url = os.getenv("DISCORD_WEBHOOK_URL")
-        if presigned_url and webhook_url:
-            message = f"🔒 @here Asset encryption has complete for `{rel}`!\n\Direct download link: {presigned_url} \n\n Please note that this URL will expire in 60 minutes."
-            await send_discord_notification(webhook_url, message)
-        else:
-            log("INFO", "discord.notification:skip",
-                reason="no_webhook_or_presign_failed",
-                has_webhook=bool(webhook_url), has_presigned=bool(presigned_url))
+    def _record(self, name: str, account: Optional[str], out_bucket: str, out_key: str):
+        now = time.time()
+        with contextlib.closing(self._connect()) as db:
+            db.execute("INSERT OR IGNORE INTO assets (name, account, out_bucket, out_key, state, created_at, updated_at) "
+                       "VALUES (?, ?, ?, ?, 'pending', ?, ?)", (name, account, out_bucket, out_key, now, now))
 
-        log("INFO", "done:record", output=f"s3://{out_bucket}/{out_key}")
-        return {"in": f"s3://{bucket}/{key}", "out": f"s3://{out_bucket}/{out_key}"}
+    def _due(self, accounts: List[str], limit: int) -> List[dict]:
+        cutoff = time.time() - HOUSEKEEPING_MIN_AGE
+        marks = ",".join("?" * len(accounts))
+        with contextlib.closing(self._connect()) as db:
+            rows = db.execute(f"SELECT name, account, out_bucket, out_key, attempts FROM assets WHERE state = 'pending' "
+                              f"AND created_at < ? AND account IN ({marks}) ORDER BY updated_at LIMIT ?",
+                              (cutoff, *accounts, limit)).fetchall()
+        return [dict(zip(("name", "account", "out_bucket", "out_key", "attempts"), r)) for r in rows]
 
-    finally:
-        # cleanup tmp files
-        for p in (in_path, out_path):
+    def _mark(self, name: str, state: str, attempts: Optional[int] = None):
+        with contextlib.closing(self._connect()) as db:
+            db.execute("UPDATE assets SET state = ?, attempts = COALESCE(?, attempts), updated_at = ? WHERE name = ?",
+                       (state, attempts, time.time(), name))
+
+    async def record(self, name: str, account: Optional[str], out_bucket: str, out_key: str):
+        try:
+            await asyncio.to_thread(self._record, name, account, out_bucket, out_key)
+        except Exception as e:
+            log("WARNING", "housekeeping:record_error", asset_name=name, error=str(e))
+
+    async def due(self, accounts: List[str], limit: int) -> List[dict]:
+        return await asyncio.to_thread(self._due, accounts, limit)
+
+    async def mark(self, name: str, state: str, attempts: Optional[int] = None):
+        await asyncio.to_thread(self._mark, name, state, attempts)
+
+asset_ledger = AssetLedger(HOUSEKEEPING_SQLITE_PATH) if HOUSEKEEPING else None
+
+
+class Housekeeper:
+    """
+    Prunes ledger assets from the portal while the pipeline is idle: at most HOUSEKEEPING_BATCH
+    per pass, HOUSEKEEPING_RATE per minute, and only after the output is confirmed in S3.
+    A record arriving mid-pass stops the pass before the next asset.
+    """
+    MAX_ATTEMPTS = 3
+
+    def __init__(self):
+        self._last_action = 0.0
+        self._reported = set()  # dry run: names already logged
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(min(HOUSEKEEPING_IDLE_SECONDS, 30.0))
+            if not pipeline.idle_for(HOUSEKEEPING_IDLE_SECONDS):
+                continue
             try:
-                if p and isinstance(p, Path) and p.exists():
-                    p.unlink()
-            except Exception:
-                pass
+                await self.run_pass()
+            except Exception as e:
+                log("ERROR", "housekeeping:pass_failed", error=str(e))
+
+    async def run_pass(self):
+        accounts = [p.account.name for p in account_scheduler.pools if not p.account.fenced()]
+        due = [a for a in await asset_ledger.due(accounts, HOUSEKEEPING_BATCH * 4) if a["name"] not in self._reported]
+        done = 0
+        for asset in due[:HOUSEKEEPING_BATCH]:
+            if not pipeline.idle_for(HOUSEKEEPING_IDLE_SECONDS):
+                log("INFO", "housekeeping:yield", reason="records_in_flight", pruned=done)
+                return
+            await asyncio.sleep(max(0.0, self._last_action + 60.0 / HOUSEKEEPING_RATE - time.monotonic()))
+            self._last_action = time.monotonic()
+            done += await self._prune(asset)
+        if due:
+            log("INFO", "housekeeping:pass", candidates=len(due), pruned=done, dry_run=HOUSEKEEPING_DRY_RUN)
+
+    async def _prune(self, asset: dict) -> bool:
+        name = asset["name"]
+        try:
+            await asyncio.to_thread(s3.head_object, Bucket=asset["out_bucket"], Key=asset["out_key"])
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                # The output is gone, so the portal copy is the only one left: keep it
+                log("WARNING", "housekeeping:output_missing", asset_name=name, output=asset["out_key"])
+                await asset_ledger.mark(name, "output_missing")
+            return False
+
+        if HOUSEKEEPING_DRY_RUN:
+            self._reported.add(name)
+            log("INFO", "housekeeping:would_prune", asset_name=name, account=asset["account"],
+                output=f"s3://{asset['out_bucket']}/{asset['out_key']}")
+            return False
+
+        attempts = asset["attempts"] + 1
+        try:
+            async with account_scheduler.lease(prefer=asset["account"]) as slot:
+                if slot.pool.account.name != asset["account"]:
+                    return False  # that account is fenced; its assets wait for the next pass
+                async with Timer("housekeeping.prune", asset_name=name, account=asset["account"]):
+                    state = await _prune_asset(slot.page, name)
+            await asset_ledger.mark(name, state, attempts)
+            log("INFO" if state != "ambiguous" else "WARNING", f"housekeeping:{state}", asset_name=name)
+            return state == "pruned"
+        except Exception as e:
+            state = "failed" if attempts >= self.MAX_ATTEMPTS else "pending"
+            await asset_ledger.mark(name, state, attempts)
+            log("WARNING", "housekeeping:prune_failed", asset_name=name, attempts=attempts, error=str(e))
+            return False
+
+async def _prune_asset(page: Page, name: str) -> str:
+    """Delete (or archive, per HOUSEKEEPING_ACTION_SELECTOR) one asset row; returns the ledger state."""
+    try:
+        await navigate_to_upload_modal(page)  # signs in again if the session lapsed
+        await _goto_created_assets(page, [name])
+        row = _asset_row(page, name)
+        try:
+            await row.first.wait_for(state="visible", timeout=15000)
+        except Exception:
+            return "missing"  # already removed by hand
+        if await row.count() != 1:
+            return "ambiguous"  # never guess which row to delete; left for a human to look at
+        await row.locator(HOUSEKEEPING_ACTION_SELECTOR).first.click()
+        if HOUSEKEEPING_CONFIRM_BUTTON:
+            await page.get_by_role("button", name=HOUSEKEEPING_CONFIRM_BUTTON, exact=True).click()
+        await _wait("prune_row_gone", expect(row).to_have_count(0, timeout=15000))
+        return "pruned"
+    finally:
+        await _return_to_upload_modal(page)
+
+housekeeper = Housekeeper()
 
 # ================
 # Event handler(s)
@@ -688,21 +3141,27 @@ def _as_s3_record(bucket: str, key: str):
     encoded_key = urllib.parse.quote_plus(key)
     return {"s3": {"bucket": {"name": bucket}, "object": {"key": encoded_key}}}
 
+def _event_records(event) -> list:
+    """Normalize to S3-style records list."""
+    records = []
+    if "Records" in event:
+        records = event["Records"]
+    elif event.get("bucket") and event.get("key"):
+        records = [_as_s3_record(event["bucket"], event["key"])]
+    elif event.get("records"):
+        for r in event["records"]:
+            if r.get("bucket") and r.get("key"):
+                records.append(_as_s3_record(r["bucket"], r["key"]))
+    return records
+
 async def async_handler(event, context):
     # simple health ping support
     if event.get("health_check") or event.get("rawPath") == "/healthz":
         return {"statusCode": 200, "body": "OK"}
 
-    _current_ctx["request_id"] = getattr(context, "aws_request_id", None)
+    _ctx_request_id.set(getattr(context, "aws_request_id", None))
 
     # Log sanitized config
-    original_max_parallel = int(os.getenv("MAX_PARALLEL", "1"))
-    if original_max_parallel > 1:
-        log("WARNING", "config:max_parallel_override", 
-            message="MAX_PARALLEL forced to 1 for persistent browser mode", 
-            requested=original_max_parallel, 
-            actual=MAX_PARALLEL)
-    
     log("INFO", "config",
         log_level=LOG_LEVEL,
         input_prefix=INPUT_PREFIX,
@@ -720,34 +3179,67 @@ async def async_handler(event, context):
         mode=MODE,
         disable_human_delays=DISABLE_HUMAN_DELAYS,
         browser_restart_after=BROWSER_RESTART_AFTER,
+        worker_processes=WORKER_PROCESSES,
+        worker_index=WORKER_INDEX,
+        metrics_enabled=METRICS_ENABLED,
+        metrics_port=METRICS_PORT,
+        trace_export_path=TRACE_EXPORT_PATH or None,
+        artifact_sample_first=ARTIFACT_SAMPLE_FIRST,
+        artifact_sample_rate=ARTIFACT_SAMPLE_RATE,
+        artifact_budget_mb=ARTIFACT_BUDGET_MB,
+        artifact_traces=ARTIFACT_TRACES,
+        log_async=LOG_ASYNC,
+        log_rate_limit=LOG_RATE_LIMIT,
+        log_sample=LOG_SAMPLE,
+        accounts=[p.account.name for p in account_scheduler.pools],
+        browser_retire_after=BROWSER_RETIRE_AFTER,
+        hot_spare=HOT_SPARE,
+        pipeline_prefetch=PIPELINE_PREFETCH,
+        stream_io=STREAM_IO,
+        result_cache=RESULT_CACHE,
+        asset_ready_timeout=ASSET_READY_TIMEOUT,
+        asset_search_param=ASSET_SEARCH_PARAM or None,
+        asset_list_url=ASSET_LIST_URL or None,
+        batch_upload_max=BATCH_UPLOAD_MAX,
+        route_filter=ROUTE_FILTER,
+        idempotency_backend=IDEMPOTENCY_BACKEND,
+        lambda_persistent_loop=LAMBDA_PERSISTENT_LOOP,
+        housekeeping=HOUSEKEEPING,
+        housekeeping_dry_run=HOUSEKEEPING_DRY_RUN,
+        session_state=SESSION_STATE_ENABLED,
+        session_state_s3=SESSION_STATE_S3,
     )
 
-    # Normalize to S3-style records list
-    records = []
-    if "Records" in event:
-        records = event["Records"]
-    elif event.get("bucket") and event.get("key"):
-        records = [_as_s3_record(event["bucket"], event["key"])]
-    elif event.get("records"):
-        for r in event["records"]:
-            if r.get("bucket") and r.get("key"):
-                records.append(_as_s3_record(r["bucket"], r["key"]))
-
+    records = _event_records(event)
     if not records:
         log("INFO", "no_records")
         return {"statusCode": 200, "body": json.dumps({"processed": []})}
 
-    # bounded concurrency
-    sem = asyncio.Semaphore(MAX_PARALLEL)
+    # Drop records repeated within this event (same bucket/key/ETag)
+    unique, seen = [], set()
+    for rec in records:
+        try:
+            ident = _record_identity(rec)
+        except (KeyError, TypeError):
+            unique.append(rec)
+            continue
+        if ident in seen:
+            log("INFO", "skip:duplicate_in_event", bucket=ident[0], key=ident[1])
+            continue
+        seen.add(ident)
+        unique.append(rec)
+    records = unique
+
+    # concurrency is bounded by the pipeline stages (download / browser slots / publish)
     results = []
 
     async def _guarded(rec):
-        async with sem:
-            try:
-                return await _process_record(rec, debug_bucket_fallback=records[0]["s3"]["bucket"]["name"])
-            except Exception as e:
-                log("ERROR", "record_failed", error=str(e))
-                return {"error": str(e)}
+        try:
+            return await _process_record(rec, debug_bucket_fallback=records[0]["s3"]["bucket"]["name"])
+        except Exception as e:
+            kind = "in_progress" if isinstance(e, RecordInProgress) else _classify_error(e)
+            log("ERROR", "record_failed", error=str(e), error_kind=kind)
+            return {"error": str(e), "error_kind": kind}
 
     processed = await asyncio.gather(*[_guarded(r) for r in records], return_exceptions=False)
     for item in processed:
@@ -756,18 +3248,378 @@ async def async_handler(event, context):
 
     return {"statusCode": 200, "body": json.dumps({"processed": results}, ensure_ascii=False)}
 
+_lambda_loop: Optional[asyncio.AbstractEventLoop] = None
+_lambda_last_invoke: Optional[float] = None  # wall clock; monotonic time may not advance while frozen
+_lambda_prewarm_task: Optional[asyncio.Task] = None
+
+def _lambda_run(coro):
+    """Run `coro` on the loop kept across invocations, so pools, locks and browsers stay usable."""
+    global _lambda_loop
+    if not LAMBDA_PERSISTENT_LOOP:
+        return asyncio.run(coro)
+    if _lambda_loop is None or _lambda_loop.is_closed():
+        _lambda_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_lambda_loop)
+    return _lambda_loop.run_until_complete(coro)
+
+async def _lambda_prewarm():
+    global _lambda_prewarm_task, _lambda_last_invoke
+    t0 = time.perf_counter()
+    _lambda_prewarm_task = asyncio.create_task(account_scheduler.prewarm())
+    # Init time is capped; whatever isn't done keeps going once the first invocation runs the loop
+    done, _ = await asyncio.wait({_lambda_prewarm_task}, timeout=LAMBDA_PREWARM_TIMEOUT)
+    log("INFO", "lambda:prewarm", finished=bool(done), seconds=round(time.perf_counter() - t0, 2))
+    _lambda_last_invoke = time.time()  # a long wait for the first event (provisioned concurrency) is a thaw too
+
+async def _lambda_invoke(event, context, health_check: bool):
+    global _lambda_last_invoke
+    now = time.time()
+    thawed = _lambda_last_invoke is not None and now - _lambda_last_invoke > LAMBDA_THAW_CHECK_AFTER
+    try:
+        if LAMBDA_PERSISTENT_LOOP and not health_check:
+            if _lambda_prewarm_task and not _lambda_prewarm_task.done():
+                await asyncio.wait({_lambda_prewarm_task})
+            elif thawed:
+                log("INFO", "lambda:thaw_check", idle_s=round(now - _lambda_last_invoke, 1))
+                await account_scheduler.thaw_check()
+        return await async_handler(event, context)
+    finally:
+        _lambda_last_invoke = time.time()
+        # Background artifact uploads must finish before the sandbox is frozen
+        await artifact_uploader.drain(timeout=10)
+
 def handler(event, context):
     """AWS Lambda entrypoint."""
+    health_check = bool(event.get("health_check") or event.get("rawPath") == "/healthz")
     # Validate config on first real request (not health checks)
-    if not event.get("health_check") and event.get("rawPath") != "/healthz":
+    if not health_check:
         validate_config()
-    return asyncio.run(async_handler(event, context))
+    try:
+        return _lambda_run(_lambda_invoke(event, context, health_check))
+    finally:
+        # The sandbox may be frozen as soon as we return
+        tracer.flush()
+        log_writer.flush()
+
+# ================
+# Worker processes (WORKER_PROCESSES > 1)
+# ================
+class WorkerProcess:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.restarts = 0
+
+
+class WorkerProcessPool:
+    """
+    Supervisor side: N spawned processes, each with its own event loop, BrowserPool and
+    pipeline. Events go over a Pipe to the least-busy worker. A worker that dies is
+    respawned, and the events it held fail so SQS redelivers / HTTP jobs report it.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.workers = [WorkerProcess(i) for i in range(size)]
+        self._mp = multiprocessing.get_context("spawn")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        for w in self.workers:
+            self._spawn(w)
+        self._monitor = asyncio.create_task(self._watch())
+        log("INFO", "workers:start", processes=self.size)
+
+    def capacity(self) -> int:
+        """Events the front should keep in flight to fill every worker's slots and prefetch."""
+        return self.size * (max(1, MAX_PARALLEL) + max(0, PIPELINE_PREFETCH))
+
+    def _spawn(self, w: WorkerProcess):
+        parent_conn, child_conn = self._mp.Pipe()
+        w.process = self._mp.Process(target=_worker_process_main, args=(w.index, child_conn),
+                                     name=f"cfx-worker-{w.index}")
+        w.process.start()
+        child_conn.close()
+        w.conn = parent_conn
+        threading.Thread(target=self._reader, args=(w, parent_conn), daemon=True).start()
+        log("INFO", "workers:spawned", worker=w.index, pid=w.process.pid, restarts=w.restarts)
+
+    def _reader(self, w: WorkerProcess, conn):
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                return
+            self._loop.call_soon_threadsafe(self._deliver, w, msg)
+
+    def _deliver(self, w: WorkerProcess, msg):
+        call_id, status, payload = msg
+        fut = w.in_flight.pop(call_id, None)
+        if fut and not fut.done():
+            if status == "ok":
+                fut.set_result(payload)
+            else:
+                fut.set_exception(RuntimeError(f"worker {w.index}: {payload}"))
+
+    def _live(self) -> List[WorkerProcess]:
+        return [w for w in self.workers if w.process and w.process.is_alive()]
+
+    def _send(self, w: WorkerProcess, kind: str, payload=None, request_id: Optional[str] = None) -> asyncio.Future:
+        call_id = uuid.uuid4().hex
+        fut = self._loop.create_future()
+        w.in_flight[call_id] = fut
+        try:
+            w.conn.send((call_id, kind, payload, request_id))
+        except Exception:
+            w.in_flight.pop(call_id, None)
+            raise
+        return fut
+
+    async def call(self, event: dict, request_id: Optional[str]) -> dict:
+        live = self._live()
+        if not live:
+            raise RuntimeError("no live worker processes")
+        w = min(live, key=lambda x: len(x.in_flight))
+        return await self._send(w, "event", event, request_id)
+
+    async def metrics(self, timeout: float = 2.0) -> List[Tuple[Dict[str, str], List[dict]]]:
+        """Metric snapshots from every live worker, labelled with its index."""
+        live = self._live()
+        replies = await asyncio.gather(
+            *(asyncio.wait_for(self._send(w, "metrics"), timeout) for w in live), return_exceptions=True)
+        return [({"worker": str(w.index)}, snap) for w, snap in zip(live, replies) if isinstance(snap, list)]
+
+    async def _watch(self):
+        while not self._closing:
+            await asyncio.sleep(1.0)
+            for w in self.workers:
+                if self._closing or (w.process and w.process.is_alive()):
+                    continue
+                code = w.process.exitcode if w.process else None
+                log("ERROR", "workers:crashed", worker=w.index, exitcode=code, in_flight=len(w.in_flight))
+                for fut in w.in_flight.values():
+                    if not fut.done():
+                        fut.set_exception(RuntimeError(f"worker {w.index} exited ({code})"))
+                w.in_flight.clear()
+                try:
+                    w.conn.close()
+                except Exception:
+                    pass
+                await asyncio.sleep(WORKER_RESTART_BACKOFF)
+                if not self._closing:
+                    w.restarts += 1
+                    self._spawn(w)
+
+    async def close(self, timeout: float = 30.0):
+        """Ask every worker to drain and exit; terminate any that don't within `timeout`."""
+        self._closing = True
+        if self._monitor:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+        for w in self.workers:
+            try:
+                w.conn.send((None, "stop", None, None))
+            except Exception:
+                pass
+        for w in self.workers:
+            if not w.process:
+                continue
+            await asyncio.to_thread(w.process.join, timeout)
+            if w.process.is_alive():
+                log("WARNING", "workers:terminate", worker=w.index)
+                w.process.terminate()
+                await asyncio.to_thread(w.process.join, 5)
+        log("INFO", "workers:stopped")
+
+worker_processes: Optional[WorkerProcessPool] = None  # set on the supervisor front
+
+async def _run_event(event: dict, ctx) -> dict:
+    """Handle one event here, or on a worker process when running as the supervisor front."""
+    if worker_processes:
+        return await worker_processes.call(event, getattr(ctx, "aws_request_id", None))
+    return await async_handler(event, ctx)
+
+async def render_metrics() -> str:
+    """This process's metrics, plus each worker process's when running as the supervisor front."""
+    extra = await worker_processes.metrics() if worker_processes else None
+    return metrics.render(extra)
+
+async def start_metrics_sidecar(port: int):
+    """Minimal HTTP listener for /metrics when no FastAPI app is running (SQS mode)."""
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass  # headers are irrelevant here
+            parts = request_line.split()
+            path = parts[1].split(b"?")[0] if len(parts) > 1 else b""
+            if path == b"/metrics":
+                status, body = "200 OK", (await render_metrics()).encode("utf-8")
+            elif path == b"/healthz":
+                status, body = "200 OK", b"ok\n"
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            log("DEBUG", "metrics:request_error", error=str(e))
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(_handle, "0.0.0.0", port)
+    log("INFO", "metrics:listening", port=port)
+    return server
+
+def _worker_concurrency() -> int:
+    """Events to keep in flight so every browser slot (in every worker process) stays busy."""
+    if worker_processes:
+        return worker_processes.capacity()
+    return max(1, int(MAX_PARALLEL)) + max(0, PIPELINE_PREFETCH)
+
+def _apply_worker_overrides(index: int):
+    """Per-worker settings for spawned worker processes."""
+    global PROXY_SERVER, WORKER_INDEX, account_scheduler
+    WORKER_INDEX = str(index)
+    os.environ["WORKER_INDEX"] = WORKER_INDEX
+    if WORKER_PROXY_SERVERS:
+        PROXY_SERVER = WORKER_PROXY_SERVERS[index % len(WORKER_PROXY_SERVERS)]
+    # Spread the accounts over the workers; with fewer accounts than workers, some are shared
+    accounts = _load_accounts()
+    if len(accounts) >= WORKER_PROCESSES:
+        accounts = accounts[index::WORKER_PROCESSES]
+    elif accounts:
+        accounts = [accounts[index % len(accounts)]]
+    account_scheduler = AccountScheduler(accounts, MAX_PARALLEL)
+
+def _worker_process_main(index: int, conn):
+    """Entry point of a spawned worker process."""
+    # The supervisor owns shutdown; a terminal Ctrl-C must not kill workers mid-record
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _apply_worker_overrides(index)
+    try:
+        asyncio.run(_worker_process_loop(index, conn))
+    finally:
+        tracer.flush()
+        log_writer.flush()
+
+async def _worker_process_loop(index: int, conn):
+    loop = asyncio.get_running_loop()
+    inbox: asyncio.Queue = asyncio.Queue()
+
+    def _reader():
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                msg = (None, "stop", None, None)  # supervisor went away
+            loop.call_soon_threadsafe(inbox.put_nowait, msg)
+            if msg[1] == "stop":
+                return
+
+    threading.Thread(target=_reader, daemon=True).start()
+    log("INFO", "worker:start", worker=index, pid=os.getpid(), proxy_server=PROXY_SERVER)
+    tasks = set()
+    # Each worker prunes the assets of its own accounts, between the records it is sent
+    housekeeping = asyncio.create_task(housekeeper.run()) if asset_ledger and MODE == "sqs" else None
+
+    async def _handle(call_id, event, request_id):
+        ctx = SimpleNamespace(aws_request_id=request_id or f"worker{index}-{uuid.uuid4().hex}")
+        try:
+            reply = (call_id, "ok", await async_handler(event, ctx))
+        except Exception as e:
+            reply = (call_id, "error", str(e))
+        try:
+            conn.send(reply)
+        except Exception as e:
+            log("ERROR", "worker:reply_failed", error=str(e))
+
+    try:
+        while True:
+            call_id, kind, event, request_id = await inbox.get()
+            if kind == "stop":
+                break
+            if kind == "metrics":
+                conn.send((call_id, "ok", metrics.snapshot()))
+                continue
+            task = asyncio.create_task(_handle(call_id, event, request_id))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(set(tasks), timeout=SQS_DRAIN_SECONDS)
+    finally:
+        if housekeeping:
+            housekeeping.cancel()
+            await asyncio.gather(housekeeping, return_exceptions=True)
+        await pipeline.close()
+        await artifact_uploader.close()
+        await account_scheduler.close()
+        log("INFO", "worker:stopped", worker=index)
 
 # ================
 # HTTP wrapper (FastAPI) for ECS / local
 # ================
+class JobStore:
+    """In-memory job records behind the async HTTP API; finished jobs expire after HTTP_JOB_TTL."""
+    def __init__(self):
+        self.jobs: Dict[str, dict] = {}
+        self._durations = deque(maxlen=50)
+
+    def create(self, record: dict) -> dict:
+        self.prune()
+        bucket, key, _ = _record_identity(record)
+        job = {"id": uuid.uuid4().hex, "status": "queued", "bucket": bucket, "key": key,
+               "created_at": time.time(), "started_at": None, "finished_at": None,
+               "result": None, "error": None}
+        self.jobs[job["id"]] = job
+        return job
+
+    def start(self, job: dict):
+        job.update(status="running", started_at=time.time())
+
+    def finish(self, job: dict, result=None, error: Optional[str] = None):
+        job.update(status="failed" if error else "succeeded", result=result, error=error, finished_at=time.time())
+        self._durations.append(job["finished_at"] - job["started_at"])
+
+    def prune(self):
+        cutoff = time.time() - HTTP_JOB_TTL
+        for jid in [j["id"] for j in self.jobs.values() if j["finished_at"] and j["finished_at"] < cutoff]:
+            del self.jobs[jid]
+
+    def retry_after(self, excess: int, concurrency: int) -> int:
+        """Rough seconds until `excess` jobs have drained, from recent job durations."""
+        avg = sum(self._durations) / len(self._durations) if self._durations else 60.0
+        return max(HTTP_RETRY_AFTER_MIN, int(avg * excess / max(1, concurrency)))
+
+    @staticmethod
+    def view(job: dict) -> dict:
+        return {k: v for k, v in job.items() if v is not None}
+
+job_store = JobStore()
+http_dispatcher = None  # WorkDispatcher, created at startup when HTTP_ASYNC_JOBS=1
+
+async def _run_http_job(job: dict, record: dict):
+    job_store.start(job)
+    ctx = SimpleNamespace(aws_request_id=f"job-{job['id']}")
+    try:
+        resp = await _run_event({"Records": [record]}, ctx)
+        errors = _failed_records(resp)
+        processed = json.loads(resp.get("body") or "{}").get("processed", [])
+        job_store.finish(job, result=processed[0] if processed else None, error=errors[0]["error"] if errors else None)
+    except Exception as e:
+        job_store.finish(job, error=str(e))
+        log("ERROR", "http.job:failed", job_id=job["id"], error=str(e))
+    log("INFO", "http.job:done", job_id=job["id"], status=job["status"])
+
 try:
     from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, PlainTextResponse
     import uvicorn
     app_srv = FastAPI()
 
@@ -775,19 +3627,89 @@ try:
     async def healthz():
         return {"status": "ok"}
 
+    @app_srv.get("/metrics")
+    async def metrics_endpoint():
+        if not METRICS_ENABLED:
+            return PlainTextResponse("metrics disabled\n", status_code=404)
+        return PlainTextResponse(await render_metrics(), media_type="text/plain; version=0.0.4")
+
     @app_srv.post("/s3-event")
     async def s3_event(req: Request):
-        event = await req.json()
+        try:
+            event = await req.json()
+        except ValueError:
+            return JSONResponse(status_code=400, content={"error": "invalid_json"})
         ctx = SimpleNamespace(aws_request_id=f"ecs-{uuid.uuid4().hex}")
         # Validate config on first real request
         validate_config()
-        return await async_handler(event, ctx)
-    
+        if not HTTP_ASYNC_JOBS:
+            return await _run_event(event, ctx)
+
+        # Job mode: enqueue and answer right away; clients poll GET /jobs/{id}
+        records = _event_records(event) if isinstance(event, dict) else []
+        # Check every record before creating any job, so a bad one can't strand the others
+        invalid = []
+        for i, rec in enumerate(records):
+            try:
+                bucket, key, _ = _record_identity(rec)
+                if not bucket or not key:
+                    raise ValueError("empty bucket or key")
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                invalid.append({"index": i, "error": f"{type(e).__name__}: {e}"})
+        if invalid:
+            log("WARNING", "http.job:bad_request", records=len(records), invalid=len(invalid))
+            return JSONResponse(status_code=400, content={"error": "invalid_records", "invalid": invalid})
+        backlog = http_dispatcher.pending() + http_dispatcher.in_flight()
+        if backlog + len(records) > HTTP_JOB_QUEUE_MAX:
+            retry_after = job_store.retry_after(backlog + len(records) - HTTP_JOB_QUEUE_MAX, http_dispatcher.concurrency)
+            log("WARNING", "http.job:shed", backlog=backlog, requested=len(records), retry_after=retry_after)
+            return JSONResponse(status_code=429, headers={"Retry-After": str(retry_after)},
+                                content={"error": "queue_full", "backlog": backlog, "retry_after": retry_after})
+        jobs = []
+        for rec in records:
+            job = job_store.create(rec)
+            http_dispatcher.submit(None, lambda j=job, r=rec: _run_http_job(j, r))
+            jobs.append({"id": job["id"], "status": job["status"], "key": job["key"], "status_url": f"/jobs/{job['id']}"})
+        log("INFO", "http.job:accepted", count=len(jobs), backlog=backlog + len(jobs))
+        return JSONResponse(status_code=202, content={"jobs": jobs})
+
+    @app_srv.get("/jobs/{job_id}")
+    async def job_status(job_id: str):
+        job = job_store.jobs.get(job_id)
+        if not job:
+            return JSONResponse(status_code=404, content={"error": "unknown_job", "id": job_id})
+        return JobStore.view(job)
+
+    @app_srv.get("/jobs")
+    async def jobs_status(ids: str = ""):
+        """Batch status: GET /jobs?ids=a,b,c"""
+        wanted = [i for i in ids.split(",") if i]
+        return {"jobs": [JobStore.view(job_store.jobs[i]) if i in job_store.jobs else {"id": i, "status": "unknown"}
+                         for i in wanted]}
+
+    @app_srv.on_event("startup")
+    async def startup_event():
+        global http_dispatcher, worker_processes
+        if WORKER_PROCESSES > 1:
+            worker_processes = WorkerProcessPool(WORKER_PROCESSES)
+            worker_processes.start()
+        if HTTP_ASYNC_JOBS:
+            # Same dispatcher as the SQS worker, fed by the HTTP endpoint
+            http_dispatcher = WorkDispatcher(_worker_concurrency())
+            http_dispatcher.start()
+            log("INFO", "http.jobs:start", concurrency=http_dispatcher.concurrency, queue_max=HTTP_JOB_QUEUE_MAX)
+
     @app_srv.on_event("shutdown")
     async def shutdown_event():
         """Clean up browser on shutdown."""
         log("INFO", "http:shutdown", action="closing_browser")
-        await browser_pool.close()
+        if http_dispatcher:
+            await http_dispatcher.drain(SQS_DRAIN_SECONDS)
+        if worker_processes:
+            await worker_processes.close()
+        await pipeline.close()
+        await artifact_uploader.close()
+        await account_scheduler.close()
 
 except Exception as _e:
     app_srv = None  # FastAPI not installed; that's okay in pure Lambda/SQS mode
@@ -819,99 +3741,409 @@ def _install_signal_handlers():
     signal.signal(signal.SIGTERM, _sigterm)
     signal.signal(signal.SIGINT, _sigterm)
 
-async def _receive_batch():
+async def _receive_batch(max_messages: int = SQS_MAX_MESSAGES):
     def _recv():
         return sqs.receive_message(
             QueueUrl=SQS_QUEUE_URL,
-            MaxNumberOfMessages=SQS_MAX_MESSAGES,
+            MaxNumberOfMessages=max(1, min(10, max_messages)),
             WaitTimeSeconds=SQS_WAIT_TIME_SECONDS,
             VisibilityTimeout=SQS_VISIBILITY_TIMEOUT,
-            AttributeNames=["SentTimestamp", "MessageGroupId", "SequenceNumber"],
+            AttributeNames=["SentTimestamp", "MessageGroupId", "SequenceNumber", "ApproximateReceiveCount"],
             MessageAttributeNames=["All"],
         )
     return await asyncio.to_thread(_recv)
 
-async def _delete_message(receipt_handle: str):
-    def _del():
-        sqs.delete_message(QueueUrl=SQS_QUEUE_URL, ReceiptHandle=receipt_handle)
-    await asyncio.to_thread(_del)
+class WorkDispatcher:
+    """
+    Starts submitted work as soon as one of `concurrency` slots frees up. Items sharing a
+    group key (FIFO MessageGroupId) run one at a time, in the order they were submitted.
+    """
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._backlog: Dict[str, deque] = {}  # group -> items waiting behind the running one
+        self._active_groups = set()
+        self._tasks = set()
+        self._room = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._runner = asyncio.create_task(self._run())
+
+    def pending(self) -> int:
+        """Submitted items that have not started yet."""
+        return self._ready.qsize() + sum(len(q) for q in self._backlog.values())
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, group: Optional[str], fn, on_cancel=None):
+        """
+        Queue `fn` (an async callable) to run after earlier items of the same group. If an
+        item fails (raises or returns False), the group's queued items are not run; their
+        `on_cancel` (async callable) is awaited instead, so they can be retried in order.
+        """
+        item = (group, fn, on_cancel)
+        if group is not None and group in self._active_groups:
+            self._backlog.setdefault(group, deque()).append(item)
+            return
+        if group is not None:
+            self._active_groups.add(group)
+        self._ready.put_nowait(item)
+
+    async def wait_for_room(self, limit: int):
+        while self.pending() >= limit:
+            self._room.clear()
+            await self._room.wait()
+
+    async def _run(self):
+        while True:
+            item = await self._ready.get()
+            await self._slots.acquire()
+            self._room.set()
+            task = asyncio.create_task(self._execute(item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, item):
+        group, fn, _ = item
+        ok = False
+        dropped = []
+        try:
+            ok = await fn() is not False
+        except Exception as e:
+            log("ERROR", "dispatcher:item_failed", group=group, error=str(e))
+        finally:
+            self._slots.release()
+            if group is not None:
+                backlog = self._backlog.get(group)
+                if backlog and not ok:
+                    # Running the rest would overtake the failed item; hand them back instead
+                    dropped = list(self._backlog.pop(group))
+                    self._active_groups.discard(group)
+                    log("WARNING", "dispatcher:group_stopped", group=group, released=len(dropped))
+                elif backlog:
+                    self._ready.put_nowait(backlog.popleft())
+                    if not backlog:
+                        del self._backlog[group]
+                else:
+                    self._active_groups.discard(group)
+            self._room.set()
+            for _, _, on_cancel in dropped:
+                if on_cancel:
+                    try:
+                        await on_cancel()
+                    except Exception as e:
+                        log("WARNING", "dispatcher:cancel_failed", group=group, error=str(e))
+
+    async def drain(self, timeout: float):
+        """Stop starting new work and give running items `timeout` seconds to finish."""
+        if self._runner:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+        if self._tasks:
+            done, still = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for t in still:
+                t.cancel()
+            if still:
+                log("WARNING", "dispatcher:drain_timeout", cancelled=len(still))
+                await asyncio.gather(*still, return_exceptions=True)
+
+
+class VisibilityHeartbeat:
+    """
+    Keeps a received message invisible while it waits in the buffer or is being processed,
+    by pushing its visibility timeout SQS_VISIBILITY_TIMEOUT ahead every SQS_HEARTBEAT_INTERVAL.
+    """
+    def __init__(self, receipt_handle: str):
+        self.receipt_handle = receipt_handle
+        self.received_at = time.monotonic()
+        self.extensions = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if SQS_HEARTBEAT and SQS_HEARTBEAT_INTERVAL < SQS_VISIBILITY_TIMEOUT:
+            self._task = asyncio.create_task(self._run())
+        _sqs_heartbeats[self.receipt_handle] = self
+
+    async def _set_visibility(self, seconds: int):
+        await asyncio.to_thread(sqs.change_message_visibility, QueueUrl=SQS_QUEUE_URL,
+                                ReceiptHandle=self.receipt_handle, VisibilityTimeout=seconds)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SQS_HEARTBEAT_INTERVAL)
+            held = time.monotonic() - self.received_at
+            if held + SQS_VISIBILITY_TIMEOUT > SQS_HEARTBEAT_MAX_SECONDS:
+                log("WARNING", "sqs.heartbeat:max_reached", held_s=int(held))
+                return
+            try:
+                await self._set_visibility(SQS_VISIBILITY_TIMEOUT)
+                self.extensions += 1
+                log("DEBUG", "sqs.heartbeat:extended", held_s=int(held), extensions=self.extensions)
+            except Exception as e:
+                log("WARNING", "sqs.heartbeat:error", held_s=int(held), error=str(e))
+
+    async def stop(self, release: bool = False):
+        """Stop extending; with release=True make the message visible again right away."""
+        _sqs_heartbeats.pop(self.receipt_handle, None)
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if release:
+            try:
+                await self._set_visibility(0)
+                log("INFO", "sqs.msg:released")
+            except Exception as e:
+                log("WARNING", "sqs.msg:release_error", error=str(e))
+
+_sqs_heartbeats: Dict[str, VisibilityHeartbeat] = {}
+
+
+class SqsAckBatcher:
+    """Deletes processed messages with delete_message_batch, at most SQS_DELETE_FLUSH_SECONDS late."""
+    def __init__(self):
+        self._pending: List[Tuple[str, int]] = []  # (receipt handle, failed attempts so far)
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def ack(self, receipt_handle: str):
+        self._pending.append((receipt_handle, 0))
+        if len(self._pending) >= 10:
+            self._full.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=SQS_DELETE_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Delete everything pending; failures are queued again for the next flush, up to SQS_DELETE_ATTEMPTS."""
+        pending, self._pending = self._pending, []
+        retry: List[Tuple[str, int]] = []
+        for start in range(0, len(pending), 10):
+            batch = pending[start:start + 10]
+            entries = [{"Id": str(i), "ReceiptHandle": h} for i, (h, _) in enumerate(batch)]
+            try:
+                resp = await asyncio.to_thread(sqs.delete_message_batch, QueueUrl=SQS_QUEUE_URL, Entries=entries)
+            except Exception as e:
+                log("ERROR", "sqs.delete:error", count=len(batch), error=str(e))
+                retry.extend(batch)
+                continue
+            for f in resp.get("Failed", []):
+                handle, attempts = batch[int(f["Id"])]
+                log("ERROR", "sqs.delete:failed", code=f.get("Code"), error=f.get("Message"),
+                    sender_fault=f.get("SenderFault"), receipt=handle[:24])
+                if not f.get("SenderFault"):
+                    retry.append((handle, attempts))  # SQS-side trouble; a stale receipt won't get better
+            log("DEBUG", "sqs.delete:batch", count=len(batch), failed=len(resp.get("Failed", [])))
+        for handle, attempts in retry:
+            if attempts + 1 < SQS_DELETE_ATTEMPTS:
+                self._pending.append((handle, attempts + 1))
+            else:
+                # The message will be redelivered and processed again (idempotency ledger permitting)
+                log("ERROR", "sqs.delete:gave_up", receipt=handle[:24], attempts=attempts + 1)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for _ in range(max(1, SQS_DELETE_ATTEMPTS)):
+            await self.flush()
+            if not self._pending:
+                break
+            await asyncio.sleep(SQS_DELETE_FLUSH_SECONDS)
+
+
+def _parse_sqs_body(body_raw: str) -> dict:
+    # Try to parse as JSON, but handle various message formats
+    try:
+        body = json.loads(body_raw)
+        # If it's a plain string that's not a JSON object, wrap it
+        if isinstance(body, str):
+            log("WARNING", "sqs.msg:string_body", body_preview=body[:100])
+            body = {"message": body}
+    except json.JSONDecodeError:
+        log("WARNING", "sqs.msg:parse_error", body_preview=body_raw[:100])
+        # Try to parse as S3 event notification
+        if "s3:ObjectCreated" in body_raw:
+            try:
+                # Attempt to extract S3 info from raw string
+                bucket_match = re.search(r'"name"\s*:\s*"([^"]+)"', body_raw)
+                key_match = re.search(r'"key"\s*:\s*"([^"]+)"', body_raw)
+                if bucket_match and key_match:
+                    body = {"Records": [_as_s3_record(bucket_match.group(1), key_match.group(1))]}
+                else:
+                    body = {"raw": body_raw, "error": "Could not parse S3 event"}
+            except:
+                body = {"raw": body_raw, "error": "Failed to extract S3 info"}
+        else:
+            body = {"raw": body_raw}
+    return body
+
+def _failed_records(resp: dict) -> List[dict]:
+    """Errors async_handler reported for individual records (it does not raise for those)."""
+    try:
+        processed = json.loads(resp.get("body") or "{}").get("processed", [])
+    except (AttributeError, ValueError):
+        return []
+    return [p for p in processed if isinstance(p, dict) and p.get("error")]
+
+# Retries only repeat the same outcome: missing inputs, assets the portal rejected after every re-upload
+PERMANENT_ERROR_KINDS = ("fatal", "reupload")
+
+async def _park_message(msg: dict, reason: str):
+    """Copy a message we are giving up on to SQS_PARKING_QUEUE_URL (best-effort)."""
+    if not SQS_PARKING_QUEUE_URL:
+        return
+    kwargs = {"QueueUrl": SQS_PARKING_QUEUE_URL, "MessageBody": msg.get("Body", "{}"),
+              "MessageAttributes": {"park_reason": {"DataType": "String", "StringValue": reason[:256]}}}
+    if SQS_PARKING_QUEUE_URL.endswith(".fifo"):
+        kwargs["MessageGroupId"] = msg.get("Attributes", {}).get("MessageGroupId") or "parked"
+        kwargs["MessageDeduplicationId"] = msg["MessageId"]
+    try:
+        await asyncio.to_thread(sqs.send_message, **kwargs)
+    except Exception as e:
+        log("ERROR", "sqs.msg:park_error", error=str(e))
+
+async def _handle_sqs_message(msg: dict, acks: SqsAckBatcher, heartbeat: VisibilityHeartbeat):
+    rid = f"sqs-{uuid.uuid4().hex}"
+    body = _parse_sqs_body(msg.get("Body", "{}"))
+    ctx = SimpleNamespace(aws_request_id=rid)
+
+    ok = False
+    release = SQS_RELEASE_ON_FAILURE
+    attrs = msg.get("Attributes", {})
+    try:
+        resp = await _run_event(body, ctx)
+        failed = _failed_records(resp)
+        retryable = [f for f in failed if f.get("error_kind") not in PERMANENT_ERROR_KINDS]
+        if retryable:
+            receives = int(attrs.get("ApproximateReceiveCount", "1"))
+            if receives < SQS_MAX_RECEIVES:
+                # A live claim elsewhere needs time to finish or lapse; an instant redelivery would just spin
+                release = release and not any(f.get("error_kind") == "in_progress" for f in retryable)
+                raise RuntimeError(f"{len(failed)} record(s) failed: {retryable[0]['error']}")
+            log("ERROR", "sqs.msg:gave_up", receives=receives, error=retryable[0]["error"])
+            await _park_message(msg, f"gave up after {receives} deliveries: {retryable[0]['error']}")
+        elif failed:
+            log("ERROR", "sqs.msg:permanent_failure", error=failed[0]["error"], error_kind=failed[0].get("error_kind"))
+            await _park_message(msg, failed[0]["error"])
+        ok = True
+        acks.ack(msg["ReceiptHandle"])
+        log("INFO", "sqs.msg:ok" if not failed else "sqs.msg:dropped",
+            group=attrs.get("MessageGroupId"),
+            seq=attrs.get("SequenceNumber"),
+            heartbeats=heartbeat.extensions)
+    except Exception as e:
+        # do not delete on transient failure (at-least-once)
+        log("ERROR", "sqs.msg:failed", error=str(e), traceback="".join(traceback.format_exc()))
+    finally:
+        await heartbeat.stop(release=not ok and release)
+    return ok
+
+async def _receive_loop(dispatcher: WorkDispatcher, acks: SqsAckBatcher, buffer_size: int):
+    """Keep the dispatcher's buffer topped up with long polls, independent of processing."""
+    while not _shutdown.is_set():
+        try:
+            await dispatcher.wait_for_room(buffer_size)
+            resp = await _receive_batch(min(SQS_MAX_MESSAGES, buffer_size - dispatcher.pending()))
+            msgs = resp.get("Messages", [])
+            for msg in msgs:
+                # The visibility clock runs from receipt, so the heartbeat covers buffered time too
+                heartbeat = VisibilityHeartbeat(msg["ReceiptHandle"])
+                heartbeat.start()
+                group = msg.get("Attributes", {}).get("MessageGroupId")
+                dispatcher.submit(group, lambda m=msg, hb=heartbeat: _handle_sqs_message(m, acks, hb),
+                                  on_cancel=lambda hb=heartbeat: hb.stop(release=True))
+            if msgs:
+                log("DEBUG", "sqs.poll:received", count=len(msgs), buffered=dispatcher.pending(),
+                    in_flight=dispatcher.in_flight())
+        except Exception as e:
+            log("ERROR", "sqs.poll:error", error=str(e))
+            await asyncio.sleep(2.0)
 
 async def _worker_loop():
+    global worker_processes
     if not SQS_QUEUE_URL:
         raise RuntimeError("SQS_QUEUE_URL required in MODE=sqs")
     
     # Validate config at startup
     validate_config()
 
-    log("INFO", "sqs.worker:start", queue=SQS_QUEUE_URL, wait=SQS_WAIT_TIME_SECONDS, max_msgs=SQS_MAX_MESSAGES)
-    sem = asyncio.Semaphore(max(1, int(MAX_PARALLEL)))
+    if WORKER_PROCESSES > 1:
+        # This process only polls and dispatches; browsers live in the worker processes
+        worker_processes = WorkerProcessPool(WORKER_PROCESSES)
+        worker_processes.start()
+
+    # Enough messages in flight to keep every browser slot busy plus the prefetch window
+    concurrency = _worker_concurrency()
+    buffer_size = SQS_BUFFER_SIZE or max(SQS_MAX_MESSAGES, concurrency)
+    log("INFO", "sqs.worker:start", queue=SQS_QUEUE_URL, wait=SQS_WAIT_TIME_SECONDS, max_msgs=SQS_MAX_MESSAGES,
+        concurrency=concurrency, buffer_size=buffer_size)
     _install_signal_handlers()
 
-    try:
-        while not _shutdown.is_set():
-            try:
-                resp = await _receive_batch()
-                msgs = resp.get("Messages", [])
-                if not msgs:
-                    continue  # immediately issue another long poll
-
-                async def _handle(msg):
-                    async with sem:
-                        rid = f"sqs-{uuid.uuid4().hex}"
-                        body_raw = msg.get("Body", "{}")
-                        
-                        # Try to parse as JSON, but handle various message formats
-                        try:
-                            body = json.loads(body_raw)
-                            # If it's a plain string that's not a JSON object, wrap it
-                            if isinstance(body, str):
-                                log("WARNING", "sqs.msg:string_body", body_preview=body[:100])
-                                body = {"message": body}
-                        except json.JSONDecodeError:
-                            log("WARNING", "sqs.msg:parse_error", body_preview=body_raw[:100])
-                            # Try to parse as S3 event notification
-                            if "s3:ObjectCreated" in body_raw:
-                                try:
-                                    # Attempt to extract S3 info from raw string
-                                    import re
-                                    bucket_match = re.search(r'"name"\s*:\s*"([^"]+)"', body_raw)
-                                    key_match = re.search(r'"key"\s*:\s*"([^"]+)"', body_raw)
-                                    if bucket_match and key_match:
-                                        body = {"Records": [_as_s3_record(bucket_match.group(1), key_match.group(1))]}
-                                    else:
-                                        body = {"raw": body_raw, "error": "Could not parse S3 event"}
-                                except:
-                                    body = {"raw": body_raw, "error": "Failed to extract S3 info"}
-                            else:
-                                body = {"raw": body_raw}
-                        
-                        ctx = SimpleNamespace(aws_request_id=rid)
-
-                        try:
-                            await async_handler(body, ctx)
-                            await _delete_message(msg["ReceiptHandle"])
-                            log("INFO", "sqs.msg:ok",
-                                group=msg.get("Attributes", {}).get("MessageGroupId"),
-                                seq=msg.get("Attributes", {}).get("SequenceNumber"))
-                        except Exception as e:
-                            # do not delete on failure (at-least-once)
-                            log("ERROR", "sqs.msg:failed", error=str(e), traceback="".join(traceback.format_exc()))
-
-                await asyncio.gather(*[_handle(m) for m in msgs])
+    dispatcher = WorkDispatcher(concurrency)
+    acks = SqsAckBatcher()
+    dispatcher.start()
+    acks.start()
+    receiver = asyncio.create_task(_receive_loop(dispatcher, acks, buffer_size))
+    # With worker processes the browsers (and their housekeeping) live there
+    housekeeping = asyncio.create_task(housekeeper.run()) if asset_ledger and not worker_processes else None
+    metrics_server = None
+    if METRICS_ENABLED and METRICS_PORT:
+        try:
+            metrics_server = await start_metrics_sidecar(METRICS_PORT)
+        except OSError as e:
+            log("WARNING", "metrics:listen_failed", port=METRICS_PORT, error=str(e))
 
-            except Exception as e:
-                log("ERROR", "sqs.poll:error", error=str(e))
-                await asyncio.sleep(2.0)
+    try:
+        await _shutdown.wait()
     finally:
+        receiver.cancel()
+        if housekeeping:
+            housekeeping.cancel()
+        await asyncio.gather(receiver, *([housekeeping] if housekeeping else []), return_exceptions=True)
+        if metrics_server:
+            metrics_server.close()
+        log("INFO", "sqs.worker:drain", in_flight=dispatcher.in_flight(), buffered=dispatcher.pending())
+        await dispatcher.drain(SQS_DRAIN_SECONDS)
+        await acks.close()
+        # Hand messages we never finished back to the queue instead of sitting out their timeout
+        for heartbeat in list(_sqs_heartbeats.values()):
+            await heartbeat.stop(release=True)
+        if worker_processes:
+            await worker_processes.close()
         # Cleanup browser on shutdown
         log("INFO", "sqs.worker:cleanup", action="closing_browser")
-        await browser_pool.close()
+        await pipeline.close()
+        await artifact_uploader.close()
+        await account_scheduler.close()
 
     log("INFO", "sqs.worker:shutdown")
 
 # ================
 # Entrypoint
 # ================
+if LAMBDA_PREWARM and LAMBDA_PERSISTENT_LOOP and os.getenv("AWS_LAMBDA_FUNCTION_NAME") and not WORKER_INDEX:
+    # Module import is the Lambda init phase: get the browser up before the first event
+    try:
+        validate_config()
+        _lambda_run(_lambda_prewarm())
+    except Exception as e:
+        log("ERROR", "lambda:prewarm_failed", error=str(e))
+    finally:
+        log_writer.flush()
+
 if __name__ == "__main__":
     if MODE == "sqs":
         asyncio.run(_worker_loop())
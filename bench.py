@@ -0,0 +1,456 @@
+"""
+Offline throughput benchmark for app.py.
+
+Serves a local stand-in of the portal pages the automation drives (sign-in button,
+login form, create modal with dropzone, created-assets table with DownloadButton),
+backs S3/SQS with moto, and runs async_handler or _worker_loop end to end with a
+real Camoufox browser. Each configuration runs in its own subprocess, because app.py
+reads its settings at import time.
+
+    python bench.py --records 20 --parallel 1,2,4 --human-delays off --batch 1,4
+    python bench.py --mode sqs --records 50 --parallel 2 --processing-delay 5 --fail-rate 0.05
+
+Reports records/min, per-stage p50/p95 (from the Timer ":end" log lines) and the peak
+RSS of the whole process tree (python + browser processes).
+"""
+import os, sys, io, json, time, uuid, random, socket, asyncio, zipfile, argparse, itertools, threading, tempfile, subprocess
+from pathlib import Path
+from typing import Optional, Dict, List
+
+BUCKET = "cfx-bench"
+INPUT_PREFIX = "unprocessed/"
+OUTPUT_PREFIX = "processed/"
+REPORT_STAGES = (
+    "s3.download", "login", "upload.wait", "processing.wait", "download",
+    "camoufox_run", "camoufox_batch_run", "s3.upload_result",
+)
+
+# ================
+# Fake portal
+# ================
+_CREATE_PAGE = """<!doctype html><html><body>
+<div class="modal">
+  <input placeholder="Enter asset name" id="name">
+  <div class="cfxui__InputDropzone__dropzone__bde8d"><input type="file" id="file"></div>
+  <button id="upload" disabled>Upload File</button>
+</div>
+<script>
+const name = document.getElementById('name'), file = document.getElementById('file'), btn = document.getElementById('upload');
+function sync() { btn.disabled = !(name.value && file.files.length); }
+// A new asset name re-opens the form after the previous upload hid the button
+name.addEventListener('input', () => { btn.style.display = ''; sync(); });
+file.addEventListener('change', sync);
+btn.addEventListener('click', async () => {
+  btn.disabled = true;
+  const r = await fetch('/api/assets', {method: 'POST', headers: {'x-asset-name': name.value}, body: file.files[0]});
+  if (r.ok) { btn.style.display = 'none'; file.value = ''; } else { sync(); }
+});
+</script></body></html>"""
+
+_SIGNED_OUT_PAGE = """<!doctype html><html><body>
+<button onclick="location.href='/sign-in'">Sign in with Cfx.re</button>
+</body></html>"""
+
+_SIGN_IN_PAGE = """<!doctype html><html><body>
+<input id="login-account-name"><input id="login-account-password" type="password">
+<button id="login-button">Log in</button>
+<div class="error-message" hidden></div>
+<script>
+document.getElementById('login-button').addEventListener('click', async () => {
+  const body = JSON.stringify({
+    username: document.getElementById('login-account-name').value,
+    password: document.getElementById('login-account-password').value,
+  });
+  const r = await fetch('/api/login', {method: 'POST', headers: {'content-type': 'application/json'}, body});
+  if (r.ok) { location.href = '/assets/created-assets?modal=create'; return; }
+  const err = document.querySelector('.error-message');
+  err.textContent = 'Invalid credentials'; err.hidden = false;
+});
+</script></body></html>"""
+
+_ASSETS_PAGE = """<!doctype html><html><body>
+<table><tbody id="rows"></tbody></table>
+<script>
+let last = '';
+function render(assets) {
+  document.getElementById('rows').innerHTML = assets.map(a =>
+    `<tr data-sentry-component="AssetRow"><td>${a.name}</td><td>${a.status}</td><td>
+       <button data-sentry-component="DownloadButton" ${a.status === 'ready' ? '' : 'disabled'}
+               onclick="location.href='/api/assets/${a.id}/download'">Download</button></td></tr>`).join('');
+}
+async function poll() {
+  try {
+    const r = await fetch('/api/assets' + location.search);
+    const text = await r.text();
+    if (text !== last) { last = text; render(JSON.parse(text).assets); }
+  } catch (e) {}
+  setTimeout(poll, 1000);
+}
+poll();
+</script></body></html>"""
+
+
+class FakePortal:
+    """Asset store behind the fake portal; processing finishes `delay` (+ jitter) seconds after upload."""
+    def __init__(self, delay: float, jitter: float, fail_rate: float, login_fail_rate: float, page_size: int):
+        self.delay = delay
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.login_fail_rate = login_fail_rate
+        self.page_size = page_size
+        self.sessions: Dict[str, str] = {}  # token -> username
+        self.assets: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def status(self, asset: dict) -> str:
+        if time.time() < asset["ready_at"]:
+            return "processing"
+        return "failed" if asset["fail"] else "ready"
+
+    def create(self, owner: str, name: str, body: bytes) -> dict:
+        asset = {
+            "id": uuid.uuid4().hex, "name": name, "owner": owner, "body": body, "created": time.time(),
+            "ready_at": time.time() + self.delay + random.uniform(0, self.jitter),
+            "fail": random.random() < self.fail_rate,
+        }
+        with self.lock:
+            self.assets[asset["id"]] = asset
+        return asset
+
+    def listing(self, owner: str, search: str = "", page: int = 1) -> List[dict]:
+        with self.lock:
+            mine = [a for a in self.assets.values() if a["owner"] == owner and search in a["name"]]
+        mine.sort(key=lambda a: a["created"], reverse=True)
+        start = (max(page, 1) - 1) * self.page_size
+        return [{"id": a["id"], "name": a["name"], "status": self.status(a)}
+                for a in mine[start:start + self.page_size]]
+
+    def app(self):
+        from fastapi import FastAPI, Request
+        from fastapi.responses import HTMLResponse, JSONResponse, Response, RedirectResponse
+
+        portal = self
+        app = FastAPI()
+
+        def _user(req: Request) -> Optional[str]:
+            return portal.sessions.get(req.cookies.get("bench_session", ""))
+
+        @app.get("/")
+        async def root():
+            return RedirectResponse("/assets/created-assets?modal=create")
+
+        @app.get("/assets/created-assets")
+        async def created_assets(req: Request, modal: Optional[str] = None):
+            if not _user(req):
+                return HTMLResponse(_SIGNED_OUT_PAGE)
+            return HTMLResponse(_CREATE_PAGE if modal == "create" else _ASSETS_PAGE)
+
+        @app.get("/sign-in")
+        async def sign_in():
+            return HTMLResponse(_SIGN_IN_PAGE)
+
+        @app.post("/api/login")
+        async def login(req: Request):
+            body = await req.json()
+            if not body.get("username") or not body.get("password") or random.random() < portal.login_fail_rate:
+                return JSONResponse({"error": "invalid credentials"}, status_code=401)
+            token = uuid.uuid4().hex
+            portal.sessions[token] = body["username"]
+            resp = JSONResponse({"ok": True})
+            resp.set_cookie("bench_session", token, httponly=True)
+            return resp
+
+        @app.post("/api/assets")
+        async def upload(req: Request):
+            user = _user(req)
+            if not user:
+                return JSONResponse({"error": "unauthorized"}, status_code=401)
+            asset = portal.create(user, req.headers.get("x-asset-name", ""), await req.body())
+            return {"id": asset["id"], "name": asset["name"], "status": portal.status(asset)}
+
+        @app.get("/api/assets")
+        async def list_assets(req: Request, search: str = "", page: int = 1):
+            user = _user(req)
+            if not user:
+                return JSONResponse({"error": "unauthorized"}, status_code=401)
+            return {"assets": portal.listing(user, search, page)}
+
+        @app.get("/api/assets/{asset_id}/download")
+        async def download(asset_id: str, req: Request):
+            asset = portal.assets.get(asset_id)
+            if not _user(req) or not asset or portal.status(asset) != "ready":
+                return JSONResponse({"error": "not available"}, status_code=404)
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, "w") as zf:
+                zf.writestr("input.zip", asset["body"])
+                zf.writestr("escrow.txt", f"processed {asset['name']}\n")
+            return Response(buf.getvalue(), media_type="application/zip",
+                            headers={"Content-Disposition": f'attachment; filename="{asset["name"]}.zip"'})
+
+        return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_portal(portal: FakePortal) -> str:
+    """Serve the fake portal on a background thread and return its base URL."""
+    import uvicorn
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(portal.app(), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("fake portal did not start")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def _make_input(i: int, size_kb: int) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr(f"resource_{i}/fxmanifest.lua", "fx_version 'cerulean'\n")
+        zf.writestr(f"resource_{i}/data.bin", os.urandom(size_kb * 1024))
+    return buf.getvalue()
+
+
+# ================
+# One configuration (runs in a subprocess)
+# ================
+def run_config(cfg: dict):
+    """Set up moto + the fake portal, import app.py under them, push the records through, write results."""
+    from moto import mock_aws
+    import boto3
+
+    with mock_aws():
+        region = os.environ["AWS_DEFAULT_REGION"]
+        s3 = boto3.client("s3", region_name=region)
+        s3.create_bucket(Bucket=BUCKET)
+        if cfg["mode"] == "sqs":
+            sqs = boto3.client("sqs", region_name=region)
+            os.environ["SQS_QUEUE_URL"] = sqs.create_queue(
+                QueueName="cfx-bench", Attributes={"VisibilityTimeout": "30"})["QueueUrl"]
+
+        portal = FakePortal(cfg["processing_delay"], cfg["processing_jitter"], cfg["fail_rate"],
+                            cfg["login_fail_rate"], cfg["page_size"])
+        os.environ["CFX_PORTAL_URL"] = start_portal(portal)
+        os.environ.setdefault("ASSET_SEARCH_PARAM", "search")  # the fake portal filters on ?search=
+
+        keys = []
+        for i in range(cfg["records"]):
+            key = f"{INPUT_PREFIX}bench_{i:04d}.zip"
+            s3.put_object(Bucket=BUCKET, Key=key, Body=_make_input(i, cfg["input_kb"]))
+            keys.append(key)
+
+        import app  # reads the environment prepared above
+
+        t0 = time.perf_counter()
+        if cfg["mode"] == "sqs":
+            outcome = asyncio.run(_run_sqs(app, s3, keys, cfg["timeout"]))
+        else:
+            outcome = asyncio.run(_run_handler(app, keys))
+        elapsed = time.perf_counter() - t0
+        app.log_writer.flush()
+
+    ok = outcome["ok"]
+    result = dict(cfg, ok=ok, failed=len(keys) - ok, elapsed_s=round(elapsed, 2),
+                  records_per_min=round(ok / elapsed * 60, 2) if elapsed > 0 else 0.0)
+    Path(cfg["result_path"]).write_text(json.dumps(result))
+
+
+async def _run_handler(app, keys: List[str]) -> dict:
+    event = {"Records": [{"s3": {"bucket": {"name": BUCKET}, "object": {"key": k}}} for k in keys]}
+    resp = await app.async_handler(event, type("Ctx", (), {"aws_request_id": f"bench-{uuid.uuid4().hex}"})())
+    processed = json.loads(resp["body"])["processed"]
+    await app.pipeline.close()
+    await app.account_scheduler.close()
+    return {"ok": sum(1 for r in processed if "out" in r)}
+
+
+async def _run_sqs(app, s3, keys: List[str], timeout: float) -> dict:
+    for key in keys:
+        body = {"Records": [{"s3": {"bucket": {"name": BUCKET}, "object": {"key": key}}}]}
+        app.sqs.send_message(QueueUrl=app.SQS_QUEUE_URL, MessageBody=json.dumps(body))
+
+    worker = asyncio.create_task(app._worker_loop())
+    deadline = time.monotonic() + timeout
+    ok = 0
+    while time.monotonic() < deadline and not worker.done():
+        listing = await asyncio.to_thread(s3.list_objects_v2, Bucket=BUCKET, Prefix=OUTPUT_PREFIX)
+        ok = listing.get("KeyCount", 0)
+        if ok >= len(keys):
+            break
+        await asyncio.sleep(0.5)
+    app._shutdown.set()
+    await worker
+    return {"ok": ok}
+
+
+# ================
+# Driver
+# ================
+def _tree_rss_bytes(root: int) -> int:
+    """RSS summed over `root` and all its descendants, read from /proc."""
+    parents: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    total, stack = 0, [root]
+    while stack:
+        pid = stack.pop()
+        stack.extend(parents.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _stage_stats(log_path: Path) -> Dict[str, dict]:
+    durations: Dict[str, List[float]] = {}
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # print() output from app import
+            msg = rec.get("message", "") if isinstance(rec, dict) else ""
+            if msg.endswith(":end") and rec.get("status") == "ok" and "duration_ms" in rec:
+                durations.setdefault(msg[:-4], []).append(rec["duration_ms"])
+    return {
+        stage: {"n": len(v), "p50_ms": _percentile(v, 0.5), "p95_ms": _percentile(v, 0.95)}
+        for stage, v in durations.items()
+    }
+
+
+def bench_one(cfg: dict, workdir: Path) -> dict:
+    name = f"p{cfg['max_parallel']}_h{int(cfg['human_delays'])}_b{cfg['batch']}"
+    log_path = workdir / f"{name}.log"
+    cfg = dict(cfg, result_path=str(workdir / f"{name}.json"))
+    env = dict(
+        os.environ,
+        MODE=cfg["mode"],
+        AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing", AWS_SESSION_TOKEN="testing",
+        AWS_DEFAULT_REGION="us-east-1",
+        S3_BUCKET=BUCKET, INPUT_PREFIX=INPUT_PREFIX, OUTPUT_PREFIX=OUTPUT_PREFIX,
+        CFX_USERNAME="bench", CFX_PASSWORD="bench",
+        MAX_PARALLEL=str(cfg["max_parallel"]),
+        DISABLE_HUMAN_DELAYS="0" if cfg["human_delays"] else "1",
+        BATCH_UPLOAD_MAX=str(cfg["batch"]),
+        SESSION_STATE_PATH=str(workdir / f"{name}_state.json"),
+        IDEMPOTENCY_SQLITE_PATH=str(workdir / f"{name}_ledger.sqlite3"),
+        DEBUG="0", METRICS_PORT="0", LOG_LEVEL="INFO", LOG_RATE_LIMIT="0",
+        DISCORD_WEBHOOK_URL="",
+    )
+    peak = 0
+    with open(log_path, "w") as log_file:
+        proc = subprocess.Popen([sys.executable, __file__, "_run", json.dumps(cfg)],
+                                env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        while proc.poll() is None:
+            peak = max(peak, _tree_rss_bytes(proc.pid))
+            time.sleep(0.5)
+    result_path = Path(cfg["result_path"])
+    if proc.returncode != 0 or not result_path.exists():
+        return dict(cfg, name=name, error=f"exit code {proc.returncode}, see {log_path}")
+    result = json.loads(result_path.read_text())
+    result.update(name=name, peak_rss_mb=round(peak / 1048576, 1), stages=_stage_stats(log_path))
+    return result
+
+
+def _fmt_ms(v: Optional[float]) -> str:
+    return "-" if v is None else f"{v / 1000:.1f}s"
+
+
+def print_report(results: List[dict]):
+    print(f"\n{'config':<16}{'ok':>5}{'fail':>6}{'rec/min':>10}{'peak MB':>10}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['name']:<16}  ERROR {r['error']}")
+            continue
+        print(f"{r['name']:<16}{r['ok']:>5}{r['failed']:>6}{r['records_per_min']:>10}{r['peak_rss_mb']:>10}")
+    for r in results:
+        if "error" in r:
+            continue
+        print(f"\n{r['name']}  (stage p50 / p95)")
+        for stage in REPORT_STAGES:
+            st = r["stages"].get(stage)
+            if st:
+                print(f"  {stage:<22}{_fmt_ms(st['p50_ms']):>8} / {_fmt_ms(st['p95_ms']):<8} n={st['n']}")
+
+
+def _ints(v: str) -> List[int]:
+    return [int(x) for x in v.split(",") if x.strip()]
+
+
+def _flags(v: str) -> List[bool]:
+    return [x.strip().lower() in ("1", "on", "true", "yes") for x in v.split(",") if x.strip()]
+
+
+def main(argv: Optional[List[str]] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["_run"]:
+        run_config(json.loads(argv[1]))
+        return
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--mode", choices=("handler", "sqs"), default="handler",
+                    help="drive async_handler with one event, or _worker_loop through an SQS queue")
+    ap.add_argument("--records", type=int, default=10)
+    ap.add_argument("--input-kb", type=int, default=256, help="random payload per input zip")
+    ap.add_argument("--parallel", default="1", help="MAX_PARALLEL values, comma separated")
+    ap.add_argument("--human-delays", default="off", help="on/off values, comma separated")
+    ap.add_argument("--batch", default="1", help="BATCH_UPLOAD_MAX values, comma separated")
+    ap.add_argument("--processing-delay", type=float, default=3.0, help="portal seconds from upload to ready")
+    ap.add_argument("--processing-jitter", type=float, default=2.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of assets the portal marks failed")
+    ap.add_argument("--login-fail-rate", type=float, default=0.0, help="fraction of login attempts rejected")
+    ap.add_argument("--page-size", type=int, default=50, help="assets listed on the created-assets page")
+    ap.add_argument("--timeout", type=float, default=900, help="sqs mode: give up after this many seconds")
+    ap.add_argument("--workdir", help="keep logs and results here (default: a temp dir)")
+    ap.add_argument("--json", help="also write all results to this file")
+    args = ap.parse_args(argv)
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="cfx-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    base = {
+        "mode": args.mode, "records": args.records, "input_kb": args.input_kb,
+        "processing_delay": args.processing_delay, "processing_jitter": args.processing_jitter,
+        "fail_rate": args.fail_rate, "login_fail_rate": args.login_fail_rate,
+        "page_size": args.page_size, "timeout": args.timeout,
+    }
+    results = []
+    for parallel, human, batch in itertools.product(_ints(args.parallel), _flags(args.human_delays), _ints(args.batch)):
+        cfg = dict(base, max_parallel=parallel, human_delays=human, batch=batch)
+        print(f"running MAX_PARALLEL={parallel} human_delays={human} BATCH_UPLOAD_MAX={batch} ...", flush=True)
+        results.append(bench_one(cfg, workdir))
+
+    print_report(results)
+    print(f"\nlogs: {workdir}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
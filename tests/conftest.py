@@ -0,0 +1,13 @@
+import os
+import sys
+
+# app.py builds its boto3 clients and reads its configuration at import time
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("CFX_USERNAME", "tester")
+os.environ.setdefault("CFX_PASSWORD", "secret")
+os.environ.setdefault("METRICS_ENABLED", "0")
+os.environ.setdefault("SESSION_STATE_PATH", "/tmp/cfx-test-session-state.json")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
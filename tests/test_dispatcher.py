@@ -0,0 +1,79 @@
+import asyncio
+
+import app
+
+
+def _dispatch(items, concurrency=4):
+    """Submit (group, name, ok) items and return the run/cancel order."""
+    events = []
+
+    async def run():
+        d = app.WorkDispatcher(concurrency)
+        d.start()
+
+        def job(name, ok):
+            async def fn():
+                await asyncio.sleep(0.01)
+                events.append(name)
+                return ok
+            return fn
+
+        def cancel(name):
+            async def fn():
+                events.append(("cancelled", name))
+            return fn
+
+        for group, name, ok in items:
+            d.submit(group, job(name, ok), on_cancel=cancel(name))
+        await asyncio.sleep(0.2)
+        assert d.pending() == 0 and d.in_flight() == 0
+        await d.drain(1)
+
+    asyncio.run(run())
+    return events
+
+
+def test_items_in_a_group_run_in_submission_order():
+    events = _dispatch([("g", f"g{i}", True) for i in range(5)])
+    assert events == [f"g{i}" for i in range(5)]
+
+
+def test_groups_run_independently():
+    events = _dispatch([("a", "a0", True), ("b", "b0", True), ("a", "a1", True), ("b", "b1", True)])
+    assert events.index("a0") < events.index("a1")
+    assert events.index("b0") < events.index("b1")
+    assert sorted(events) == ["a0", "a1", "b0", "b1"]
+
+
+def test_a_failure_cancels_the_rest_of_its_group_only():
+    events = _dispatch([("g", "g0", False), ("g", "g1", True), ("g", "g2", True), ("h", "h0", True)])
+    assert events.index("g0") < events.index(("cancelled", "g1")) < events.index(("cancelled", "g2"))
+    assert "g1" not in events and "g2" not in events
+    assert "h0" in events
+
+
+def test_ungrouped_items_are_unaffected_by_failures():
+    events = _dispatch([(None, "x", False), (None, "y", True)])
+    assert sorted(events) == ["x", "y"]
+
+
+def test_group_accepts_new_items_after_a_failure():
+    async def run():
+        d = app.WorkDispatcher(2)
+        d.start()
+        ran = []
+
+        async def fail():
+            return False
+
+        async def ok():
+            ran.append("retry")
+
+        d.submit("g", fail)
+        await asyncio.sleep(0.05)
+        d.submit("g", ok)
+        await asyncio.sleep(0.05)
+        await d.drain(1)
+        return ran
+
+    assert asyncio.run(run()) == ["retry"]
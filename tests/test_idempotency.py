@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import app
+
+
+@pytest.fixture
+def sqlite_ledger(tmp_path):
+    return app.SqliteLedger(str(tmp_path / "ledger.sqlite3"))
+
+
+@pytest.fixture
+def s3_ledger(monkeypatch):
+    with mock_aws():
+        client = boto3.client("s3", region_name=os.environ["AWS_DEFAULT_REGION"])
+        client.create_bucket(Bucket="ledger")
+        monkeypatch.setattr(app, "s3", client)
+        yield app.S3Ledger()
+
+
+@pytest.fixture(params=["sqlite", "s3"])
+def ledger(request):
+    return request.getfixturevalue(f"{request.param}_ledger")
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_claim_blocks_a_second_delivery_until_released(ledger):
+    assert _run(ledger.acquire("b/k@1", "ledger")) == ("acquired", None)
+    assert _run(ledger.acquire("b/k@1", "ledger")) == ("in_progress", None)
+    _run(ledger.release("b/k@1", "ledger"))
+    assert _run(ledger.acquire("b/k@1", "ledger")) == ("acquired", None)
+
+
+def test_completed_entry_returns_the_prior_result(ledger):
+    _run(ledger.acquire("b/k@1", "ledger"))
+    _run(ledger.complete("b/k@1", "ledger", {"out": "s3://b/processed/k"}))
+    assert _run(ledger.acquire("b/k@1", "ledger")) == ("completed", {"out": "s3://b/processed/k"})
+    # A different object version is a different record
+    assert _run(ledger.acquire("b/k@2", "ledger")) == ("acquired", None)
+
+
+def test_expired_lease_can_be_taken_over(ledger, monkeypatch):
+    monkeypatch.setattr(app, "IDEMPOTENCY_LEASE_SECONDS", -1)
+    assert _run(ledger.acquire("b/k@1", "ledger")) == ("acquired", None)
+    assert _run(ledger.acquire("b/k@1", "ledger")) == ("acquired", None)
+
+
+def test_stale_completion_is_reprocessed(ledger, monkeypatch):
+    _run(ledger.acquire("b/k@1", "ledger"))
+    _run(ledger.complete("b/k@1", "ledger", {"out": "x"}))
+    monkeypatch.setattr(app, "IDEMPOTENCY_TTL", -1)
+    assert _run(ledger.acquire("b/k@1", "ledger")) == ("acquired", None)
+
+
+def test_in_progress_delivery_fails_instead_of_succeeding(sqlite_ledger, monkeypatch):
+    monkeypatch.setattr(app, "idempotency_ledger", sqlite_ledger)
+    rec = {"s3": {"bucket": {"name": "b"}, "object": {"key": "unprocessed/k.zip", "eTag": "abc"}}}
+    _run(sqlite_ledger.acquire("b/unprocessed/k.zip@abc", "b"))
+
+    async def run():
+        with pytest.raises(app.RecordInProgress):
+            await app._run_record(rec, None)
+        resp = await app.async_handler({"Records": [rec]}, None)
+        return json.loads(resp["body"])["processed"]
+
+    processed = _run(run())
+    assert processed[0]["error_kind"] == "in_progress"
+
+
+class _Acks:
+    def __init__(self):
+        self.acked = []
+
+    def ack(self, handle):
+        self.acked.append(handle)
+
+
+class _Heartbeat:
+    extensions = 0
+
+    def __init__(self):
+        self.released = None
+
+    async def stop(self, release=False):
+        self.released = release
+
+
+def _handle(monkeypatch, failed, receives=1, release_on_failure=False):
+    async def fake_event(event, ctx):
+        return {"statusCode": 200, "body": json.dumps({"processed": failed})}
+    monkeypatch.setattr(app, "_run_event", fake_event)
+    monkeypatch.setattr(app, "SQS_RELEASE_ON_FAILURE", release_on_failure)
+    msg = {"MessageId": "m1", "ReceiptHandle": "h1", "Body": "{}",
+           "Attributes": {"ApproximateReceiveCount": str(receives)}}
+    acks, heartbeat = _Acks(), _Heartbeat()
+    ok = _run(app._handle_sqs_message(msg, acks, heartbeat))
+    return ok, acks.acked, heartbeat.released
+
+
+def test_sqs_acks_successes_and_permanent_failures(monkeypatch):
+    assert _handle(monkeypatch, [{"in": "s3://b/k"}])[:2] == (True, ["h1"])
+    assert _handle(monkeypatch, [{"error": "gone", "error_kind": "fatal"}])[:2] == (True, ["h1"])
+    assert _handle(monkeypatch, [{"error": "rejected", "error_kind": "reupload"}])[:2] == (True, ["h1"])
+
+
+def test_sqs_leaves_transient_failures_until_the_receive_cap(monkeypatch):
+    assert _handle(monkeypatch, [{"error": "timeout", "error_kind": "transient"}]) == (False, [], False)
+    assert _handle(monkeypatch, [{"error": "timeout", "error_kind": "transient"}],
+                   release_on_failure=True) == (False, [], True)
+    ok, acked, _ = _handle(monkeypatch, [{"error": "timeout", "error_kind": "transient"}],
+                           receives=app.SQS_MAX_RECEIVES)
+    assert (ok, acked) == (True, ["h1"])
+
+
+def test_sqs_never_fast_releases_an_in_progress_record(monkeypatch):
+    assert _handle(monkeypatch, [{"error": "busy", "error_kind": "in_progress"}],
+                   release_on_failure=True) == (False, [], False)
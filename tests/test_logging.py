@@ -0,0 +1,57 @@
+import io
+import json
+import time
+
+import app
+
+
+def _rec(message, **kv):
+    return dict({"ts": time.time(), "level": "INFO", "message": message}, **kv)
+
+
+def test_log_writer_survives_unserialisable_record():
+    stream = io.StringIO()
+    writer = app.LogWriter(stream, max_queue=100, batch_max=1)
+
+    writer.submit(_rec("bad", payload={(1, 2): "tuple keys"}))
+    writer.submit(_rec("good"))
+    writer.flush(timeout=5)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert writer._thread.is_alive()
+    assert [line["message"] for line in lines] == ["log:unserialisable", "good"]
+    assert "tuple keys" in lines[0]["record"]
+
+
+def test_log_writer_reports_dropped_records():
+    stream = io.StringIO()
+    writer = app.LogWriter(stream, max_queue=1, batch_max=10)
+    writer._queue.put_nowait(_rec("queued"))
+    writer.dropped = 3
+
+    writer.write([writer._queue.get_nowait()])
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert lines[-1]["message"] == "log:dropped" and lines[-1]["count"] == 3
+
+
+def test_log_limiter_caps_lines_per_window_and_reports_suppressed(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(app, "LOG_RATE_LIMIT", 2)
+    monkeypatch.setattr(app, "LOG_SAMPLE", {})
+    limiter = app._LogLimiter()
+
+    assert [limiter.allow("chatty") for _ in range(4)] == [(True, 0), (True, 0), (False, 0), (False, 0)]
+    assert limiter.allow("other") == (True, 0)
+    now[0] += 1.0
+    assert limiter.allow("chatty") == (True, 2)
+    assert limiter.allow("chatty") == (True, 0)
+
+
+def test_log_limiter_sampling(monkeypatch):
+    monkeypatch.setattr(app, "LOG_SAMPLE", {"never": 0.0, "always": 1.0})
+    monkeypatch.setattr(app, "LOG_RATE_LIMIT", 0)
+    limiter = app._LogLimiter()
+    assert not any(limiter.allow("never")[0] for _ in range(20))
+    assert all(limiter.allow("always")[0] for _ in range(20))
@@ -0,0 +1,62 @@
+import asyncio
+
+import app
+
+
+class _FlakySqs:
+    """delete_message_batch that raises `errors` times, then reports `failed` entries."""
+    def __init__(self, errors=0, failed=()):
+        self.errors = errors
+        self.failed = list(failed)
+        self.deleted = []
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        if self.errors:
+            self.errors -= 1
+            raise RuntimeError("throttled")
+        failed = [f for f in self.failed if int(f["Id"]) < len(Entries)]
+        self.failed = []
+        bad = {f["Id"] for f in failed}
+        self.deleted += [e["ReceiptHandle"] for e in Entries if e["Id"] not in bad]
+        return {"Failed": failed}
+
+
+def test_ack_batcher_retries_a_failed_batch(monkeypatch):
+    fake = _FlakySqs(errors=1)
+    monkeypatch.setattr(app, "sqs", fake)
+
+    async def run():
+        acks = app.SqsAckBatcher()
+        acks.ack("h1")
+        acks.ack("h2")
+        await acks.flush()
+        assert fake.deleted == []
+        await acks.flush()
+        return acks
+
+    acks = asyncio.run(run())
+    assert fake.deleted == ["h1", "h2"]
+    assert acks._pending == []
+
+
+def test_ack_batcher_drops_sender_faults_and_gives_up(monkeypatch):
+    fake = _FlakySqs(failed=[{"Id": "0", "Code": "ReceiptHandleIsInvalid", "SenderFault": True}],
+                     errors=0)
+    monkeypatch.setattr(app, "sqs", fake)
+    monkeypatch.setattr(app, "SQS_DELETE_ATTEMPTS", 2)
+
+    async def run():
+        acks = app.SqsAckBatcher()
+        acks.ack("stale")
+        acks.ack("ok")
+        await acks.flush()
+        assert acks._pending == []  # a stale receipt is not retried
+        fake.errors = 5
+        acks.ack("h3")
+        await acks.flush()
+        await acks.flush()
+        return acks
+
+    acks = asyncio.run(run())
+    assert fake.deleted == ["ok"]
+    assert acks._pending == []  # gave up after SQS_DELETE_ATTEMPTS flushes
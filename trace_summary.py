@@ -0,0 +1,132 @@
+"""
+Summarise the OTLP/JSON trace files written by app.py (TRACE_EXPORT_PATH).
+
+    python trace_summary.py /tmp/cfx-traces.jsonl
+    python trace_summary.py '/tmp/cfx-traces.jsonl*' --root record --top 20
+
+Each record's root span is split along its critical path (walking back from the end,
+always into the child span that finished last), so the time of every stage adds up to
+the record's wall time. Stages are ranked by their share of total wall time across the
+run, alongside their call count and inclusive p50/p95 durations.
+"""
+import json, glob, argparse
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+
+class _Span:
+    def __init__(self, d: dict):
+        self.trace_id = d["traceId"]
+        self.span_id = d["spanId"]
+        self.parent_id = d.get("parentSpanId") or None
+        self.name = d["name"]
+        self.start = int(d["startTimeUnixNano"])
+        self.end = int(d["endTimeUnixNano"])
+        self.error = (d.get("status") or {}).get("code") == 2
+
+
+def load_spans(paths: List[str]) -> Dict[str, Dict[str, _Span]]:
+    """traceId -> spanId -> span, merged over every file and line."""
+    traces: Dict[str, Dict[str, _Span]] = defaultdict(dict)
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        doc = json.loads(line)
+                    except ValueError:
+                        continue
+                    for rs in doc.get("resourceSpans", []):
+                        for ss in rs.get("scopeSpans", []):
+                            for d in ss.get("spans", []):
+                                span = _Span(d)
+                                traces[span.trace_id][span.span_id] = span
+    return traces
+
+
+def critical_path(span: _Span, children: Dict[str, List[_Span]], until: int, out: Dict[str, int]):
+    """Attribute [span.start, until] to the spans on its critical path, adding ns per name to `out`."""
+    t = until
+    for child in sorted(children.get(span.span_id, []), key=lambda c: c.end, reverse=True):
+        if child.start >= t:
+            continue  # entirely after the part of the path still to explain
+        child_end = min(child.end, t)
+        start = max(child.start, span.start)
+        out[span.name] += max(0, t - child_end)
+        critical_path(child, children, child_end, out)
+        t = start
+        if t <= span.start:
+            break
+    out[span.name] += max(0, t - span.start)
+
+
+def _percentile(values: List[int], q: float) -> Optional[int]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(traces: Dict[str, Dict[str, _Span]], root_name: Optional[str]) -> dict:
+    crit: Dict[str, int] = defaultdict(int)
+    durations: Dict[str, List[int]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    wall, roots = 0, 0
+    for spans in traces.values():
+        children: Dict[str, List[_Span]] = defaultdict(list)
+        for s in spans.values():
+            if s.parent_id in spans:
+                children[s.parent_id].append(s)
+        for s in spans.values():
+            if s.parent_id in spans or (root_name and s.name != root_name):
+                continue
+            roots += 1
+            wall += s.end - s.start
+            critical_path(s, children, s.end, crit)
+            # Inclusive durations for every span under this root
+            stack = [s]
+            while stack:
+                cur = stack.pop()
+                durations[cur.name].append(cur.end - cur.start)
+                errors[cur.name] += cur.error
+                stack.extend(children.get(cur.span_id, []))
+    return {"roots": roots, "wall_ns": wall, "critical_ns": crit, "durations": durations, "errors": errors}
+
+
+def print_summary(summary: dict, top: int):
+    wall = summary["wall_ns"] or 1
+    print(f"traces: {summary['roots']}   wall time: {summary['wall_ns'] / 1e9:.1f}s")
+    print(f"{'stage':<32}{'share':>8}{'crit s':>10}{'count':>8}{'p50 s':>9}{'p95 s':>9}{'errors':>8}")
+    ranked = sorted(summary["critical_ns"].items(), key=lambda kv: kv[1], reverse=True)
+    for name, ns in ranked[:top]:
+        d = summary["durations"].get(name, [])
+        p50, p95 = _percentile(d, 0.5), _percentile(d, 0.95)
+        print(f"{name:<32}{ns / wall * 100:>7.1f}%{ns / 1e9:>10.1f}{len(d):>8}"
+              f"{(p50 or 0) / 1e9:>9.2f}{(p95 or 0) / 1e9:>9.2f}{summary['errors'].get(name, 0):>8}")
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("paths", nargs="+", help="trace files or glob patterns (worker files end in .workerN)")
+    ap.add_argument("--root", default="record", help="root span name to summarise ('' = every root)")
+    ap.add_argument("--top", type=int, default=30)
+    ap.add_argument("--json", action="store_true", help="print the summary as JSON instead of a table")
+    args = ap.parse_args(argv)
+
+    summary = summarize(load_spans(args.paths), args.root or None)
+    if args.json:
+        print(json.dumps({
+            "roots": summary["roots"],
+            "wall_s": summary["wall_ns"] / 1e9,
+            "stages": [
+                {"name": name, "share": ns / (summary["wall_ns"] or 1), "critical_s": ns / 1e9,
+                 "count": len(summary["durations"].get(name, [])), "errors": summary["errors"].get(name, 0)}
+                for name, ns in sorted(summary["critical_ns"].items(), key=lambda kv: kv[1], reverse=True)
+            ],
+        }, indent=2))
+    else:
+        print_summary(summary, args.top)
+
+
+if __name__ == "__main__":
+    main()